@@ -21,6 +21,7 @@ import os
 from utils.logging import logger
 from dotenv import dotenv_values
 from utils import log
+from google_cloud_functions.warmup import WARM_UP, WARMUP_ON_START
 
 app = Flask(__name__)
 
@@ -36,6 +37,13 @@ def hello() -> str:
     return "Hello, World!"
 
 
+@app.route("/readyz")
+def readyz() -> tuple:
+    # 503 until the startup warm-up has finished, so Cloud Run's startup probe holds traffic back until then
+    status = WARM_UP.status()
+    return (status, 200 if status['ready'] else 503)
+
+
 @app.route("/wait_sec")
 def wait_sec() -> str:
     logger.info(logField="custom-entry", called_route="wait_sec")
@@ -79,7 +87,9 @@ def shutdown_handler(signal_int: int, frame: FrameType) -> None:
     logger.info(f"Caught Signal {signal.strsignal(signal_int)}")
 
     from utils.logging import flush
+    from resources.azure_client import close_shared_clients
 
+    close_shared_clients()
     flush()
 
     # Safely exit program
@@ -95,3 +105,6 @@ if __name__ == "__main__":
 else:
     # handles Cloud Run container termination
     signal.signal(signal.SIGTERM, shutdown_handler)
+
+if WARMUP_ON_START:
+    WARM_UP.start()
@@ -0,0 +1,73 @@
+# Async serving mode: gunicorn --worker-class uvicorn_worker.UvicornWorker asgi:app
+#
+# The LLM backed endpoints and /wait_sec are coroutines here, so a conversation waiting on Azure OpenAI
+# holds no worker thread and one instance serves as many concurrent conversations as Cloud Run's
+# concurrency setting lets through. Every other route is served by the Flask app, mounted as is.
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+from a2wsgi import WSGIMiddleware
+import google_cloud_functions
+from resources import await_async
+from resources.azure_client import close_shared_clients
+from resources.streaming import EventStream
+from utils import RequestData
+from utils.logging import logger, flush
+from app import app as flask_app
+
+ALL_METHODS = ['GET', 'POST', 'OPTIONS']
+
+
+def to_response(result: Any) -> Response:
+    '''Turns a handler's Flask style return value, a body or a (body, status, headers) tuple, into a Starlette response.'''
+    body, status, headers = result, 200, None
+    if isinstance(result, tuple):
+        body, status, headers = (tuple(result) + (200, None))[:3]
+    if isinstance(body, EventStream):
+        return StreamingResponse(body, status_code=status, headers=headers, media_type='text/event-stream')
+    if isinstance(body, (dict, list)):
+        # Flask's JSON provider, so both apps serialize bodies (dates included) the same way
+        return Response(flask_app.json.dumps(body), status_code=status, headers=headers, media_type='application/json')
+    return Response(body, status_code=status, headers=headers, media_type='text/html')
+
+
+def llm_route(name: str, handler: Callable[[RequestData], Awaitable[Any]]) -> Callable[[Request], Awaitable[Response]]:
+    async def endpoint(request: Request) -> Response:
+        logger.info(logField="custom-entry", called_route=name)
+        # The handler runs on the Azure OpenAI loop that owns the shared clients, this loop just awaits it
+        return to_response(await await_async(handler(await RequestData.from_starlette(request))))
+    return endpoint
+
+
+async def wait_sec(request: Request) -> Response:
+    logger.info(logField="custom-entry", called_route="wait_sec")
+    return to_response(await google_cloud_functions.copilot_wait_sec_async(await RequestData.from_starlette(request)))
+
+
+async def ms_teams_error_messenger(request: Request) -> Response:
+    logger.info(logField="custom-entry", called_route="ms_teams_error_messenger")
+    # pymsteams only has a blocking client
+    request_data = await RequestData.from_starlette(request)
+    return to_response(await asyncio.to_thread(google_cloud_functions.ms_teams_error_messenger, request_data))
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette) -> AsyncIterator[None]:
+    yield
+    # uvicorn handles SIGTERM itself, so app.py's shutdown_handler doesn't run in this mode
+    await asyncio.to_thread(close_shared_clients)
+    flush()
+
+
+app = Starlette(lifespan=lifespan, routes=[
+    Route("/clarify_issue", llm_route("clarify_issue", google_cloud_functions.clarify_issue_async), methods=ALL_METHODS),
+    Route("/dynamic_qna", llm_route("dynamic_qna", google_cloud_functions.dynamic_qna_async), methods=ALL_METHODS),
+    Route("/wait_sec", wait_sec),
+    Route("/ms_teams_error_messenger", ms_teams_error_messenger),
+    # The remaining Flask routes are quick, its thread pool keeps the default 10 workers
+    Mount("/", app=WSGIMiddleware(flask_app))])
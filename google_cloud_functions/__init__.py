@@ -1,15 +1,18 @@
 
-from .copilot_wait_sec.main import copilotWaitSec
+from .copilot_wait_sec.main import copilotWaitSec, copilot_wait_sec_async
 from .ms_teams_messenger.main import ms_teams_error_messenger
 from .set_copilot_monitor_flag.main import set_copilot_postman_monitor_flag
 from .top_topic_intents.main import getIntents
-from .clarify_issue.main import clarify_issue
-from .dynamic_qna.main import dynamic_qna
+from .clarify_issue.main import clarify_issue, clarify_issue_async
+from .dynamic_qna.main import dynamic_qna, dynamic_qna_async
 
 
 __all__ = [
     "copilotWaitSec", 
+    "copilot_wait_sec_async", 
     "ms_teams_error_messenger", 
     "set_copilot_postman_monitor_flag", 
     "getIntents", "clarify_issue", 
-    "dynamic_qna"]
+    "dynamic_qna", 
+    "clarify_issue_async", 
+    "dynamic_qna_async"]
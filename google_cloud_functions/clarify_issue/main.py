@@ -1,14 +1,27 @@
-from google.cloud import firestore
 from firebase_admin import credentials, initialize_app
 import functions_framework
 from dataclasses import field
 from enum import Enum
-from pydantic import BaseModel
-from openai import AsyncAzureOpenAI
-from typing import Any, List, Optional
+from pydantic import BaseModel, PrivateAttr, TypeAdapter
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 import asyncio
+import itertools
+import threading
 import os
-from models import FBTopicList
+from models import FBTopicList, IssueIndex
+from utils.cache import TTLCache
+from utils.prompt_templates import prompt_template_cache
+from utils.firestore_clients import firestore_client
+from utils.http import RequestData
+from resources.azure_client import run_async, shared_chat_client
+from resources.embeddings import candidate_ranker
+from resources.structured_completions import StructuredCompletions
+from resources.subtopic_instructions import SubtopicInstructions
+from resources.candidate_questions import ResponsePath
+from resources.deployments import shared_deployment_pool
+from resources.rate_limits import LoadShedError, shed_response
+from resources.streaming import SSE_HEADERS, EventStream, StreamedQuestions, wsgi_response
 
 try:
     cred = credentials.ApplicationDefault()
@@ -44,6 +57,9 @@ class BuildEnv(Enum):
     def _missing_(cls, value):
         return cls.dev
 
+# The env this instance is deployed for: requests that don't name an env are served from it, and warm-up preloads it
+BUILD_ENV = os.environ.get('BUILD_ENV', BuildEnv.dev.value).lower()
+
 class FBCollection(Enum):
     azure_data = "azure_data"
     
@@ -54,9 +70,9 @@ class EnvConfig:
     firebase_prefix: str # dev_, stage_ or prod_
     project_id: str # homekeep-dev-1614708479592
     
-    def __init__(self, env: Optional[str]="dev") -> None:
+    def __init__(self, env: Optional[str]=BUILD_ENV) -> None:
         
-        self.build_env = BuildEnv(env.upper() if env else "DEV")
+        self.build_env = BuildEnv(env.upper() if env else BUILD_ENV.upper())
         log(assigning_build_env=self.build_env.value)
         
         match self.build_env:
@@ -98,6 +114,8 @@ class IssueTrainingModel(BaseModel):
     subchapter: Optional[int] = 0
     subtopics: list = field(default_factory=list)
     
+TOPIC_MODEL_VERSIONS = itertools.count(1)
+
 class TopicTrainingModel(BaseModel): 
     issues: list[Any] = []
     topic_id: str
@@ -105,6 +123,52 @@ class TopicTrainingModel(BaseModel):
     additional_notes: Optional[str] = ''
     additional_topic_info: Optional[str] = ''
     system_instructions: list[Any]  = []
+    _issue_index: Optional[IssueIndex] = PrivateAttr(default=None)
+    # Unique per loaded topic doc, anything derived from the issues (e.g. prompt templates) is keyed by it
+    _version: int = PrivateAttr(default_factory=lambda: next(TOPIC_MODEL_VERSIONS))
+    
+    @property
+    def version(self) -> int:
+        return self._version
+    
+    def index_issues(self) -> IssueIndex:
+        self._issue_index = IssueIndex(self.issues)
+        self._version = next(TOPIC_MODEL_VERSIONS)
+        return self._issue_index
+    
+    def issue_index(self) -> IssueIndex:
+        return self._issue_index if self._issue_index is not None else self.index_issues()
+
+
+# Local fast path: skip the model when the subtopic has at most this many flows...
+CLARIFY_FAST_PATH_MAX_ISSUES = int(os.environ.get('CLARIFY_FAST_PATH_MAX_ISSUES', 3))
+# ...or the best local match scores at least this many times the runner up. 0 disables the dominance check
+CLARIFY_FAST_PATH_DOMINANCE = float(os.environ.get('CLARIFY_FAST_PATH_DOMINANCE', 2.0))
+CLARIFY_FAST_PATH_MAX_ANSWERS = int(os.environ.get('CLARIFY_FAST_PATH_MAX_ANSWERS', 3))
+
+# Topic docs change weekly: serve from memory for the TTL, then serve stale while one background load revalidates.
+# Snapshot listeners invalidate an entry as soon as the topic or one of its issue collections changes.
+FIRESTORE_TOPICS_TTL_SEC = float(os.environ.get('FIRESTORE_TOPICS_TTL_SEC', 600))
+FIRESTORE_TOPICS_STALE_SEC = float(os.environ.get('FIRESTORE_TOPICS_STALE_SEC', 3600))
+FIRESTORE_TOPICS_LISTEN = os.environ.get('FIRESTORE_TOPICS_LISTEN', '1') == '1'
+
+# Keyed by (project, collection, topic), shared by every request in the process
+TOPIC_CACHE: TTLCache[Tuple[str, str, str], TopicTrainingModel] = TTLCache(
+    name='firestore_topics', ttl=FIRESTORE_TOPICS_TTL_SEC, stale_ttl=FIRESTORE_TOPICS_STALE_SEC)
+TOPIC_LISTENERS: Dict[Tuple[str, str, str], List[Any]] = {}
+TOPIC_LISTENERS_LOCK = threading.Lock()
+# Static prompt instructions per (topic doc version, copilot, subtopic, limit_request)
+PROMPT_TEMPLATES = prompt_template_cache('clarify_issue_prompt_templates')
+
+
+# Subcollection reads run in parallel, shared by all requests so a burst of cold topics can't open unbounded streams
+FIRESTORE_FETCH_WORKERS = int(os.environ.get('FIRESTORE_FETCH_WORKERS', 8))
+ISSUE_FETCH_EXECUTOR = ThreadPoolExecutor(max_workers=FIRESTORE_FETCH_WORKERS, thread_name_prefix='firestore-issues')
+ISSUES_ADAPTER = TypeAdapter(List[IssueTrainingModel])
+
+
+def _stream_issue_dicts(issues_collection) -> List[dict]:
+    return [issue_doc.to_dict() for issue_doc in issues_collection.stream()]
 
 
 class FireStoreTopics:
@@ -113,22 +177,75 @@ class FireStoreTopics:
         self.env_config: EnvConfig = EnvConfig(env)
         self.topic = topic.lower()
         self.firestore_topic = FBTopicList(self.topic)
-        self.db = firestore.Client(project=self.env_config.project_id)
+        self.db = firestore_client(self.env_config.project_id)
         self.topic_model = None
         
+    @property
+    def cache_key(self) -> Tuple[str, str, str]:
+        return (self.env_config.project_id, self.env_config.collection(FBCollection.azure_data), self.firestore_topic.value)
+        
     def get_topic_doc(self, env: Optional[str]=None):
-        azure_data_ref = self.db.collection(self.env_config.collection(FBCollection.azure_data)).document(self.firestore_topic.value).get()
-        self.topic_model = TopicTrainingModel.model_validate(azure_data_ref.to_dict())
-        self.topic_model.issues = self._get_topic_issues()
+        '''
+        Returns the topic with its issues from TOPIC_CACHE, reading Firestore only on a miss.
+        A refreshed topic replaces the cached one as a whole, so in-flight requests keep the model they started with.
+        The returned model is shared, treat it as read-only.
+        '''
+        self.topic_model = TOPIC_CACHE.get(self.cache_key, self._load_topic_doc)
+        self._listen()
         return self.topic_model
     
+    def _topic_ref(self):
+        return self.db.collection(self.env_config.collection(FBCollection.azure_data)).document(self.firestore_topic.value)
+    
+    def _load_topic_doc(self) -> TopicTrainingModel:
+        azure_data_ref = self._topic_ref().get()
+        topic_model = TopicTrainingModel.model_validate(azure_data_ref.to_dict())
+        topic_model.issues = self._get_topic_issues()
+        topic_model.index_issues()
+        return topic_model
+    
+    def _listen(self) -> None:
+        '''Attaches the invalidation listeners once per cache key.'''
+        key = self.cache_key
+        if not FIRESTORE_TOPICS_LISTEN or key in TOPIC_LISTENERS:
+            return
+        with TOPIC_LISTENERS_LOCK:
+            if key in TOPIC_LISTENERS:
+                return
+            TOPIC_LISTENERS[key] = []
+            try:
+                topic_ref = self._topic_ref()
+                TOPIC_LISTENERS[key].append(topic_ref.on_snapshot(self._on_topic_change()))
+                for issues_collection in topic_ref.collections():
+                    TOPIC_LISTENERS[key].append(issues_collection.on_snapshot(self._on_topic_change()))
+            except Exception as err:
+                # Without listeners the TTL alone bounds staleness
+                log(firestore_listener_failed=key, error=err)
+    
+    def _on_topic_change(self):
+        key = self.cache_key
+        load = self._load_topic_doc
+        initial_snapshot = [True]
+        
+        def on_snapshot(snapshots, changes, read_time) -> None:
+            # Every listener first delivers the current state, which the cache already holds
+            if initial_snapshot[0]:
+                initial_snapshot[0] = False
+                return
+            log(firestore_topic_changed=key, read_time=read_time)
+            TOPIC_CACHE.invalidate(key)
+            TOPIC_CACHE.refresh(key, load)
+        return on_snapshot
+    
     def _get_topic_issues(self, env: Optional[str]=None):
-        issues: List[IssueTrainingModel] = []
-        azure_data_ref = self.db.collection(self.env_config.collection(FBCollection.azure_data)).document(self.firestore_topic.value).collections()    
-        for issues_collection in azure_data_ref:
-            for issue_doc in issues_collection.stream():
-                issues.append(IssueTrainingModel.model_validate(issue_doc.to_dict()))
-        log(found_issues=len(issues))
+        '''
+        Streams every issue subcollection concurrently (bounded by FIRESTORE_FETCH_WORKERS across the process),
+        then validates all issue docs in one pass once the reads are done.
+        '''
+        issues_collections = list(self._topic_ref().collections())
+        issue_batches = ISSUE_FETCH_EXECUTOR.map(_stream_issue_dicts, issues_collections)
+        issues: List[IssueTrainingModel] = ISSUES_ADAPTER.validate_python([issue for batch in issue_batches for issue in batch])
+        log(found_issues=len(issues), issue_collections=len(issues_collections))
         return issues
     
 def log(new_line: bool = False, *args, **kwargs) -> None:
@@ -205,6 +322,7 @@ class CopilotAnswerFormat(BaseModel):
 class CopilotQuestionFormat(BaseModel):
     question_text: str
     copilot_answer_set: List[CopilotAnswerFormat]
+    served_by: str = ResponsePath.llm.value
 
 class AIResponseFormatModel(BaseModel): 
     question_model: Optional[QuestionFormatModel]
@@ -224,205 +342,56 @@ class CopilotResponse:
 
 
 
-class AIResource:
+class AIResource(StructuredCompletions):
     '''
     https://learn.microsoft.com/en-us/azure/ai-services/openai/how-to/structured-outputs?tabs=python
     '''
     connected: bool = False
+    response_model = AIResponseFormatModel
     
     def __init__(self, env_config: EnvConfig, system_instructions: List[str] | None = None) -> None:
         self.system_instructions: List[str] | None = system_instructions
         self.env_config = env_config
         try:
-            self.chat_client = AsyncAzureOpenAI(
-                api_key=self.env_config.azure_ai_api_key,  
-                api_version=self.env_config.azure_ai_version,
-                azure_endpoint=self.env_config.azure_ai_endpoint, 
-                max_retries=2
-            )
+            # Shared by every request, run its coroutines with run_async
+            self.chat_client = shared_chat_client(self.env_config)
+            self.deployments = shared_deployment_pool(self.env_config, self.env_config.azure_ai_model_name)
         except:
             self.connected = False
         else:
             self.connected = True
-    async def assign_system_instruction_set(self, system_instructions: List[str], topic_instructions: Optional[List[str]] = None):
-                
-        self.system_instructions = system_instructions
-            
-        log(processing_system_instructions='...')
-        ai_response = self.chat_client.beta.chat.completions.stream(
-            model=self.env_config.azure_ai_model_name,
-            messages=[
-                {"role": "system",
-                "content": ' '.join(system_instructions)},
-                {"role": "system",
-                "content": ' '.join(topic_instructions if topic_instructions else [""])}]
-            )
-        return
+
+    @property
+    def model_name(self) -> str:
+        return self.env_config.azure_ai_model_name
 
     def assign_system_instructions(self, system_instructions: List[str]):
-                
+        
         self.system_instructions = system_instructions
-            
-        ai_response = self.chat_client.beta.chat.completions.parse(
-            model=self.env_config.azure_ai_model_name,
-            messages=[
-                {"role": "system",
-                "content": ' '.join(system_instructions)},]
-            )
-        return
+
+    # clarify_issue's callers name the system prompt `system_instructions`
+    async def warm_prompt_cache(self, system_instructions: List[str], topic_instructions: Optional[List[str]] = None) -> bool:
+        return await super().warm_prompt_cache(system_instructions, topic_instructions)
 
     async def get_typed_structured_response(self, user_prompt: List[str], system_instructions: List[str] = [], response_format: type = AIResponseFormatModel) -> Any | None:
-        """
-        Generatively fills request model, requires first providing the model to be filled.
+        return await super().get_typed_structured_response(user_prompt, system_instructions, response_format)
 
-        Args:
-            system_prompt (List[str]): The initial instructions if different than the provided instruction used for class instantiation. Joins to one string 
-            user_prompt (List[str]): The current input to be processed. Joins to one string
-            response_format (type): The object to be generatively filled
-            
-        Returns:
-            AIResponseFormatModel | None: The model format to be returned, wherein some or all is generatively filled
-        """
-        if self.connected:
-            self.assign_system_instructions(system_instructions=system_instructions)
-            ai_response = await self.chat_client.beta.chat.completions.parse(
-                model=self.env_config.azure_ai_model_name,
-                messages=[
-                    {"role": "system",
-                    "content": ' '.join(system_instructions)},
-                    {"role": "user",
-                    "content": ' '.join(user_prompt)},],
-                response_format=response_format
-                )
-            return ai_response.choices[0].message.parsed
-            # print(ai_response)
-        else:
-            return None
-        
-            
-    async def get_structured_response(self, user_prompt: List[str], system_instructions: List[str] = [], topic_instructions: List[str] = []) -> AIResponseFormatModel | None:
-        """
-        Generatively fills request model, requires first providing the model to be filled.
-
-        Args:
-            system_prompt (List[str]): The initial instructions if different than the provided instruction used for class instantiation. Joins to one string 
-            user_prompt (List[str]): The current input to be processed. Joins to one string
-
-        Returns:
-            AIResponseFormatModel | None: The model format to be returned, wherein some or all is generatively filled
-        """
-        if self.connected:
-            self.assign_system_instructions(system_instructions=system_instructions)
-            ai_response = await self.chat_client.beta.chat.completions.parse(
-                model=self.env_config.azure_ai_model_name,
-                messages=[
-                    {"role": "system",
-                    "content": ' '.join(topic_instructions)},
-                    {"role": "system",
-                    "content": ' '.join(system_instructions)},
-                    {"role": "user",
-                    "content": ' '.join(user_prompt)},],
-                response_format=AIResponseFormatModel # Describes the object format to be returned form the AI model.
-                )
-            asyncio.ensure_future(self.chat_client.close())
-            return ai_response.choices[0].message.parsed
-        else:
-            return None
-        
-    async def get_chat_response(self, system_prompt: List[str], user_prompt: List[str]) -> str:
-        """
-        Basic question & typed chat completion
-
-        Args:
-            system_prompt (List[str]): The initial instructions if different than the provided instruction used for class instantiation. Joins to one string 
-            user_prompt (List[str]): The current input to be processed. Joins to one string
-
-        Returns:
-            str: Generative response from the Azure AI model given the user input and system instructions
-        """
-        if self.connected:
-            self.assign_system_instructions(system_instructions=system_prompt)
-            ai_response = await self.chat_client.chat.completions.create(
-                model=self.env_config.azure_ai_model_name,
-                messages=[    
-                    {"role": "system",
-                    "content": ' '.join(system_prompt)},
-                    {"role": "user",
-                    "content": ' '.join(user_prompt)},]
-                )
-            response_text = ai_response.choices[0].message.content.__str__()
-            return response_text.encode('utf-8').decode('unicode-escape')
-        else:
-            return 'NA'
-    
+    async def get_structured_response(self, user_prompt: List[str], system_instructions: List[str] = [], topic_instructions: List[str] = [], context_instructions: List[str] = []) -> AIResponseFormatModel | None:
+        return await super().get_structured_response(user_prompt, system_instructions, topic_instructions, context_instructions)
 
-class SystemInstructionsCreator:
-    def __init__(self, copilot: str, subtopic: str, topic_training_data: TopicTrainingModel, limit_request: bool = True):
-        try:
-            self.copilot: str = copilot # Ex: 'interior_climate_control'
-            self.subtopic: str = subtopic # Ex: 'heating_and_cooling_systems'
-            self.topic: str = topic_training_data.topic if topic_training_data.topic else "" # Ex: 'Interior Climate Control'
-        except Exception:
-            pass
-        
-        self.limit_request = limit_request
-        self.topic_training_data = topic_training_data
-        self.matching_subtopic_issues = []
-        
-        for issue in self.topic_training_data.issues:
-            if self.subtopic in issue.subtopics and not self.limit_request:
-                issue_str = issue.__dict__.__str__() + "\n\n"
-                self.matching_subtopic_issues.append(issue_str)
-            elif self.subtopic in issue.subtopics:
-                if issue and issue.observation and issue.associated_copilot_flow:
-                    self.matching_subtopic_issues.append({"associated_copilot_flow": issue.associated_copilot_flow, "observation": issue.observation, "issue_number": issue.issue_number})
-            else:
-                pass
-    
-    def base_system_instructions(self):
-        
-        instructions: List[str] = [
-            'Consider this list, which will be referred to as: \'topic_list\', which is a list of issues in which the \'observation\' is a basic description of a homeowners issue: \n{}.'.format(self.matching_subtopic_issues),
-            'The user will submit an issue related to their residential home, which the \'topic_list\' will be used to determine if the issue is warrantable',
-            'Any system instructions which includes something like: \'some_variable\', is referencing a field that will be assigned.',
-            'Assume the user\'s issue relates to their home\'s {0} and all responses should be structured around a residential home\'s {1}.'.format(self.topic, self.subtopic),
-            ]
-        instructions.append(self.topic_training_data.additional_topic_info if self.topic_training_data.additional_topic_info else '')
-        return instructions
-    
-    def redirect_issue_instructions(self):
-        
-        instructions: List[str] = [
-            "Consider this list of common homeowner issue descriptions: {}.".format(self.matching_subtopic_issues.__str__()),
-            "Each \'associated_copilot_flow\' will have a basic general description as the \'observation\' value.",
-            "Compare the user's input against: \'observation\' and assign: \'closest_matching_copilot_flow\' as the value: \'associated_copilot_flow\' of the same object, which contains the closes matching description.",
-            "Always assign a value.",
-            "Assume the user's issue is related to their home's {0}, specifically {1}".format(self.topic, self.subtopic)]
-        return instructions
+    def stream_structured_response(self, user_prompt: List[str], system_instructions: List[str] = [], topic_instructions: List[str] = [], context_instructions: List[str] = []) -> AsyncIterator[Tuple[Dict[str, Any], Optional[AIResponseFormatModel]]]:
+        return super().stream_structured_response(user_prompt, system_instructions, topic_instructions, context_instructions)
+    
 
-    def alternative_topics_instructions(self):
-        
-        instructions: List[str] = [
-            "Consider this list of common homeowner issue descriptions: {}.".format(self.matching_subtopic_issues.__str__()),
-            "Each \'associated_copilot_flow\' will have a basic general description as the \'observation\' value.",
-            "Compare the user's input against: \'observation\' and assign: \'closest_matching_copilot_flow\' as the value: \'associated_copilot_flow\' of the same object, which contains the closes matching description.",
-            "Always assign a value.",
-            "Assume the user's issue is related to their home's {0}, specifically {1}".format(self.topic, self.subtopic)]
-        
-        return instructions
+class SystemInstructionsCreator(SubtopicInstructions):
+    templates = PROMPT_TEMPLATES
     
-    def clarifyUserIssueInstructions(self) -> List[str]:
-        
-        instructions: List[str] = [
-            'Assign \'question_model\' using a clarifying question as \'question_text\' and the relative multiple choice answers to the question as \'answer_set\'.',
-            'The \'question_text\' should be formed to include the issue\'s topic: {0}, and this subtopic: {1} and addressing the user\'s issue.'.format(self.topic, self.subtopic),
-            'The goal is to determine which topic most closely matches the user\'s issue.',
-            'Never include an answer being some form of the following; \'Other\', \'Not Certain\' or \'None\' as one of the \'answer_set\' answers.',
-            'The amount of answers in \'answer_set\' should be between 2 to 5 answers, which prioritize answers clarifying the related topic observation the most. It\'s preferable that there would be more answers, up to 5.',
-            'Each \'answer_text\' values should only be a couple words long, maximum 4.',
-            'Assign each \'answer_set\' value: \'associated_copilot_flow\' as the closest matching value for the field: \'associated_copilot_flow\' from each object from the \'topic_list\'.',
-        ]
-        return instructions
+    @property
+    def template_key(self) -> Tuple:
+        return (self.topic_training_data.version, self.copilot, self.subtopic, self.limit_request)
+    
+    def alternative_topics_instructions(self):
+        return self.redirect_issue_instructions()
 
 class DynamicQnA:
     
@@ -441,54 +410,94 @@ class DynamicQnA:
         self.firestore_app = FireStoreTopics(env=self.env, topic=self.topic)
         self.topic_training_data: TopicTrainingModel = self.firestore_app.get_topic_doc()
         self.limit_request: bool = limit_request
-        self.instructions_model = SystemInstructionsCreator(copilot=self.copilot, subtopic=self.subtopic, topic_training_data=self.topic_training_data)
-        
-    async def _cold_start_instructions(self, system_instructions: List[str] = [], topic_instructions: List[str] = []):
+        self.instructions_model = SystemInstructionsCreator(copilot=self.copilot, subtopic=self.subtopic, topic_training_data=self.topic_training_data, user_input=self.user_input)
         
-        if not system_instructions:
-            system_instructions = self.instructions_model.base_system_instructions()
-            
-        asyncio.ensure_future(self.ai_resource.assign_system_instruction_set(system_instructions=system_instructions))
-        return
-    
-    def _start_conversation(self, topic_instructions: List[str]):
+    async def cold_start(self) -> bool:
+        '''
+        Copilot's cold start ping: connects to the Azure endpoint and warms the prompt cache
+        with this copilot and subtopic's stable prefix, so the clarify call that follows starts warm.
+        '''
+        return await self.ai_resource.warm_prompt_cache(
+            system_instructions=self.instructions_model.base_system_instructions(),
+            topic_instructions=self.instructions_model.clarifyUserIssueInstructions())
+    
+    async def _start_conversation(self, topic_instructions: List[str]):
         
         if self.user_input:
-            response = self._get_structured_response(system_instructions=self.instructions_model.base_system_instructions(), topic_instructions=topic_instructions)
+            response = await self._get_structured_response(system_instructions=self.instructions_model.base_system_instructions(), topic_instructions=topic_instructions)
             return response
-        
-        else:
-            self._cold_start_instructions
             
-    def _get_structured_response(self, topic_instructions: List[str], system_instructions: Optional[List[str]]) -> AIResponseFormatModel | None:
+    async def _get_structured_response(self, topic_instructions: List[str], system_instructions: Optional[List[str]]) -> AIResponseFormatModel | None:
         
         if not system_instructions:
             system_instructions = self.instructions_model.base_system_instructions()
         if self.user_input:
-            ai_response: AIResponseFormatModel | None = asyncio.run(
-                self.ai_resource.get_structured_response(
+            ai_response: AIResponseFormatModel | None = await self.ai_resource.get_structured_response(
                     system_instructions=system_instructions, 
                     user_prompt=[self.user_input], 
-                    topic_instructions=topic_instructions)
-                )
+                    topic_instructions=topic_instructions,
+                    context_instructions=self.instructions_model.topic_list_instructions())
         return ai_response
     
     
-class ClarifyIssueCreator(DynamicQnA):
+class ClarifyIssueCreator(DynamicQnA, StreamedQuestions):
+    answer_format = CopilotAnswerFormat
+    question_format = CopilotQuestionFormat
+    model_answer_format = AnswerFormatModel
     
     def __init__(self, *args, **kwargs):
         
         super().__init__(*args, **kwargs)
         self.topic_instructions = self.instructions_model.clarifyUserIssueInstructions()
-        _pass = self._cold_start_instructions()
     
-    def start_conversation(self):
+    async def start_conversation(self):
         
-        response = self._start_conversation(topic_instructions=self.instructions_model.clarifyUserIssueInstructions())
+        # The local matcher may call the embedding endpoint synchronously, keep it off the event loop
+        local_response = await asyncio.to_thread(self.local_copilot_question)
+        if local_response:
+            return local_response
+        
+        try:
+            response = await self._start_conversation(topic_instructions=self.instructions_model.clarifyUserIssueInstructions())
+        except Exception as err:
+            if not self.can_fall_back(err):
+                raise
+            return await asyncio.to_thread(self.fallback_copilot_question, self.user_input, err)
         format_copilot_response: CopilotQuestionFormat = self.assign_copilot_question(ai_response=response)
         
         return format_copilot_response
     
+    def stream_conversation(self) -> AsyncIterator[str]:
+        '''`start_conversation` as server-sent events, see StreamedQuestions.'''
+        return self.stream_copilot_question(self.user_input, prepare=self.local_copilot_question)
+    
+    def local_copilot_question(self) -> Optional[CopilotQuestionFormat]:
+        '''
+        Answers without the Azure call when the local matcher is confident (see CLARIFY_FAST_PATH_*),
+        using the candidate issues' observations as answers and their flows as the Copilot redirects.
+        '''
+        candidates = self.instructions_model.subtopic_issues.confident_candidates(
+            user_input=self.user_input, 
+            max_issues=CLARIFY_FAST_PATH_MAX_ISSUES, 
+            dominance=CLARIFY_FAST_PATH_DOMINANCE, 
+            max_answers=CLARIFY_FAST_PATH_MAX_ANSWERS, 
+            ranker=candidate_ranker())
+        if not candidates or not self.topic_training_data.topic_id:
+            return None
+        log(served_by=ResponsePath.local.value, candidates=len(candidates))
+        return self.candidate_copilot_question(candidates)
+    
+    def fallback_candidates(self, user_input: Optional[str]) -> List[IssueTrainingModel]:
+        '''The confident local candidates when there are some, ranked without embeddings, the lexically best matching flows otherwise.'''
+        return self.instructions_model.subtopic_issues.confident_candidates(
+            user_input=user_input, 
+            max_issues=CLARIFY_FAST_PATH_MAX_ISSUES, 
+            dominance=CLARIFY_FAST_PATH_DOMINANCE, 
+            max_answers=CLARIFY_FAST_PATH_MAX_ANSWERS) or super().fallback_candidates(user_input)
+    
+    def question_topic(self) -> str:
+        return self.instructions_model.topic or self.topic
+    
     def _check_answer_index(self, question_model: QuestionFormatModel):
         
         index = 0
@@ -502,6 +511,17 @@ class ClarifyIssueCreator(DynamicQnA):
                 
         return question_model
     
+    def copilot_answer(self, item: AnswerFormatModel) -> Optional[CopilotAnswerFormat]:
+        
+        if not (item.associated_copilot_flow and self.topic_training_data.topic_id):
+            return None
+        return CopilotAnswerFormat(
+            DisplayName=item.answer_text, 
+            ExternalIntentId=item.associated_copilot_flow, 
+            Score=50, 
+            TopicId=self.topic_training_data.topic_id + ".topic." + item.associated_copilot_flow, 
+            TriggerId=item.associated_copilot_flow)
+    
     def assign_copilot_question(self, ai_response: Optional[AIResponseFormatModel]) -> CopilotQuestionFormat:
         
         copilot_answers: List[CopilotAnswerFormat] = []
@@ -512,14 +532,8 @@ class ClarifyIssueCreator(DynamicQnA):
             
             for item in ai_response.question_model.answer_set:
                 
-                if item.associated_copilot_flow and self.topic_training_data.topic_id:
-                    
-                    new_answer_set: CopilotAnswerFormat = CopilotAnswerFormat(
-                        DisplayName=item.answer_text, 
-                        ExternalIntentId=item.associated_copilot_flow, 
-                        Score=50, 
-                        TopicId=self.topic_training_data.topic_id + ".topic." + item.associated_copilot_flow, 
-                        TriggerId=item.associated_copilot_flow)
+                new_answer_set: Optional[CopilotAnswerFormat] = self.copilot_answer(item)
+                if new_answer_set:
                     copilot_answers.append(new_answer_set)
                     
             not_listed_answer_set = CopilotAnswerFormat(
@@ -544,6 +558,14 @@ def clarify_issue(request):
         * note: If a local process is still running on 8080
             * kill -9 $(lsof -i:8080 -t)
     """
+    return wsgi_response(run_async(clarify_issue_async(RequestData.from_flask(request))))
+
+
+async def clarify_issue_async(request: RequestData):
+    '''
+    The clarify_issue handler. Runs on the Azure OpenAI loop (AZURE_LOOP): the model calls are awaited,
+    Firestore and the local matcher run on worker threads, so a conversation waiting on the model holds no thread.
+    '''
     if request.method == "OPTIONS":
         headers = {
             # "Access-Control-Allow-Origin": "http://localhost:3050",
@@ -573,21 +595,25 @@ def clarify_issue(request):
                 log(env=clarify_issue_model.env, topic=clarify_issue_model.copilot)
                 
                 if clarify_issue_model and clarify_issue_model.copilot and clarify_issue_model.subtopic and clarify_issue_model.user_input:
-                    clarify_issue_resource = ClarifyIssueCreator(ai_resource=app, request=request)
-                    clarify_response = clarify_issue_resource.start_conversation()
+                    clarify_issue_resource = await asyncio.to_thread(ClarifyIssueCreator, ai_resource=app, request=request)
+                    if request.wants_event_stream:
+                        return (EventStream(clarify_issue_resource.stream_conversation()), 200, {**headers, **SSE_HEADERS})
+                    try:
+                        clarify_response = await clarify_issue_resource.start_conversation()
+                    except LoadShedError as err:
+                        return shed_response(err, headers)
                     
                     if clarify_response:
                         return (clarify_response.model_dump(), 200, headers)
                     else:
-                        _cold_start = clarify_issue_resource._cold_start_instructions()
                         return ({"response": "OK"}, 200, headers)
         case ResourceType.none | ResourceType.cold_start:
             
             request_model: CopilotRequest = RequestModel(request=request).request_model
             if request_model and request_model.copilot and request_model.subtopic:
-                question_creator_resource = DynamicQnA(ai_resource=app, request=request)
-                _cold_start = question_creator_resource._cold_start_instructions()
-                return ({"response": "OK"}, 200, headers)
+                question_creator_resource = await asyncio.to_thread(DynamicQnA, ai_resource=app, request=request)
+                warmed = await question_creator_resource.cold_start()
+                return ({"response": "OK", "warmed": warmed}, 200, headers)
             
         case _:
             
@@ -1,8 +1,9 @@
+import asyncio
 import datetime
 import time
 
 
-def copilotWaitSec(request):
+def _wait_seconds(request) -> float:
     request_json = request.get_json(silent=True)
     request_args = request.args
 
@@ -14,11 +15,26 @@ def copilotWaitSec(request):
         seconds = 1
     if seconds > 10 :
         seconds = 10
-    time.sleep(seconds)
+    return seconds
+
+
+def _finished(seconds: float) -> dict:
     start_time: datetime.datetime = datetime.datetime.today()
     finish_time: datetime.datetime = start_time + datetime.timedelta(seconds=seconds)
     print(float("0.1"))
 
     return {"finished": True, "start_time": start_time, "finish_time": finish_time}
 
-__all__ = ["copilotWaitSec"]
\ No newline at end of file
+
+def copilotWaitSec(request):
+    seconds = _wait_seconds(request)
+    time.sleep(seconds)
+    return _finished(seconds)
+
+
+async def copilot_wait_sec_async(request):
+    seconds = _wait_seconds(request)
+    await asyncio.sleep(seconds)
+    return _finished(seconds)
+
+__all__ = ["copilotWaitSec", "copilot_wait_sec_async"]
@@ -1,14 +1,16 @@
 from enum import Enum
 from pydantic import BaseModel
 from openai import AzureOpenAI, AsyncAzureOpenAI
-from typing import Any, List, Optional
+from typing import Any, AsyncIterator, List, Optional
 import asyncio
-from resources import AIResource
+from functools import partial
+from resources import AIResource, run_async
+from resources.rate_limits import LoadShedError, shed_response
+from resources.streaming import SSE_HEADERS, EventStream, StreamedQuestions, wsgi_response
 from .models import *
 from .instructions import SystemInstructionsCreator
 from .question_creator import QuestionCreator
-from utils import log
-from flask import Flask, request
+from utils import log, RequestData
 
 class FBCollection(Enum):
     azure_data = "azure_data"
@@ -38,36 +40,30 @@ class DynamicQnA:
         self.topic_training_data = TopicTrainingModel(copilot=self.copilot, subtopic=self.subtopic,)
         self.ai_resource: AIResource = ai_resource
         self.limit_request = limit_request
-        self.instructions_model = SystemInstructionsCreator(copilot=self.copilot, subtopic=self.subtopic, topic_training_data=self.topic_training_data)
+        self.instructions_model = SystemInstructionsCreator(copilot=self.copilot, subtopic=self.subtopic, topic_training_data=self.topic_training_data, user_input=self.user_input)
         
-    async def _cold_start_instructions(self, system_instructions: List[str] = [], topic_instructions: List[str] = []):
-        
-        if not system_instructions:
-            system_instructions = self.instructions_model.base_system_instructions()
-            
-        asyncio.ensure_future(self.ai_resource.assign_system_instruction_set(system_prompt=system_instructions))
-        return
+    async def cold_start(self) -> bool:
+        '''Connects to the Azure endpoint and warms the prompt cache with this copilot and subtopic's stable prefix.'''
+        return await self.ai_resource.warm_prompt_cache(
+            system_prompt=self.instructions_model.base_system_instructions(),
+            topic_instructions=self.instructions_model.clarifyUserIssueInstructions())
     
-    def _start_conversation(self, topic_instructions: List[str]):
+    async def _start_conversation(self, topic_instructions: List[str]):
         
         if self.user_input:
-            response = self._get_structured_response(system_instructions=self.instructions_model.base_system_instructions(), topic_instructions=topic_instructions)
+            response = await self._get_structured_response(system_instructions=self.instructions_model.base_system_instructions(), topic_instructions=topic_instructions)
             return response
-        
-        else:
-            self._cold_start_instructions
             
-    def _get_structured_response(self, topic_instructions: List[str], system_instructions: Optional[List[str]]) -> AIResponseFormatModel | None:
+    async def _get_structured_response(self, topic_instructions: List[str], system_instructions: Optional[List[str]]) -> AIResponseFormatModel | None:
         
         if not system_instructions:
             system_instructions = self.instructions_model.base_system_instructions()
         if self.user_input:
-            ai_response: AIResponseFormatModel | None = asyncio.run(
-                self.ai_resource.get_structured_response(
+            ai_response: AIResponseFormatModel | None = await self.ai_resource.get_structured_response(
                     system_prompt=system_instructions, 
                     user_prompt=[self.user_input], 
-                    topic_instructions=topic_instructions)
-                )
+                    topic_instructions=topic_instructions,
+                    context_instructions=self.instructions_model.topic_list_instructions())
         return ai_response
     
 class ClarifyIssueCreator(DynamicQnA):
@@ -76,11 +72,10 @@ class ClarifyIssueCreator(DynamicQnA):
         
         super().__init__(*args, **kwargs)
         self.topic_instructions = self.instructions_model.clarifyUserIssueInstructions()
-        _pass = self._cold_start_instructions()
     
-    def start_conversation(self):
+    async def start_conversation(self):
         
-        response = self._start_conversation(topic_instructions=self.instructions_model.clarifyUserIssueInstructions())
+        response = await self._start_conversation(topic_instructions=self.instructions_model.clarifyUserIssueInstructions())
         format_copilot_response: CopilotQuestionFormat = self.assign_copilot_question(ai_response=response)
         
         return format_copilot_response
@@ -132,7 +127,11 @@ class ClarifyIssueCreator(DynamicQnA):
         return copilot_response_model
     
     
-class ClarifyIssue:
+class ClarifyIssue(StreamedQuestions):
+    answer_format = CopilotAnswerFormat
+    question_format = CopilotQuestionFormat
+    model_answer_format = AnswerFormatModel
+
     def __init__(
         self, 
         ai_resource: AIResource,
@@ -148,31 +147,45 @@ class ClarifyIssue:
         self.limit_request = limit_request
         self.instructions_model = SystemInstructionsCreator(copilot=copilot, subtopic=subtopic, topic_training_data=self.topic_training_data)
 
-    async def cold_start_instructions(self):
-        
-        instructions = self.instructions_model.base_system_instructions()
-        asyncio.ensure_future(self.ai_resource.assign_system_instruction_set(system_prompt=instructions))
-        
-        return
+    async def cold_start(self) -> bool:
+        '''
+        Copilot's cold start ping: connects to the Azure endpoint and warms the prompt cache
+        with this copilot and subtopic's stable prefix, so the clarify call that follows starts warm.
+        '''
+        return await self.ai_resource.warm_prompt_cache(
+            system_prompt=self.instructions_model.base_system_instructions(),
+            topic_instructions=self.instructions_model.clarifyUserIssueInstructions())
     
-    def start_conversation(self, user_input: Optional[str], redirect_answer: Optional[str]):
+    async def start_conversation(self, user_input: Optional[str], redirect_answer: Optional[str]):
         
         if user_input:
-            response = self.get_issue_clarification_ai_response(user_prompt=[user_input])
+            # The shortlist may call the embedding endpoint synchronously, keep it off the event loop
+            await asyncio.to_thread(self.instructions_model.shortlist, user_input)
+            try:
+                response = await self.get_issue_clarification_ai_response(user_prompt=[user_input])
+            except Exception as err:
+                if not self.can_fall_back(err):
+                    raise
+                return self.fallback_copilot_question(user_input, err)
             # return response
             new_response = self.assign_copilot_question(ai_response=response)
             return new_response
-        else:
-            self.cold_start_instructions
 
-    def check_answer_index(self, question_model: QuestionFormatModel):
+    def stream_conversation(self, user_input: str) -> AsyncIterator[str]:
+        '''`start_conversation` as server-sent events, see StreamedQuestions.'''
+        return self.stream_copilot_question(user_input, prepare=partial(self.instructions_model.shortlist, user_input))
+
+    def copilot_answer(self, item: AnswerFormatModel) -> Optional[CopilotAnswerFormat]:
         
-        index = 0
-        if question_model.answer_set[0].answer_index == 1:
-            for idx in question_model.answer_set:
-                idx.answer_index = index
-                index += 1
-        return question_model
+        if not (item.associated_copilot_flow and self.topic_training_data.topic_id):
+            return None
+        return CopilotAnswerFormat(
+            DisplayName=item.answer_text, 
+            ExternalIntentId=item.associated_copilot_flow, 
+            Score=50, 
+            TopicId=self.topic_training_data.topic_id + ".topic." + item.associated_copilot_flow, 
+            TriggerId=item.associated_copilot_flow, 
+            closest_matching_issue_number=item.closest_matching_issue_number)
 
     def assign_copilot_question(self, ai_response: Optional[AIResponseFormatModel]) -> CopilotQuestionFormat:
         
@@ -182,15 +195,8 @@ class ClarifyIssue:
             
             for item in ai_response.question_model.answer_set:
                 
-                if item.associated_copilot_flow and self.topic_training_data.topic_id:
-                    
-                    new_answer_set: CopilotAnswerFormat = CopilotAnswerFormat(
-                        DisplayName=item.answer_text, 
-                        ExternalIntentId=item.associated_copilot_flow, 
-                        Score=50, 
-                        TopicId=self.topic_training_data.topic_id + ".topic." + item.associated_copilot_flow, 
-                        TriggerId=item.associated_copilot_flow, 
-                        closest_matching_issue_number=item.closest_matching_issue_number)
+                new_answer_set: Optional[CopilotAnswerFormat] = self.copilot_answer(item)
+                if new_answer_set:
                     copilot_answers.append(new_answer_set)
                     
             not_listed_answer_set = CopilotAnswerFormat(DisplayName='Not listed', ExternalIntentId="None", Score=0, TopicId=self.topic_training_data.topic_id + ".topic." + "None", TriggerId="None", closest_matching_issue_number=0)
@@ -200,14 +206,13 @@ class ClarifyIssue:
         
         return copilot_response_model
     
-    def get_issue_clarification_ai_response(self, user_prompt: List[str]) -> AIResponseFormatModel | None:
+    async def get_issue_clarification_ai_response(self, user_prompt: List[str]) -> AIResponseFormatModel | None:
         
-        ai_response: AIResponseFormatModel | None = asyncio.run(
-            self.ai_resource.get_structured_response(
+        ai_response: AIResponseFormatModel | None = await self.ai_resource.get_structured_response(
                 system_prompt=self.instructions_model.base_system_instructions(), 
                 user_prompt=user_prompt, 
-                topic_instructions=self.instructions_model.clarifyUserIssueInstructions())
-            )
+                topic_instructions=self.instructions_model.clarifyUserIssueInstructions(),
+                context_instructions=self.instructions_model.topic_list_instructions())
         
         if ai_response:
             if ai_response.question_model != None:
@@ -219,16 +224,19 @@ class ClarifyIssue:
             
             if ai_response.question_model:
                 if ai_response.question_model.closest_matching_issue_number:
-                    closest_issues: List[GuidelinesFileModel] = self.topic_training_data.issues
-                    
-                    for issue in closest_issues:
-                        if issue.associated_copilot_flow == ai_response.question_model.closest_matching_issue_number:
-                            ai_response.question_model.closest_matching_flow = issue.associated_copilot_flow
+                    closest_issue: GuidelinesFileModel | None = self.topic_training_data.subtopic_issues.by_issue_number.get(ai_response.question_model.closest_matching_issue_number)
+                    if closest_issue:
+                        ai_response.question_model.closest_matching_flow = closest_issue.associated_copilot_flow
                 return ai_response
             else:
                 return ai_response
 
 def dynamic_qna(request):
+    return wsgi_response(run_async(dynamic_qna_async(RequestData.from_flask(request))))
+
+
+async def dynamic_qna_async(request: RequestData):
+    '''The dynamic_qna handler, runs on the Azure OpenAI loop like clarify_issue_async.'''
     if request.method == "OPTIONS":
         headers = {
             # "Access-Control-Allow-Origin": "http://localhost:3050",
@@ -249,13 +257,18 @@ def dynamic_qna(request):
     ai_resource = AIResource()
     
     if model and model.copilot and model.subtopic:
-        clarify_issue_resource = ClarifyIssue(copilot=model.copilot, subtopic=model.subtopic, ai_resource=ai_resource)
+        clarify_issue_resource = await asyncio.to_thread(ClarifyIssue, copilot=model.copilot, subtopic=model.subtopic, ai_resource=ai_resource)
         if model.copilot and model.subtopic and model.user_input:
-            clarify_response = clarify_issue_resource.start_conversation(user_input=model.user_input, redirect_answer=None)
+            if request.wants_event_stream:
+                return (EventStream(clarify_issue_resource.stream_conversation(user_input=model.user_input)), 200, {**headers, **SSE_HEADERS})
+            try:
+                clarify_response = await clarify_issue_resource.start_conversation(user_input=model.user_input, redirect_answer=None)
+            except LoadShedError as err:
+                return shed_response(err, headers)
             log(clarify_response=clarify_response)
             if clarify_response:
                 return (clarify_response.model_dump(), 200, headers)
         else:
-            cold_start = clarify_issue_resource.cold_start_instructions()
-            return ({"response": "OK"}, 200, headers)
+            warmed = await clarify_issue_resource.cold_start()
+            return ({"response": "OK", "warmed": warmed}, 200, headers)
         
\ No newline at end of file
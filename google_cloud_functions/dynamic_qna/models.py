@@ -1,9 +1,10 @@
 from enum import Enum
-from typing import List, Optional, Any
-from dataclasses import dataclass, field
+from typing import List, Optional, Any, Tuple
+from dataclasses import dataclass
 from pydantic import BaseModel
-import json
-# from ...training_data import training_data 
+from models import IssueIndex, SubtopicIssues
+from resources.candidate_questions import ResponsePath
+from .training_data import GuidelinesFileModel, TopicRecord, TrainingDataStore
 
 
 class ResourceType(Enum):
@@ -15,54 +16,35 @@ class ResourceType(Enum):
     
 
 @dataclass
-class GuidelinesFileModel: 
+class TopicTrainingModel: 
     '''
-    The topic specific json object, represented as a model
-    Better option would be to set up a blob storage resource, so the OpenAI model is trained on the data prior to deploy
+    Per-request view over the process-wide TrainingDataStore.
+    Pinned to the snapshot current when the request started, so a reload mid-request can't mix two versions.
     '''
-    issue_number: Optional[int] = 0
-    observation: Optional[str] = ''
-    performance_guideline: Optional[str] = ''
-    remodeling_specific_guideline: Optional[str] = ''
-    void_warranty_factors: Optional[str] = ''
-    corrective_measure: Optional[str] = ''
-    discussion: Optional[str] = ''
-    matching_issue_certainty: Optional[float] = 0
-    associated_copilot_flow: Optional[str] = ''
-    chapter: Optional[int] = 0
-    subchapter: Optional[int] = 0
-    subtopics: list = field(default_factory=list)
-
-
-@dataclass
-class TopicTrainingModel: 
-    issues = []
     topic_id: str = ''
     topic: Optional[str] = ''
     additional_notes: Optional[str] = ''
     additional_topic_info: Optional[str] = ''
-    system_instructions = []
     
     def __init__(self, copilot: str, subtopic: str):
         self.copilot = copilot.lower()
         self.subtopic = subtopic
-        # file_path = 'training_data/{}.json'.format(self.copilot.lower())
-        file_path = 'combined_training_data.json'
-        json_file = json.load(open(file_path, 'r'))
-        self.topic = json_file[self.copilot]['topic']
-        self.topic_id = json_file[self.copilot]['topic_id']
-        self.additional_notes = json_file[self.copilot]['additional_notes']
-        self.additional_topic_info = json_file[self.copilot]['additional_topic_info']
-        self.issues.extend(GuidelinesFileModel(**items) for items in json_file[self.copilot]['issues'] if self.subtopic in items['subtopics'])
+        snapshot = TrainingDataStore.shared().snapshot()
+        self.training_data_version = snapshot.version
+        self.topic_record: TopicRecord = snapshot.data.topic(self.copilot)
+        self.topic = self.topic_record.topic
+        self.topic_id = self.topic_record.topic_id
+        self.additional_notes = self.topic_record.additional_notes
+        self.additional_topic_info = self.topic_record.additional_topic_info
+        self.subtopic_issues: SubtopicIssues = self.topic_record.index.subtopic(self.subtopic)
+        self.issues: Tuple[GuidelinesFileModel, ...] = self.subtopic_issues.issues
+        self.system_instructions: List[str] = []
+    
+    def get_issues(self) -> Tuple[GuidelinesFileModel, ...]:
+        return self.topic_record.issues
     
-    def get_issues(self) -> list[GuidelinesFileModel]:
-        file_path = 'combined_training_data.json'
-        json_file = json.load(open(file_path, 'r'))
-        self.topic = json_file[self.copilot]['topic']
-        self.additional_notes = json_file[self.copilot]['additional_notes']
-        self.additional_topic_info = json_file[self.copilot]['additional_topic_info']
-        self.issues.extend(GuidelinesFileModel(**items) for items in json_file[self.copilot]['issues'])
-        return self.issues
+    def issue_index(self) -> IssueIndex:
+        return self.topic_record.index
 
 
 class LimitedIssueModel(BaseModel):
@@ -146,6 +128,7 @@ class CopilotAnswerFormat(BaseModel):
 class CopilotQuestionFormat(BaseModel):
     question_text: str
     copilot_answer_set: List[CopilotAnswerFormat]
+    served_by: str = ResponsePath.llm.value
 
 class StructuredVariableModel(BaseModel):
     variable_type: Any
@@ -1,10 +1,9 @@
 from typing import List, Optional
 from pydantic import BaseModel
-import asyncio
 from .models import *
 from .instructions import SystemInstructionsCreator
 from utils import log
-from resources import AIResource
+from resources import AIResource, run_async
 
 class QuestionCreator:
     '''
@@ -63,24 +62,13 @@ class QuestionCreator:
                 return redirect_model
                 
     def format_topic_list_instructions(self):
-        issues = []
-        for issue in self.topic_training_data.issues:
-            if self.subtopic in issue.subtopics:
-                issue_str = issue.__dict__.__str__() + "\n\n"
-                issues.append(issue_str)
-                # self.limited_training_model.append(LimitedIssueModel(observation=issue.observation, associated_copilot_flow=issue.associated_copilot_flow))
-        # issues = []
-        # for issue in self.limited_training_model:
-        #     issue_str = issue.__dict__.__str__() + "\n\n"
-        #     issues.append(issue_str)
+        issues = [issue.__dict__.__str__() + "\n\n" for issue in self.topic_training_data.subtopic_issues.issues]
         log(issues=issues)
         return issues
         
         
-    async def cold_start_instructions(self):
-        instructions = self.createBaseInstructions()
-        asyncio.ensure_future(self.ai_resource.assign_system_instruction_set(system_prompt=instructions))
-        return
+    def cold_start(self) -> bool:
+        return run_async(self.ai_resource.warm_prompt_cache(system_prompt=self.createBaseInstructions()))
         
     def createBaseInstructions(self):
         # log(assigning='Base System Instructions...')
@@ -104,10 +92,7 @@ class QuestionCreator:
         return instructions
         
     def redirect_issue_instructions(self):
-        combined = []
-        for guideline in self.topic_training_data.issues:
-            if guideline and guideline.observation and guideline.associated_copilot_flow:
-                combined.append({"associated_copilot_flow": guideline.associated_copilot_flow, "observation": guideline.observation})
+        combined = [{"associated_copilot_flow": guideline.associated_copilot_flow, "observation": guideline.observation} for guideline in self.topic_training_data.subtopic_issues.flow_issues]
         instructions: List[str] = [
             "Consider this list of descriptions that a homeowners issue: {}.".format(combined.__str__()),
             "Each \'associated_copilot_flow\' will have a basic general description as the \'observation\' value.",
@@ -117,10 +102,7 @@ class QuestionCreator:
         return instructions
         
     def limited_redirect_issue_instructions(self):
-        combined = []
-        for guideline in self.topic_training_data.issues:
-            if guideline and guideline.observation and guideline.associated_copilot_flow:
-                combined.append({"associated_copilot_flow": guideline.associated_copilot_flow, "observation": guideline.observation})
+        combined = [{"associated_copilot_flow": guideline.associated_copilot_flow, "observation": guideline.observation} for guideline in self.topic_training_data.subtopic_issues.flow_issues]
         instructions: List[str] = [
             "Consider this list of descriptions that a homeowners issue: {}.".format(combined.__str__()),
             "Each \'associated_copilot_flow\' will have a basic general description as the \'observation\' value.",
@@ -194,7 +176,7 @@ class QuestionCreator:
         return copilot_response_model
             
     def get_redirect_ai_response(self, system_prompt: List[str], user_prompt: List[str]) -> RedirectResponse | None:
-        ai_response: RedirectResponse | None = asyncio.run(self.ai_resource.get_typed_structured_response(system_prompt=system_prompt, user_prompt=user_prompt, response_format=RedirectResponse))
+        ai_response: RedirectResponse | None = run_async(self.ai_resource.get_typed_structured_response(system_prompt=system_prompt, user_prompt=user_prompt, response_format=RedirectResponse))
         if ai_response:
             return ai_response
         else:
@@ -202,7 +184,7 @@ class QuestionCreator:
                 
     def get_issue_clarification_ai_response(self, system_prompt: List[str], user_prompt: List[str]) -> AIResponseFormatModel | None:
             
-        ai_response: AIResponseFormatModel | None = asyncio.run(
+        ai_response: AIResponseFormatModel | None = run_async(
             self.ai_resource.get_structured_response(
                 system_prompt=self.createBaseInstructions(), 
                 user_prompt=user_prompt, 
@@ -219,11 +201,9 @@ class QuestionCreator:
                 
             if ai_response.question_model:
                 if ai_response.question_model.closest_matching_issue_number:
-                    closest_issues: List[GuidelinesFileModel] = self.topic_training_data.issues
-                        
-                    for issue in closest_issues:
-                        if issue.associated_copilot_flow == ai_response.question_model.closest_matching_issue_number:
-                            ai_response.question_model.closest_matching_flow = issue.associated_copilot_flow
+                    closest_issue: GuidelinesFileModel | None = self.topic_training_data.subtopic_issues.by_issue_number.get(ai_response.question_model.closest_matching_issue_number)
+                    if closest_issue:
+                        ai_response.question_model.closest_matching_flow = closest_issue.associated_copilot_flow
                 return ai_response
             else:
                 return ai_response
@@ -231,9 +211,9 @@ class QuestionCreator:
     def get_structured_ai_response(self, system_prompt: List[str], user_prompt: List[str]) -> AIResponseFormatModel | None:
         if system_prompt != self.system_instructions:
             self.system_instructions = system_prompt
-            ai_response: AIResponseFormatModel | None = asyncio.run(self.ai_resource.get_structured_response(system_prompt=system_prompt, user_prompt=user_prompt))
+            ai_response: AIResponseFormatModel | None = run_async(self.ai_resource.get_structured_response(system_prompt=system_prompt, user_prompt=user_prompt))
         else:
-            ai_response: AIResponseFormatModel | None = asyncio.run(self.ai_resource.get_structured_response(user_prompt=user_prompt))
+            ai_response: AIResponseFormatModel | None = run_async(self.ai_resource.get_structured_response(user_prompt=user_prompt))
                 
         if ai_response:
                 
@@ -0,0 +1,259 @@
+from dataclasses import dataclass, field, fields
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
+import threading
+import struct
+import json
+import mmap
+import os
+import sys
+from utils import log, ReloadableSnapshot, Snapshot
+from models import IssueIndex
+
+
+TRAINING_DATA_PATH = os.environ.get('TRAINING_DATA_PATH', 'combined_training_data.json')
+COMPILED_TRAINING_DATA_PATH = os.environ.get('COMPILED_TRAINING_DATA_PATH', 'combined_training_data.bin')
+TRAINING_DATA_RELOAD_SEC = float(os.environ.get('TRAINING_DATA_RELOAD_SEC', 60)) # 0 disables the file watcher
+
+# Compiled layout: MAGIC | uint32 index length | json index | data region
+# The index holds an offset table per copilot (topic fields + one entry per issue) and the issue positions per subtopic.
+# Offsets are relative to the start of the data region, every blob is a compact json document.
+MAGIC = b'AVIDTD01'
+HEADER = struct.Struct('<8sI')
+
+
+@dataclass(frozen=True)
+class GuidelinesFileModel:
+    '''
+    The topic specific json object, represented as a model
+    Better option would be to set up a blob storage resource, so the OpenAI model is trained on the data prior to deploy
+    '''
+    issue_number: Optional[int] = 0
+    observation: Optional[str] = ''
+    performance_guideline: Optional[str] = ''
+    remodeling_specific_guideline: Optional[str] = ''
+    void_warranty_factors: Optional[str] = ''
+    corrective_measure: Optional[str] = ''
+    discussion: Optional[str] = ''
+    matching_issue_certainty: Optional[float] = 0
+    associated_copilot_flow: Optional[str] = ''
+    chapter: Optional[int] = 0
+    subchapter: Optional[int] = 0
+    subtopics: tuple = field(default_factory=tuple)
+
+    @classmethod
+    def from_json(cls, issue_json: dict) -> "GuidelinesFileModel":
+        '''Ignores keys the model doesn't know (a few hand-edited issues carry stray fields like \'issue_no\').'''
+        known_fields = {model_field.name for model_field in fields(cls)}
+        values = {key: value for key, value in issue_json.items() if key in known_fields}
+        values['subtopics'] = tuple(values.get('subtopics', ()))
+        return cls(**values)
+
+
+@dataclass(frozen=True)
+class TopicRecord:
+    '''
+    Read-only training data for one copilot, shared by every request in the process.
+    '''
+    copilot: str
+    topic: str = ''
+    topic_id: str = ''
+    additional_notes: str = ''
+    additional_topic_info: str = ''
+    issues: Tuple[GuidelinesFileModel, ...] = ()
+    index: IssueIndex = field(init=False, compare=False, repr=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, 'index', IssueIndex(self.issues))
+
+    @classmethod
+    def from_json(cls, copilot: str, topic_json: dict) -> "TopicRecord":
+        issues = tuple(GuidelinesFileModel.from_json(item) for item in topic_json.get('issues', []))
+        return cls(
+            copilot=copilot,
+            topic=topic_json.get('topic', ''),
+            topic_id=topic_json.get('topic_id', ''),
+            additional_notes=topic_json.get('additional_notes', ''),
+            additional_topic_info=topic_json.get('additional_topic_info', ''),
+            issues=issues)
+
+
+class JsonTrainingData:
+    '''
+    Parses the whole json file up front. Used when no current compiled artifact exists, e.g. running locally.
+    '''
+
+    def __init__(self, file_path: str = TRAINING_DATA_PATH) -> None:
+        self.file_path = file_path
+        with open(file_path, 'r') as json_file:
+            raw_topics: Dict[str, dict] = json.load(json_file)
+        self._topics: Mapping[str, TopicRecord] = MappingProxyType({
+            copilot.lower(): TopicRecord.from_json(copilot.lower(), topic_json) for copilot, topic_json in raw_topics.items()})
+
+    def copilots(self) -> Tuple[str, ...]:
+        return tuple(self._topics)
+
+    def topic(self, copilot: str) -> TopicRecord:
+        return self._topics[copilot.lower()]
+
+
+class CompiledTrainingData:
+    '''
+    Memory-maps the compiled artifact and only decodes a copilot's blobs the first time that copilot is requested.
+    Pages of topics that are never requested are never read, so memory stays flat as the data grows.
+    '''
+
+    def __init__(self, file_path: str = COMPILED_TRAINING_DATA_PATH) -> None:
+        self.file_path = file_path
+        with open(file_path, 'rb') as artifact:
+            self._mmap = mmap.mmap(artifact.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_length = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError('{} is not a compiled training data file.'.format(file_path))
+        index_start = HEADER.size
+        self._data_start = index_start + index_length
+        self._index: Dict[str, dict] = json.loads(self._mmap[index_start:self._data_start])
+        self._decoded: Dict[str, TopicRecord] = {}
+        self._lock = threading.Lock()
+
+    def _blob(self, entry: List[int]) -> dict:
+        offset, length = entry
+        start = self._data_start + offset
+        return json.loads(self._mmap[start:start + length])
+
+    def copilots(self) -> Tuple[str, ...]:
+        return tuple(self._index)
+
+    def subtopic_positions(self, copilot: str, subtopic: str) -> Tuple[int, ...]:
+        return tuple(self._index[copilot.lower()]['subtopics'].get(subtopic, ()))
+
+    def topic(self, copilot: str) -> TopicRecord:
+        copilot = copilot.lower()
+        record = self._decoded.get(copilot)
+        if record is None:
+            with self._lock:
+                record = self._decoded.get(copilot)
+                if record is None:
+                    entry = self._index[copilot]
+                    topic_json = self._blob(entry['topic'])
+                    topic_json['issues'] = [self._blob(issue_entry) for issue_entry in entry['issues']]
+                    record = TopicRecord.from_json(copilot, topic_json)
+                    self._decoded[copilot] = record
+        return record
+
+
+def compile_training_data(source_path: str = TRAINING_DATA_PATH, output_path: str = COMPILED_TRAINING_DATA_PATH) -> str:
+    '''
+    Build step: compiles combined_training_data.json into the indexed artifact read by CompiledTrainingData.
+    Written to a temp file and renamed, so a running reader never sees a half written artifact.
+    '''
+    with open(source_path, 'r') as json_file:
+        raw_topics: Dict[str, dict] = json.load(json_file)
+
+    data = bytearray()
+    index: Dict[str, dict] = {}
+
+    def append_blob(value: dict) -> List[int]:
+        blob = json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        offset = len(data)
+        data.extend(blob)
+        return [offset, len(blob)]
+
+    for copilot, topic_json in raw_topics.items():
+        issues_json: List[dict] = topic_json.get('issues', [])
+        subtopics: Dict[str, List[int]] = {}
+        for position, issue_json in enumerate(issues_json):
+            for subtopic in issue_json.get('subtopics', []):
+                subtopics.setdefault(subtopic, []).append(position)
+        index[copilot.lower()] = {
+            'topic': append_blob({key: value for key, value in topic_json.items() if key != 'issues'}),
+            'issues': [append_blob(issue_json) for issue_json in issues_json],
+            'subtopics': subtopics,
+        }
+
+    index_bytes = json.dumps(index, separators=(',', ':')).encode('utf-8')
+    temp_path = output_path + '.tmp'
+    with open(temp_path, 'wb') as artifact:
+        artifact.write(HEADER.pack(MAGIC, len(index_bytes)))
+        artifact.write(index_bytes)
+        artifact.write(data)
+    os.replace(temp_path, output_path)
+    log(compiled_training_data=output_path, topics=len(index), size=HEADER.size + len(index_bytes) + len(data))
+    return output_path
+
+
+def compiled_artifact_is_current(source_path: str = TRAINING_DATA_PATH, artifact_path: str = COMPILED_TRAINING_DATA_PATH) -> bool:
+    '''The artifact is only trusted when it was built after the last edit to the json source.'''
+    if not os.path.exists(artifact_path):
+        return False
+    if not os.path.exists(source_path):
+        return True
+    return os.path.getmtime(artifact_path) >= os.path.getmtime(source_path)
+
+
+class TrainingDataStore:
+    '''
+    Process-wide training data, shared by every request as immutable TopicRecords.
+    Reads the compiled artifact when it's current, otherwise falls back to parsing the json.
+    When polling is enabled a watcher reopens the data after either file changes and swaps the new snapshot in,
+    requests that already hold a snapshot finish on the old one.
+    '''
+    _shared: Optional["TrainingDataStore"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, file_path: str = TRAINING_DATA_PATH, compiled_path: str = COMPILED_TRAINING_DATA_PATH, poll_interval: float = 0) -> None:
+        self.file_path = file_path
+        self.compiled_path = compiled_path
+        self._snapshots: ReloadableSnapshot[JsonTrainingData | CompiledTrainingData] = ReloadableSnapshot(
+            name='training_data', load=self._open, version=self._version, poll_interval=poll_interval)
+
+    @classmethod
+    def shared(cls) -> "TrainingDataStore":
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls(poll_interval=TRAINING_DATA_RELOAD_SEC)
+        return cls._shared
+
+    def _version(self) -> Tuple[Optional[int], Optional[int]]:
+        return (_modified_ns(self.file_path), _modified_ns(self.compiled_path))
+
+    def _open(self) -> JsonTrainingData | CompiledTrainingData:
+        if compiled_artifact_is_current(self.file_path, self.compiled_path):
+            try:
+                source = CompiledTrainingData(self.compiled_path)
+            except (OSError, ValueError) as err:
+                log(compiled_training_data_error=err)
+            else:
+                log(loaded_training_data=self.compiled_path)
+                return source
+        log(loaded_training_data=self.file_path)
+        return JsonTrainingData(self.file_path)
+
+    def snapshot(self) -> Snapshot[JsonTrainingData | CompiledTrainingData]:
+        return self._snapshots.get()
+
+    def refresh(self) -> bool:
+        return self._snapshots.refresh()
+
+    def source(self) -> JsonTrainingData | CompiledTrainingData:
+        return self.snapshot().data
+
+    def copilots(self) -> Tuple[str, ...]:
+        return self.source().copilots()
+
+    def topic(self, copilot: str) -> TopicRecord:
+        '''Raises KeyError for an unknown copilot, same as indexing the raw json did.'''
+        return self.source().topic(copilot)
+
+
+def _modified_ns(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+if __name__ == '__main__':
+    # python -m google_cloud_functions.dynamic_qna.training_data [source.json] [output.bin]
+    compile_training_data(*sys.argv[1:3])
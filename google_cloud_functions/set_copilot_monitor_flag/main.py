@@ -1,10 +1,10 @@
 import os
 import functions_framework
-from google.cloud import firestore
 from firebase_admin import credentials, initialize_app
 from enum import Enum
 from typing import Any, Optional
 from pydantic import BaseModel
+from utils.firestore_clients import firestore_client
 
 try:
     cred = credentials.ApplicationDefault()
@@ -83,7 +83,7 @@ class FireStoreTopics:
     def __init__(self, topic: str, env: Optional[EnvConfig]=None):
         self.env_config: EnvConfig = env
         self.firestore_topic = FBTopicList(topic)
-        self.db = firestore.Client(project=self.env_config.project_id)
+        self.db = firestore_client(self.env_config.project_id)
         self.topic_model = None
         
     def get_topic_doc(self, env: Optional[str]=None):
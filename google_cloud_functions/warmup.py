@@ -0,0 +1,148 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+import threading
+import time
+import os
+from models import FBTopicList
+from resources import AIResource, run_async
+from resources.azure_client import warm_connection
+from resources.embeddings import candidate_ranker
+from utils import log
+from utils.firestore_clients import FIRESTORE_CLIENTS
+from .dynamic_qna.training_data import TrainingDataStore
+from .dynamic_qna import models as dynamic_qna_models
+from .dynamic_qna.instructions import SystemInstructionsCreator
+from .clarify_issue import main as clarify_issue_main
+
+WARMUP_ON_START = os.environ.get('WARMUP_ON_START', '1') == '1'
+WARMUP_WORKERS = int(os.environ.get('WARMUP_WORKERS', 8))
+# clarify_issue topics are preloaded for each of these envs, the deployment's BUILD_ENV by default. Requests for other envs load on first use
+WARMUP_FIRESTORE_ENVS = [env.strip() for env in os.environ.get('WARMUP_FIRESTORE_ENVS', clarify_issue_main.BUILD_ENV).split(',') if env.strip()]
+
+WarmUpStep = Tuple[str, Callable[[], Any]]
+
+
+class WarmUp:
+    '''
+    Runs the lazy initialization of every endpoint before the first request does: training data, indexes,
+    Firestore topics and Azure clients. Steps run in parallel, a failed step is logged and
+    recorded but doesn't hold readiness back, whatever it didn't warm is loaded on first use as before.
+    '''
+
+    def __init__(self, steps: Sequence[WarmUpStep], workers: int = WARMUP_WORKERS) -> None:
+        self.steps = list(steps)
+        self.workers = workers
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self._done = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def start(self) -> None:
+        '''Runs the warm-up once on a background thread, so the server can bind and answer /readyz meanwhile.'''
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name='warm-up', daemon=True)
+                self._thread.start()
+
+    def run(self) -> None:
+        self.started_at = time.monotonic()
+        log(warm_up='starting', steps=[name for name, _ in self.steps])
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(self.steps))), thread_name_prefix='warm-up') as executor:
+            list(executor.map(self._run_step, self.steps))
+        self.finished_at = time.monotonic()
+        self._done.set()
+        log(warm_up='ready', seconds=round(self.finished_at - self.started_at, 3), failed=[name for name, result in self.results.items() if not result['ok']], firestore_clients=FIRESTORE_CLIENTS.stats())
+
+    def _run_step(self, step: WarmUpStep) -> None:
+        name, warm = step
+        started = time.monotonic()
+        try:
+            detail = warm()
+            self.results[name] = {'ok': True, 'seconds': round(time.monotonic() - started, 3), 'detail': detail}
+        except Exception as err:
+            log(warm_up_step_failed=name, error=err)
+            self.results[name] = {'ok': False, 'seconds': round(time.monotonic() - started, 3), 'error': str(err)}
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'ready': self.ready,
+            'seconds': round(self.finished_at - self.started_at, 3) if self.ready and self.started_at is not None else None,
+            'steps': dict(self.results),
+            # Per project Firestore clients created and reused, more than one created means a channel was reopened
+            'firestore_clients': FIRESTORE_CLIENTS.stats()}
+
+
+def warm_training_data() -> Dict[str, int]:
+    '''dynamic_qna: opens the training data snapshot, builds every copilot's issue index and BM25 postings and its prompt templates.'''
+    store = TrainingDataStore.shared()
+    subtopics = 0
+    for copilot in store.copilots():
+        index = store.topic(copilot).index
+        for subtopic in index.subtopics():
+            index.subtopic(subtopic).bm25()
+            SystemInstructionsCreator(copilot=copilot, subtopic=subtopic, topic_training_data=dynamic_qna_models.TopicTrainingModel(copilot, subtopic))
+            subtopics += 1
+    return {'copilots': len(store.copilots()), 'subtopics': subtopics}
+
+
+def _warm_firestore_topic(env: str, topic: FBTopicList) -> int:
+    topic_model = clarify_issue_main.FireStoreTopics(topic=topic.value, env=env).get_topic_doc()
+    index = topic_model.issue_index()
+    for subtopic in index.subtopics():
+        index.subtopic(subtopic).bm25()
+        clarify_issue_main.SystemInstructionsCreator(copilot=topic.value, subtopic=subtopic, topic_training_data=topic_model)
+    return len(topic_model.issues)
+
+
+def warm_firestore_topics() -> Dict[str, int]:
+    '''
+    clarify_issue: loads every FBTopicList topic into TOPIC_CACHE in parallel, which also opens the shared Firestore
+    client and attaches the topic listeners. Per topic failures (e.g. a topic without azure_data) are logged and skipped.
+    '''
+    # FireStoreTopics lower-cases the requested topic, so only lower-case topic values are servable by clarify_issue
+    jobs = [(env, topic) for env in WARMUP_FIRESTORE_ENVS for topic in FBTopicList if topic.value == topic.value.lower()]
+    loaded: Dict[str, int] = {}
+
+    def warm(job: Tuple[str, FBTopicList]) -> None:
+        env, topic = job
+        try:
+            loaded['{}/{}'.format(env, topic.value)] = _warm_firestore_topic(env, topic)
+        except Exception as err:
+            log(warm_up_topic_failed=topic.value, env=env, error=err)
+
+    with ThreadPoolExecutor(max_workers=WARMUP_WORKERS, thread_name_prefix='warm-up-topics') as executor:
+        list(executor.map(warm, jobs))
+    if jobs and not loaded:
+        raise RuntimeError('no Firestore topic could be loaded')
+    return loaded
+
+
+def warm_ai_clients() -> Dict[str, Any]:
+    '''
+    Builds both AIResource flavours, which creates the shared Azure OpenAI clients and deployment pools, and opens
+    a pooled connection to each endpoint on the background loop. Also loads the embedding ranker.
+    '''
+    shared_resource = AIResource()
+    clarify_resource = clarify_issue_main.AIResource(env_config=clarify_issue_main.EnvConfig())
+    clients = {id(resource.chat_client): resource.chat_client for resource in (shared_resource, clarify_resource) if resource.connected}
+    # The hedge deployments too, a hedge is only useful if it doesn't start with a cold connection
+    for resource in (shared_resource, clarify_resource):
+        if resource.connected:
+            clients.update({id(client): client for client in (deployment.client() for deployment in resource.deployments.deployments if not deployment.primary)})
+    connected = [run_async(warm_connection(client)) for client in clients.values()]
+    return {'clients': len(clients), 'connected': all(connected), 'embedding_ranker': candidate_ranker() is not None}
+
+
+WARM_UP = WarmUp(steps=[
+    ('training_data', warm_training_data),
+    ('firestore_topics', warm_firestore_topics),
+    ('ai_clients', warm_ai_clients)])
@@ -1,4 +1,5 @@
 from .firebase_warranty_topics import FBTopicList
 from .dynamic_qna_response_model import AIResponseFormatModel, QuestionFormatModel, AnswerFormatModel, WarrantableIssueCertainty
+from .issue_index import IssueIndex, SubtopicIssues
 
-__all__ = ["FBTopicList", "AIResponseFormatModel", "QuestionFormatModel", "AnswerFormatModel", "WarrantableIssueCertainty"]
\ No newline at end of file
+__all__ = ["FBTopicList", "AIResponseFormatModel", "QuestionFormatModel", "AnswerFormatModel", "WarrantableIssueCertainty", "IssueIndex", "SubtopicIssues"]
\ No newline at end of file
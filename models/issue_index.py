@@ -0,0 +1,132 @@
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+from utils.retrieval import CANDIDATE_RECALL_MARGIN, CANDIDATE_TOP_K, BM25Index, shortlist
+
+# (issues, user_input) -> best first (issue, score) pairs, or None when the ranker can't score these issues
+Ranker = Callable[[Sequence[Any], str], Optional[List[Tuple[Any, float]]]]
+
+
+class SubtopicIssues:
+    '''
+    The issues of one (copilot, subtopic), with the lookups the prompt builders and response handlers need.
+    Built once per topic load, then only read.
+    '''
+
+    def __init__(self, subtopic: str, issues: Iterable[Any], ranking: Optional[Iterable[Any]] = None) -> None:
+        self.subtopic = subtopic
+        self.issues: Tuple[Any, ...] = tuple(issues)
+        # Best match first for a shortlist, guideline order otherwise
+        self.ranking: Tuple[Any, ...] = tuple(ranking) if ranking is not None else self.issues
+        # Issues usable as a Copilot answer, i.e. with both a description and a flow to redirect to
+        self.flow_issues: Tuple[Any, ...] = tuple(issue for issue in self.issues if issue.observation and issue.associated_copilot_flow)
+        self.by_flow: Mapping[str, Any] = _first_by(self.issues, 'associated_copilot_flow')
+        self.by_issue_number: Mapping[int, Any] = _first_by(self.issues, 'issue_number')
+        self._bm25: Optional[BM25Index] = None
+
+    def bm25(self) -> BM25Index:
+        # Built on first use and kept with the view, so it's rebuilt exactly when the training data reloads
+        if self._bm25 is None:
+            self._bm25 = BM25Index(self.issues, text=lambda issue: issue.observation)
+        return self._bm25
+
+    def shortlist(self, user_input: Optional[str], top_k: int = CANDIDATE_TOP_K, recall_margin: float = CANDIDATE_RECALL_MARGIN, ranker: Optional[Ranker] = None) -> "SubtopicIssues":
+        '''
+        The issues whose observation best matches the user's input, in guideline order, with `ranking` best first.
+        Ranked by `ranker` when given (e.g. embeddings), by BM25 when there's no ranker or it can't rank these issues.
+        '''
+        if not user_input:
+            return self
+        ranked = ranker(self.issues, user_input) if ranker else None
+        if ranked is None:
+            ranked = self.bm25().ranked(user_input)
+        ranking = shortlist(ranked, top_k=top_k, recall_margin=recall_margin)
+        kept = {id(issue) for issue in ranking}
+        return SubtopicIssues(self.subtopic, (issue for issue in self.issues if id(issue) in kept), ranking=ranking)
+
+    def ranked_flow_issues(self, user_input: Optional[str], ranker: Optional[Ranker] = None) -> List[Tuple[Any, float]]:
+        '''
+        One issue per distinct Copilot flow, best match first. Issues whose flow is the \'None\' placeholder are left out,
+        that flow is reserved for the \'Not listed\' answer.
+        '''
+        ranked = ranker(self.flow_issues, user_input) if ranker and user_input else None
+        if ranked is None:
+            flow_ids = {id(issue) for issue in self.flow_issues}
+            ranked = [(issue, score) for issue, score in self.bm25().ranked(user_input) if id(issue) in flow_ids]
+        seen_flows = set()
+        distinct: List[Tuple[Any, float]] = []
+        for issue, score in ranked:
+            if issue.associated_copilot_flow == 'None' or issue.associated_copilot_flow in seen_flows:
+                continue
+            seen_flows.add(issue.associated_copilot_flow)
+            distinct.append((issue, score))
+        return distinct
+
+    def confident_candidates(self, user_input: Optional[str], max_issues: int, dominance: float, max_answers: int, ranker: Optional[Ranker] = None) -> Optional[List[Any]]:
+        '''
+        The answer candidates when the local match is good enough to skip the model, otherwise None.
+        Confident means the subtopic only has `max_issues` flows to choose from at all,
+        or the best match scores at least `dominance` times the runner up. The runner up has to match too:
+        one query term hitting a single issue (everything else at 0) says too little about the input,
+        and a ratio against a zero or negative (embedding cosine) score means nothing.
+        Issues that don't match at all aren't offered as answers.
+        '''
+        ranked = self.ranked_flow_issues(user_input, ranker=ranker)
+        if not ranked:
+            return None
+        if len(ranked) <= max_issues:
+            return [issue for issue, _ in ranked]
+        top_score, runner_up_score = ranked[0][1], ranked[1][1]
+        if dominance > 0 and runner_up_score > 0 and top_score >= dominance * runner_up_score:
+            return [issue for issue, score in ranked[:max_answers] if score > 0]
+        return None
+
+    def fallback_candidates(self, user_input: Optional[str], max_answers: int) -> List[Any]:
+        '''
+        The best `max_answers` flows by BM25 alone, for answering without Azure (the embeddings ranker is Azure too).
+        The first flows in guideline order when nothing in the input matches.
+        '''
+        ranked = self.ranked_flow_issues(user_input)
+        matched = [issue for issue, score in ranked if score > 0] or [issue for issue, _ in ranked]
+        return matched[:max_answers]
+
+    def __len__(self) -> int:
+        return len(self.issues)
+
+    def __iter__(self):
+        return iter(self.issues)
+
+
+class IssueIndex:
+    '''
+    Maps every subtopic of a copilot to its SubtopicIssues, replacing per-request scans of `subtopic in issue.subtopics`.
+    Works for both GuidelinesFileModel (json training data) and IssueTrainingModel (Firestore) issues.
+    '''
+
+    def __init__(self, issues: Iterable[Any]) -> None:
+        self.issues: Tuple[Any, ...] = tuple(issues)
+        grouped: Dict[str, List[Any]] = {}
+        for issue in self.issues:
+            for subtopic in issue.subtopics or ():
+                grouped.setdefault(subtopic, []).append(issue)
+        self._subtopics: Mapping[str, SubtopicIssues] = MappingProxyType(
+            {subtopic: SubtopicIssues(subtopic, subtopic_issues) for subtopic, subtopic_issues in grouped.items()})
+        self.by_flow: Mapping[str, Any] = _first_by(self.issues, 'associated_copilot_flow')
+        self.by_issue_number: Mapping[int, Any] = _first_by(self.issues, 'issue_number')
+
+    def subtopics(self) -> Tuple[str, ...]:
+        return tuple(self._subtopics)
+
+    def subtopic(self, subtopic: Optional[str]) -> SubtopicIssues:
+        '''Unknown subtopics get an empty view rather than an error, matching the old filter loops.'''
+        found = self._subtopics.get(subtopic) if subtopic else None
+        return found if found is not None else SubtopicIssues(subtopic or '', ())
+
+
+def _first_by(issues: Iterable[Any], attribute: str) -> Mapping[Any, Any]:
+    # Several issues can share a flow, the first one in guideline order is the one the flow describes
+    lookup: Dict[Any, Any] = {}
+    for issue in issues:
+        key = getattr(issue, attribute, None)
+        if key:
+            lookup.setdefault(key, issue)
+    return MappingProxyType(lookup)
@@ -1,3 +1,4 @@
 from .ai_resource import AIResource
+from .azure_client import run_async, await_async
 
-__all__ = ["AIResource"]
\ No newline at end of file
+__all__ = ["AIResource", "run_async", "await_async"]
\ No newline at end of file
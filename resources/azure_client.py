@@ -0,0 +1,160 @@
+from concurrent.futures import Future
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple, TypeVar
+import asyncio
+import threading
+import os
+import httpx
+from openai import AsyncAzureOpenAI
+from utils import log
+
+try:
+    import h2 # noqa: F401, only needed for httpx's HTTP/2 support
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+AZURE_HTTP2 = os.environ.get('AZURE_HTTP2', '1') == '1' and HTTP2_AVAILABLE
+# Every Azure call runs on AZURE_LOOP, so the pool bounds the in-flight calls of the whole instance (ASGI conversations
+# up to Cloud Run's concurrency, or the 8 WSGI threads) plus their hedges and streams; calls past it wait for a connection.
+# Over HTTP/2 each connection multiplexes many calls, so this mostly matters on HTTP/1.1
+AZURE_HTTP_MAX_CONNECTIONS = int(os.environ.get('AZURE_HTTP_MAX_CONNECTIONS', 32))
+AZURE_HTTP_KEEPALIVE_SEC = float(os.environ.get('AZURE_HTTP_KEEPALIVE_SEC', 120))
+AZURE_HTTP_TIMEOUT_SEC = float(os.environ.get('AZURE_HTTP_TIMEOUT_SEC', 60))
+
+T = TypeVar('T')
+
+
+class BackgroundLoop:
+    '''
+    One asyncio event loop running on a daemon thread for the whole process.
+    Sync request threads submit coroutines to it and block on the result, so async clients bound to this loop
+    (and their connection pools) outlive any single request instead of dying with a per-request asyncio.run loop.
+    '''
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    self._thread = threading.Thread(target=loop.run_forever, name='loop-{}'.format(self.name), daemon=True)
+                    self._thread.start()
+                    self._loop = loop
+        return self._loop
+
+    def submit(self, coroutine: Coroutine[Any, Any, T]) -> "Future[T]":
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine: Coroutine[Any, Any, T], timeout: Optional[float] = None) -> T:
+        '''Runs the coroutine on the loop and waits for its result, the drop-in replacement for asyncio.run in request handlers.'''
+        if self._thread is not None and threading.current_thread() is self._thread:
+            coroutine.close()
+            raise RuntimeError('{} loop: run() would deadlock when called from the loop itself, await instead'.format(self.name))
+        return self.submit(coroutine).result(timeout)
+
+    async def wait_for(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        '''Awaits the coroutine on this loop from any other event loop (e.g. the ASGI server's) without blocking a thread.'''
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not None and running is self._loop:
+            return await coroutine
+        return await asyncio.wrap_future(self.submit(coroutine))
+
+    def stop(self) -> None:
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+
+
+AZURE_LOOP = BackgroundLoop('azure-openai')
+
+
+def run_async(coroutine: Coroutine[Any, Any, T], timeout: Optional[float] = None) -> T:
+    return AZURE_LOOP.run(coroutine, timeout=timeout)
+
+
+async def await_async(coroutine: Coroutine[Any, Any, T]) -> T:
+    '''The async counterpart of `run_async`, for coroutines already running on another event loop.'''
+    return await AZURE_LOOP.wait_for(coroutine)
+
+
+_clients: Dict[Tuple[str, str, str], AsyncAzureOpenAI] = {}
+_clients_lock = threading.Lock()
+
+# Called with every Azure OpenAI HTTP response, SDK retries included, e.g. to read the rate limit headers
+RESPONSE_LISTENERS: List[Callable[[httpx.Response], None]] = []
+
+
+async def _notify_listeners(response: httpx.Response) -> None:
+    for listener in RESPONSE_LISTENERS:
+        try:
+            listener(response)
+        except Exception as err:
+            log(response_listener_failed=err)
+
+
+def _http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        event_hooks={'response': [_notify_listeners]},
+        http2=AZURE_HTTP2,
+        limits=httpx.Limits(
+            max_connections=AZURE_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=AZURE_HTTP_MAX_CONNECTIONS,
+            keepalive_expiry=AZURE_HTTP_KEEPALIVE_SEC),
+        timeout=httpx.Timeout(AZURE_HTTP_TIMEOUT_SEC, connect=10.0))
+
+
+def shared_chat_client(env_config: Any) -> AsyncAzureOpenAI:
+    '''
+    The process-wide AsyncAzureOpenAI client for `env_config`'s endpoint, api version and key, on a pooled (HTTP/2 when available) transport.
+    Only use it from coroutines run with `run_async` or `await_async`, its connections belong to AZURE_LOOP.
+    '''
+    return chat_client(env_config.azure_ai_endpoint, env_config.azure_ai_version, env_config.azure_ai_api_key)
+
+
+def chat_client(endpoint: str, api_version: str, api_key: str) -> AsyncAzureOpenAI:
+    key = (endpoint, api_version, api_key)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = AsyncAzureOpenAI(
+                    api_key=api_key,
+                    api_version=api_version,
+                    azure_endpoint=endpoint,
+                    max_retries=2,
+                    http_client=_http_client())
+                _clients[key] = client
+                log(created_azure_client=endpoint, http2=AZURE_HTTP2)
+    return client
+
+
+async def warm_connection(client: AsyncAzureOpenAI) -> bool:
+    '''Opens a pooled connection (DNS, TCP, TLS and HTTP/2 setup) with a cheap models listing.'''
+    try:
+        await client.with_options(max_retries=0, timeout=10.0).models.list()
+        return True
+    except Exception as err:
+        log(warm_azure_connection_failed=err)
+        return False
+
+
+def close_shared_clients(timeout: float = 5.0) -> None:
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        try:
+            run_async(client.close(), timeout=timeout)
+        except Exception as err:
+            log(azure_client_close_failed=err)
@@ -0,0 +1,99 @@
+from abc import ABC, abstractmethod
+from enum import Enum
+from typing import Any, List, Optional
+import os
+from utils import log
+from .circuit_breaker import CircuitOpenError, azure_failure
+
+# Answers offered while Azure OpenAI is unavailable (circuit open, timeouts, 5xx)
+CLARIFY_FALLBACK_MAX_ANSWERS = int(os.environ.get('CLARIFY_FALLBACK_MAX_ANSWERS', 4))
+# Answers built from issue observations are cut to the length the model's answers are held to (see the 'clarify' instructions)
+CANDIDATE_ANSWER_MAX_WORDS = int(os.environ.get('CANDIDATE_ANSWER_MAX_WORDS', 4))
+
+_LEADING_WORDS = {'a', 'an', 'the'}
+# Words a cut label shouldn't end on
+_DANGLING_WORDS = _LEADING_WORDS | {'and', 'or', 'and/or', 'of', 'from', 'to', 'in', 'on', 'at', 'for', 'with', 'by', 'between', 'is', 'are', 'not'}
+
+
+def answer_label(observation: Optional[str], max_words: int = CANDIDATE_ANSWER_MAX_WORDS) -> str:
+    '''
+    A short answer label from an issue observation: its first `max_words` words, without a leading article
+    or a dangling connective. Ex: 'A fastener protrudes from a decking board' -> 'Fastener protrudes'
+    '''
+    words = (observation or '').strip().rstrip('.').split()
+    if len(words) > 1 and words[0].lower() in _LEADING_WORDS:
+        words = words[1:]
+    if max_words > 0 and len(words) > max_words:
+        words = words[:max_words]
+        while len(words) > 1 and words[-1].lower().rstrip(',;:') in _DANGLING_WORDS:
+            words.pop()
+    label = ' '.join(words).rstrip(',;:')
+    return label[:1].upper() + label[1:]
+
+
+class ResponsePath(Enum):
+    llm = "llm" # Question and answers written by the Azure model
+    local = "local" # Built from the local matcher's candidates, no Azure call
+    fallback = "fallback" # Azure unavailable, built from the lexically best matching flows
+
+
+class CandidateQuestions(ABC):
+    '''
+    Copilot questions built from candidate issues instead of by the model, each issue's flow offered as an answer:
+    the local fast path, and the fallback while Azure OpenAI is unavailable.
+
+    Mixed into the clarify classes of both endpoints, which provide `topic_training_data` and `instructions_model`.
+    '''
+
+    @property
+    @abstractmethod
+    def answer_format(self) -> type:
+        '''The endpoint's CopilotAnswerFormat.'''
+
+    @property
+    @abstractmethod
+    def question_format(self) -> type:
+        '''The endpoint's CopilotQuestionFormat.'''
+
+    def can_fall_back(self, err: Exception) -> bool:
+        return (isinstance(err, CircuitOpenError) or azure_failure(err)) and bool(self.topic_training_data.topic_id)
+
+    def fallback_candidates(self, user_input: Optional[str]) -> List[Any]:
+        '''The subtopic's flows that best match the input lexically (BM25). No embeddings ranker, the embeddings endpoint is Azure too.'''
+        return self.instructions_model.subtopic_issues.fallback_candidates(user_input, CLARIFY_FALLBACK_MAX_ANSWERS)
+
+    def fallback_copilot_question(self, user_input: Optional[str], err: Exception) -> Any:
+        '''The answer while Azure OpenAI is unavailable, built from `fallback_candidates`.'''
+        candidates = self.fallback_candidates(user_input)
+        log(served_by=ResponsePath.fallback.value, candidates=len(candidates), azure_error=err)
+        return self.candidate_copilot_question(candidates, served_by=ResponsePath.fallback)
+
+    def candidate_copilot_question(self, candidates: List[Any], served_by: ResponsePath = ResponsePath.local) -> Any:
+        topic_id = self.topic_training_data.topic_id
+        copilot_answers = [
+            self._answer(
+                DisplayName=answer_label(issue.observation),
+                ExternalIntentId=issue.associated_copilot_flow,
+                Score=50,
+                TopicId=topic_id + ".topic." + issue.associated_copilot_flow,
+                TriggerId=issue.associated_copilot_flow,
+                closest_matching_issue_number=issue.issue_number)
+            for issue in candidates]
+        copilot_answers.append(self._answer(
+            DisplayName='Not listed',
+            ExternalIntentId="None",
+            Score=0,
+            TopicId=topic_id + ".topic." + "None",
+            TriggerId="None",
+            closest_matching_issue_number=0))
+        question_text = 'Which of these best describes the issue with your home\'s {0}, specifically the {1}?'.format(
+            self.question_topic(), self.instructions_model.subtopic.replace('_', ' '))
+        return self.question_format(question_text=question_text, copilot_answer_set=copilot_answers, served_by=served_by.value)
+
+    def question_topic(self) -> str:
+        '''The topic the question names, the topic data's display name when it has one.'''
+        return self.instructions_model.topic or self.instructions_model.copilot
+
+    def _answer(self, **fields: Any) -> Any:
+        # clarify_issue's answers have no closest_matching_issue_number
+        return self.answer_format(**{name: value for name, value in fields.items() if name in self.answer_format.model_fields})
@@ -0,0 +1,144 @@
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+import asyncio
+import os
+import time
+from openai import APIConnectionError
+from utils import log
+
+CIRCUIT_BREAKER = os.environ.get('CIRCUIT_BREAKER', '1') == '1'
+# The circuit opens once this fraction of the last CIRCUIT_WINDOW calls failed or were slow, over at least CIRCUIT_MIN_CALLS
+CIRCUIT_FAILURE_RATE = float(os.environ.get('CIRCUIT_FAILURE_RATE', 0.5))
+CIRCUIT_WINDOW = int(os.environ.get('CIRCUIT_WINDOW', 20))
+CIRCUIT_MIN_CALLS = int(os.environ.get('CIRCUIT_MIN_CALLS', 10))
+CIRCUIT_SLOW_CALL_SEC = float(os.environ.get('CIRCUIT_SLOW_CALL_SEC', 15))
+# Calls are abandoned (and count as failed) after this long, rather than waiting out the SDK's timeouts and retries
+CIRCUIT_CALL_TIMEOUT_SEC = float(os.environ.get('CIRCUIT_CALL_TIMEOUT_SEC', 30))
+# Open this long, then half-open: up to CIRCUIT_PROBES calls at a time go through, CIRCUIT_PROBES successes in a row close it
+CIRCUIT_OPEN_SEC = float(os.environ.get('CIRCUIT_OPEN_SEC', 30))
+CIRCUIT_PROBES = int(os.environ.get('CIRCUIT_PROBES', 2))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+T = TypeVar('T')
+
+
+class CircuitOpenError(RuntimeError):
+    '''Azure OpenAI isn't called while the circuit is open.'''
+
+    def __init__(self, name: str, retry_after: float) -> None:
+        super().__init__('circuit {} is open, retry after {:.1f}s'.format(name, retry_after))
+        self.retry_after = retry_after
+
+
+def azure_failure(err: BaseException) -> bool:
+    '''Errors that mean Azure is degraded: timeouts, 429s, 5xx and connection errors. Not bad requests or our own load shedding.'''
+    status = getattr(err, 'status_code', None)
+    return isinstance(err, (asyncio.TimeoutError, APIConnectionError)) or status == 429 or (status is not None and status >= 500)
+
+
+class CircuitBreaker:
+    '''
+    Stops calling Azure OpenAI while it's failing or slow, so requests get a fallback at once instead of each one
+    waiting out timeouts. Closed, it tracks the outcome of the last `window` calls and opens when too many failed
+    (`azure_failure`) or took longer than `slow_call_sec`. Open, every call fails fast with CircuitOpenError. After
+    `open_sec` it's half-open: `probes` calls go through, and it closes once that many succeed in a row, or opens
+    again on the first failure.
+
+    Used from AZURE_LOOP only.
+    '''
+
+    def __init__(self, name: str, enabled: bool = CIRCUIT_BREAKER, failure_rate: float = CIRCUIT_FAILURE_RATE, window: int = CIRCUIT_WINDOW, min_calls: int = CIRCUIT_MIN_CALLS, slow_call_sec: float = CIRCUIT_SLOW_CALL_SEC, call_timeout_sec: float = CIRCUIT_CALL_TIMEOUT_SEC, open_sec: float = CIRCUIT_OPEN_SEC, probes: int = CIRCUIT_PROBES, clock: Callable[[], float] = time.monotonic) -> None:
+        self.name = name
+        self.enabled = enabled
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.slow_call_sec = slow_call_sec
+        self.call_timeout_sec = call_timeout_sec
+        self.open_sec = open_sec
+        self.probes = probes
+        self.clock = clock
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def closed(self) -> bool:
+        return self.state == CLOSED
+
+    def acquire(self) -> None:
+        '''Lets a call through, or raises CircuitOpenError. Every acquired call must be `record`ed.'''
+        if not self.enabled or self.state == CLOSED:
+            return
+        if self.state == OPEN:
+            retry_after = self.opened_at + self.open_sec - self.clock()
+            if retry_after > 0:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, retry_after)
+            self._transition(HALF_OPEN)
+        if self.probes_in_flight >= self.probes:
+            self.rejected += 1
+            raise CircuitOpenError(self.name, 0.0)
+        self.probes_in_flight += 1
+
+    def record(self, seconds: Optional[float], err: Optional[BaseException] = None) -> None:
+        if not self.enabled:
+            return
+        if err is not None and not azure_failure(err):
+            # Cancelled, a bad request or shed: says nothing about Azure's health
+            if self.state == HALF_OPEN:
+                self.probes_in_flight = max(0, self.probes_in_flight - 1)
+            return
+        failed = err is not None or (seconds is not None and seconds > self.slow_call_sec)
+        if self.state == HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+            if failed:
+                self._transition(OPEN)
+            else:
+                self.probe_successes += 1
+                if self.probe_successes >= self.probes:
+                    self._transition(CLOSED)
+            return
+        if self.state == OPEN:
+            # A call that started before the circuit opened
+            return
+        self.outcomes.append(failed)
+        if len(self.outcomes) >= self.min_calls and sum(self.outcomes) >= self.failure_rate * len(self.outcomes):
+            self._transition(OPEN)
+
+    def _transition(self, state: str) -> None:
+        log(circuit=self.name, state=state, failures=sum(self.outcomes), calls=len(self.outcomes))
+        self.state = state
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+        if state == OPEN:
+            self.opened += 1
+            self.opened_at = self.clock()
+        elif state == CLOSED:
+            self.outcomes.clear()
+
+    async def call(self, call: Callable[[], Awaitable[T]]) -> T:
+        '''Runs `call` through the breaker, abandoning it after `call_timeout_sec`.'''
+        self.acquire()
+        started = self.clock()
+        try:
+            result = await asyncio.wait_for(call(), self.call_timeout_sec) if self.enabled else await call()
+        except BaseException as err:
+            self.record(self.clock() - started, err)
+            raise
+        self.record(self.clock() - started)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'failures': sum(self.outcomes),
+            'calls': len(self.outcomes),
+            'opened': self.opened,
+            'rejected': self.rejected}
@@ -0,0 +1,393 @@
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+import asyncio
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+import httpx
+from openai import APIConnectionError, AsyncAzureOpenAI
+from utils import log
+from .azure_client import RESPONSE_LISTENERS, chat_client
+from .circuit_breaker import CircuitBreaker
+from .rate_limits import AZURE_RPM_LIMIT, AZURE_TPM_LIMIT, LoadShedError, Priority, RateLimiter, Ticket, usage_tokens
+
+# Extra deployments of the same model, as a JSON list. Only "endpoint" is required, the rest default to the primary's:
+# [{"name": "eastus", "endpoint": "https://<resource>.openai.azure.com", "deployment": "gpt-4o", "api_key_env": "AZURE_AI_API_KEY_EASTUS", "tpm": 150000, "rpm": 900}]
+AZURE_AI_DEPLOYMENT_POOL = os.environ.get('AZURE_AI_DEPLOYMENT_POOL', '')
+AZURE_HEDGING = os.environ.get('AZURE_HEDGING', '1') == '1'
+# A hedge goes to the next deployment once the first one is slower than this percentile of its recent latencies
+HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', 0.9))
+HEDGE_MIN_DELAY_SEC = float(os.environ.get('HEDGE_MIN_DELAY_SEC', 0.5))
+# Until a deployment has HEDGE_MIN_SAMPLES latencies
+HEDGE_DEFAULT_DELAY_SEC = float(os.environ.get('HEDGE_DEFAULT_DELAY_SEC', 3.0))
+HEDGE_MIN_SAMPLES = int(os.environ.get('HEDGE_MIN_SAMPLES', 20))
+# Hedges are capped at this fraction of calls, with bursts of up to HEDGE_BURST
+HEDGE_BUDGET_RATIO = float(os.environ.get('HEDGE_BUDGET_RATIO', 0.1))
+HEDGE_BURST = float(os.environ.get('HEDGE_BURST', 5))
+LATENCY_WINDOW = 200
+# Routing: weight of the latest call in a deployment's latency, 429 and error averages
+HEALTH_EWMA_ALPHA = float(os.environ.get('HEALTH_EWMA_ALPHA', 0.2))
+# A 429 ejects the deployment for its Retry-After, or this long without one
+THROTTLE_EJECT_SEC = float(os.environ.get('THROTTLE_EJECT_SEC', 10))
+# 5xx and connection errors eject it once their average is over ERROR_EJECT_RATE
+ERROR_EJECT_RATE = float(os.environ.get('ERROR_EJECT_RATE', 0.5))
+ERROR_EJECT_SEC = float(os.environ.get('ERROR_EJECT_SEC', 30))
+# Deployments close to their rate limit (x-ratelimit-remaining-* headers) are tried after the others
+LOW_REMAINING_TOKENS = int(os.environ.get('LOW_REMAINING_TOKENS', 4000))
+LOW_REMAINING_REQUESTS = int(os.environ.get('LOW_REMAINING_REQUESTS', 5))
+
+T = TypeVar('T')
+
+
+@dataclass(eq=False)
+class AzureDeployment:
+    '''
+    One Azure OpenAI deployment and its live health: recent latencies, EWMA latency, 429 and error rates and the
+    remaining tokens and requests of its rate limit. The primary is the deployment `EnvConfig` names.
+    '''
+    name: str
+    endpoint: str
+    deployment: str
+    api_version: str
+    api_key: str = field(repr=False)
+    primary: bool = False
+    tpm: int = AZURE_TPM_LIMIT
+    rpm: int = AZURE_RPM_LIMIT
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=LATENCY_WINDOW), repr=False)
+    calls: int = 0
+    errors: int = 0
+    throttled: int = 0
+    ewma_latency: Optional[float] = None
+    throttle_rate: float = 0.0
+    error_rate: float = 0.0
+    remaining_tokens: Optional[int] = None
+    remaining_requests: Optional[int] = None
+    ejected_until: float = 0.0
+
+    def client(self) -> AsyncAzureOpenAI:
+        return chat_client(self.endpoint, self.api_version, self.api_key)
+
+    def record(self, seconds: Optional[float] = None, error: bool = False) -> None:
+        self.calls += 1
+        if error:
+            self.errors += 1
+        elif seconds is not None:
+            self.latencies.append(seconds)
+
+    def _average(self, throttled: bool = False, failed: bool = False) -> None:
+        self.throttle_rate += HEALTH_EWMA_ALPHA * (throttled - self.throttle_rate)
+        self.error_rate += HEALTH_EWMA_ALPHA * (failed - self.error_rate)
+
+    def succeeded(self, seconds: float) -> None:
+        self.record(seconds)
+        self.ewma_latency = seconds if self.ewma_latency is None else self.ewma_latency + HEALTH_EWMA_ALPHA * (seconds - self.ewma_latency)
+        self._average()
+
+    def failed(self, err: Exception, now: float) -> bool:
+        '''Records a failed call, ejects the deployment when it's throttled or failing. True when another deployment may succeed.'''
+        self.record(error=True)
+        status = getattr(err, 'status_code', None)
+        if status == 429:
+            self.throttled += 1
+            self._average(throttled=True)
+            self.eject(now + (_retry_after(err) or THROTTLE_EJECT_SEC), reason='throttled')
+            return True
+        if isinstance(err, APIConnectionError) or (status is not None and status >= 500):
+            self._average(failed=True)
+            if self.error_rate > ERROR_EJECT_RATE:
+                self.eject(now + ERROR_EJECT_SEC, reason='failing')
+            return True
+        # Bad requests, auth errors, our own bugs: every deployment would fail the same way
+        return False
+
+    def eject(self, until: float, reason: str) -> None:
+        if until > self.ejected_until:
+            self.ejected_until = until
+            log(deployment_ejected=self.name, reason=reason, until=until)
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def observe_headers(self, headers: Any) -> None:
+        self.remaining_tokens = _int_header(headers, 'x-ratelimit-remaining-tokens', self.remaining_tokens)
+        self.remaining_requests = _int_header(headers, 'x-ratelimit-remaining-requests', self.remaining_requests)
+
+    def score(self, default_latency: float) -> float:
+        '''Expected cost of the next call, lower is better. Unmeasured deployments get `default_latency` so they get tried.'''
+        latency = default_latency if self.ewma_latency is None else self.ewma_latency
+        cost = latency * (1 + 4 * self.error_rate + 8 * self.throttle_rate)
+        if self.remaining_tokens is not None and self.remaining_tokens < LOW_REMAINING_TOKENS:
+            cost *= 4
+        if self.remaining_requests is not None and self.remaining_requests < LOW_REMAINING_REQUESTS:
+            cost *= 4
+        return cost
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'throttled': self.throttled,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'ewma_latency': self.ewma_latency,
+            'throttle_rate': round(self.throttle_rate, 3),
+            'error_rate': round(self.error_rate, 3),
+            'remaining_tokens': self.remaining_tokens,
+            'remaining_requests': self.remaining_requests,
+            'ejected_until': self.ejected_until}
+
+
+def _retry_after(err: Exception) -> Optional[float]:
+    response = getattr(err, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    for name, scale in (('retry-after-ms', 0.001), ('retry-after', 1.0)):
+        try:
+            return float(headers[name]) * scale
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+
+def _int_header(headers: Any, name: str, default: Optional[int]) -> Optional[int]:
+    try:
+        return int(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return default
+
+
+class HedgeBudget:
+    '''Every call earns `ratio` of a hedge, up to `burst` saved, so hedging can't multiply the load on Azure in an incident.'''
+
+    def __init__(self, ratio: float = HEDGE_BUDGET_RATIO, burst: float = HEDGE_BURST) -> None:
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+
+    def earn(self) -> None:
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def spend(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class DeploymentPool:
+    '''
+    Deployments serving the same model, routed by health: `candidates` orders the available deployments by EWMA
+    latency, 429 and error rates and rate limit headroom, ejected ones last. `call` runs a request against the best
+    deployment and, when it hasn't answered within its hedge delay (its rolling HEDGE_PERCENTILE latency), sends the
+    same request to the next one. The first answer wins and the other request is cancelled. Hedges are limited by a
+    HedgeBudget. A 429, 5xx or connection error fails over to the next deployment right away, instead of waiting out
+    the SDK's retries against the same throttled one.
+
+    Each deployment's client-side quota is a RateLimiter: a request waits there for its estimated tokens before it's
+    sent, deployments with quota to spare now are tried first, and a request shed by one deployment's limiter fails
+    over to the next. When every deployment sheds it, the LoadShedError reaches the caller.
+
+    All of it runs behind the pool's CircuitBreaker, which fails calls fast (CircuitOpenError) while Azure is degraded.
+
+    Calls run on AZURE_LOOP, the counters are only changed from there.
+    '''
+
+    def __init__(self, deployments: List[AzureDeployment], hedging: bool = AZURE_HEDGING, budget: Optional[HedgeBudget] = None, clock: Callable[[], float] = time.monotonic, breaker: Optional[CircuitBreaker] = None) -> None:
+        self.deployments = deployments
+        self.hedging = hedging
+        self.budget = budget or HedgeBudget()
+        self.clock = clock
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedges_over_budget = 0
+        self.failovers = 0
+        self.breaker = breaker or CircuitBreaker(deployments[0].name, clock=clock)
+        self.limiters = {deployment.name: RateLimiter(deployment.name, tpm=deployment.tpm, rpm=deployment.rpm, clock=clock) for deployment in deployments}
+
+    @property
+    def primary(self) -> AzureDeployment:
+        return self.deployments[0]
+
+    @property
+    def failover(self) -> bool:
+        '''With another deployment to fail over to, requests shouldn't be retried by the SDK.'''
+        return len(self.deployments) > 1
+
+    def candidates(self) -> List[AzureDeployment]:
+        '''The deployments to try for the next call, best first. Ejected ones come last, soonest back first.'''
+        if len(self.deployments) == 1:
+            return list(self.deployments)
+        now = self.clock()
+        available = [deployment for deployment in self.deployments if deployment.available(now)]
+        ejected = sorted((deployment for deployment in self.deployments if not deployment.available(now)), key=lambda deployment: deployment.ejected_until)
+        measured = [deployment.ewma_latency for deployment in available if deployment.ewma_latency is not None]
+        default_latency = min(measured) if measured else 1.0
+        # Ties (nothing measured yet) keep the configured order, the primary first
+        return sorted(available, key=lambda deployment: deployment.score(default_latency)) + ejected
+
+    async def acquire(self, deployment: AzureDeployment, cost: int, priority: Priority = Priority.interactive) -> Ticket:
+        '''Quota for a call made outside `call` (streams, prompt cache warm-ups).'''
+        return await self.limiters[deployment.name].acquire(cost, priority)
+
+    def hedge_delay(self, deployment: AzureDeployment) -> float:
+        if len(deployment.latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY_SEC
+        return max(HEDGE_MIN_DELAY_SEC, deployment.percentile(HEDGE_PERCENTILE))
+
+    def _start(self, deployment: AzureDeployment, request: Callable[[AzureDeployment], Awaitable[T]], cost: int, priority: Priority) -> "asyncio.Task[T]":
+        async def timed() -> T:
+            try:
+                ticket = await self.limiters[deployment.name].acquire(cost, priority)
+            except LoadShedError as err:
+                # Not the deployment's fault, but another one may have quota
+                err.retryable = True
+                raise
+            started = self.clock()
+            try:
+                result = await request(deployment)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                # Marks the exception for `call`'s failover
+                err.retryable = deployment.failed(err, self.clock())
+                raise
+            deployment.succeeded(self.clock() - started)
+            ticket.settle(usage_tokens(result))
+            return result
+        return asyncio.ensure_future(timed())
+
+    async def call(self, request: Callable[[AzureDeployment], Awaitable[T]], cost: int = 0, priority: Priority = Priority.interactive) -> T:
+        '''Runs `request`, a call of about `cost` tokens, on the best deployment. Raises the last deployment's error.'''
+        return await self.breaker.call(lambda: self._call(request, cost, priority))
+
+    async def _call(self, request: Callable[[AzureDeployment], Awaitable[T]], cost: int, priority: Priority) -> T:
+        self.calls += 1
+        self.budget.earn()
+        # Healthiest first among the deployments with quota for it now, then the ones it would queue for
+        remaining = sorted(self.candidates(), key=lambda deployment: self.limiters[deployment.name].delay(cost, priority) > 0)
+        while True:
+            first = remaining.pop(0)
+            try:
+                return await self._hedged(first, remaining, request, cost, priority)
+            except Exception as err:
+                if not (getattr(err, 'retryable', False) and remaining):
+                    raise
+                self.failovers += 1
+                log(failed_over=first.name, to=remaining[0].name, error=err)
+
+    async def _hedged(self, first: AzureDeployment, others: List[AzureDeployment], request: Callable[[AzureDeployment], Awaitable[T]], cost: int, priority: Priority) -> T:
+        '''Runs `request` on `first`, hedged to `others[0]`, which is taken off `others` once it's been tried.'''
+        first_task = self._start(first, request, cost, priority)
+        if not (self.hedging and others):
+            return await first_task
+        tasks = {first_task: first}
+        try:
+            done, _ = await asyncio.wait({first_task}, timeout=self.hedge_delay(first))
+            if done:
+                return first_task.result()
+            if not self.budget.spend():
+                self.hedges_over_budget += 1
+                return await first_task
+            self.hedges += 1
+            hedge = others.pop(0)
+            hedge_task = self._start(hedge, request, cost, priority)
+            tasks[hedge_task] = hedge
+            log(hedged=first.name, to=hedge.name)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.hedge_wins += 1 if task is hedge_task else 0
+                        return task.result()
+            # Both failed, report the first deployment's error
+            return first_task.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'hedges_over_budget': self.hedges_over_budget,
+            'failovers': self.failovers,
+            'circuit': self.breaker.stats(),
+            'deployments': {deployment.name: {**deployment.stats(), 'quota': self.limiters[deployment.name].stats()} for deployment in self.deployments}}
+
+
+def _configured_deployments(primary: AzureDeployment) -> List[AzureDeployment]:
+    if not AZURE_AI_DEPLOYMENT_POOL:
+        return []
+    try:
+        entries = json.loads(AZURE_AI_DEPLOYMENT_POOL)
+        return [
+            AzureDeployment(
+                name=entry.get('name') or entry['endpoint'],
+                endpoint=entry['endpoint'],
+                deployment=entry.get('deployment', primary.deployment),
+                api_version=entry.get('api_version', primary.api_version),
+                api_key=os.environ.get(entry['api_key_env'], '') if entry.get('api_key_env') else primary.api_key,
+                tpm=int(entry.get('tpm', primary.tpm)),
+                rpm=int(entry.get('rpm', primary.rpm)))
+            for entry in entries
+            if entry['endpoint'] != primary.endpoint or entry.get('deployment', primary.deployment) != primary.deployment]
+    except (ValueError, KeyError, TypeError, AttributeError) as err:
+        log(deployment_pool_ignored=err)
+        return []
+
+
+_pools: Dict[Tuple[str, str], DeploymentPool] = {}
+_pools_lock = threading.Lock()
+# (host, deployment) to the deployment whose rate limit headers a response carries
+_routes: Dict[Tuple[str, str], AzureDeployment] = {}
+
+
+def _route(endpoint: str, deployment: str) -> Tuple[str, str]:
+    return (urlparse(endpoint).netloc.lower(), deployment)
+
+
+def _observe_rate_limits(response: httpx.Response) -> None:
+    # Azure OpenAI paths are /openai/deployments/<deployment>/chat/completions
+    parts = response.request.url.path.split('/')
+    if 'deployments' not in parts[:-1]:
+        return
+    deployment = _routes.get((response.request.url.host.lower(), parts[parts.index('deployments') + 1]))
+    if deployment is not None:
+        deployment.observe_headers(response.headers)
+
+
+RESPONSE_LISTENERS.append(_observe_rate_limits)
+
+
+def shared_deployment_pool(env_config: Any, deployment: str) -> DeploymentPool:
+    '''The process-wide pool whose primary is `env_config`'s endpoint and `deployment`, latencies are shared by every request.'''
+    key = (env_config.azure_ai_endpoint, deployment)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                primary = AzureDeployment(
+                    name=deployment,
+                    endpoint=env_config.azure_ai_endpoint,
+                    deployment=deployment,
+                    api_version=env_config.azure_ai_version,
+                    api_key=env_config.azure_ai_api_key,
+                    primary=True)
+                pool = DeploymentPool([primary] + _configured_deployments(primary))
+                for member in pool.deployments:
+                    _routes[_route(member.endpoint, member.deployment)] = member
+                _pools[key] = pool
+    return pool
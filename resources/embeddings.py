@@ -0,0 +1,207 @@
+from typing import Any, Dict, List, Optional, Protocol, Sequence, Tuple
+import threading
+import hashlib
+import json
+import os
+import sys
+import numpy as np
+from openai import AzureOpenAI
+from utils import log, EnvConfig, BuildEnv
+from utils.retrieval import tokenize
+
+EMBEDDING_INDEX_PATH = os.environ.get('EMBEDDING_INDEX_PATH', 'combined_training_data.embeddings.npy')
+EMBEDDING_PROVIDER = os.environ.get('EMBEDDING_PROVIDER', 'azure') # 'azure' in production, 'hashing' for tests and local runs
+CANDIDATE_RANKER = os.environ.get('CANDIDATE_RANKER', 'bm25') # 'embedding' ranks prompt candidates with EmbeddingIndex
+
+
+class Embedder(Protocol):
+    name: str
+    dimensions: int
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        '''Returns a (len(texts), dimensions) float32 matrix.'''
+        ...
+
+
+class HashingEmbedder:
+    '''
+    Deterministic, dependency free embedder: hashes word and character trigram features into a fixed number of signed buckets.
+    Good enough to test the retrieval path end to end without an embeddings deployment.
+    '''
+
+    def __init__(self, dimensions: int = 256) -> None:
+        self.name = 'hashing-{}'.format(dimensions)
+        self.dimensions = dimensions
+
+    def _features(self, text: str) -> List[str]:
+        words = tokenize(text)
+        trigrams = ['#' + word[i:i + 3] for word in words for i in range(max(len(word) - 2, 1))]
+        return words + trigrams
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], 'little') % self.dimensions
+                matrix[row, bucket] += 1.0 if digest[4] & 1 else -1.0
+        return matrix
+
+
+class AzureEmbedder:
+    '''Embeddings from the Azure OpenAI embeddings deployment configured in EnvConfig.'''
+
+    def __init__(self, env_config: Optional[EnvConfig] = None, batch_size: int = 256) -> None:
+        self.env_config = env_config or EnvConfig(env=BuildEnv.dev.value)
+        self.name = 'azure-{}'.format(self.env_config.azure_ai_embedding_deployment_name)
+        self.dimensions = 0 # Known after the first call
+        self.batch_size = batch_size
+        self.client = AzureOpenAI(
+            api_key=self.env_config.azure_ai_api_key,
+            api_version=self.env_config.azure_ai_version,
+            azure_endpoint=self.env_config.azure_ai_endpoint, max_retries=2)
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        rows: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            response = self.client.embeddings.create(
+                model=self.env_config.azure_ai_embedding_deployment_name,
+                input=list(texts[start:start + self.batch_size]))
+            rows.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+        matrix = np.asarray(rows, dtype=np.float32)
+        self.dimensions = matrix.shape[1] if matrix.ndim == 2 else 0
+        return matrix
+
+
+def text_key(text: str | None) -> str:
+    return hashlib.sha1((text or '').strip().encode('utf-8')).hexdigest()
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class EmbeddingIndex:
+    '''
+    Unit-normalized float16 observation embeddings in a .npy file, memory-mapped at load.
+    Rows are keyed by a hash of the observation text, so json and Firestore issues share rows.
+    A json sidecar records which embedder built the matrix and the row keys.
+    '''
+
+    def __init__(self, matrix: np.ndarray, keys: Sequence[str], embedder_name: str) -> None:
+        self.matrix = matrix
+        self.embedder_name = embedder_name
+        self.rows: Dict[str, int] = {key: row for row, key in enumerate(keys)}
+
+    @staticmethod
+    def sidecar_path(path: str) -> str:
+        return os.path.splitext(path)[0] + '.json'
+
+    @classmethod
+    def build(cls, texts: Sequence[str], embedder: Embedder) -> "EmbeddingIndex":
+        unique_texts = list(dict.fromkeys(text.strip() for text in texts if text and text.strip()))
+        matrix = _normalize(embedder.embed(unique_texts)).astype(np.float16)
+        return cls(matrix, [text_key(text) for text in unique_texts], embedder.name)
+
+    def save(self, path: str) -> str:
+        temp_path = path + '.tmp.npy'
+        np.save(temp_path, self.matrix)
+        os.replace(temp_path, path)
+        keys = [key for key, _ in sorted(self.rows.items(), key=lambda item: item[1])]
+        with open(self.sidecar_path(path), 'w') as sidecar:
+            json.dump({'embedder': self.embedder_name, 'keys': keys}, sidecar)
+        log(saved_embedding_index=path, rows=len(keys), dimensions=self.matrix.shape[1])
+        return path
+
+    @classmethod
+    def load(cls, path: str = EMBEDDING_INDEX_PATH) -> "EmbeddingIndex":
+        with open(cls.sidecar_path(path), 'r') as sidecar:
+            meta = json.load(sidecar)
+        return cls(np.load(path, mmap_mode='r'), meta['keys'], meta['embedder'])
+
+    def row_ids(self, texts: Sequence[str | None]) -> List[Optional[int]]:
+        return [self.rows.get(text_key(text)) for text in texts]
+
+    def top_k(self, queries: np.ndarray, k: int, rows: Optional[Sequence[int]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Batched cosine similarity: (B, d) query embeddings against all rows, or only `rows` when given.
+        Returns (B, k) row ids and scores, best first.
+        '''
+        candidates = np.asarray(rows if rows is not None else range(self.matrix.shape[0]), dtype=np.int64)
+        if candidates.size == 0:
+            empty = np.zeros((len(queries), 0))
+            return empty.astype(np.int64), empty
+        vectors = np.asarray(self.matrix[candidates], dtype=np.float32)
+        similarities = _normalize(np.atleast_2d(queries).astype(np.float32)) @ vectors.T
+        k = min(k, candidates.size)
+        best = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(similarities, best, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best = np.take_along_axis(best, order, axis=1)
+        return candidates[best], np.take_along_axis(best_scores, order, axis=1)
+
+
+class EmbeddingRanker:
+    '''
+    Ranks a subtopic's issues by cosine similarity between the user's input and each observation.
+    Returns None when any issue is missing from the index, so the caller can fall back to BM25.
+    '''
+
+    def __init__(self, index: EmbeddingIndex, embedder: Embedder) -> None:
+        self.index = index
+        self.embedder = embedder
+
+    def __call__(self, issues: Sequence[Any], query: str) -> Optional[List[Tuple[Any, float]]]:
+        row_ids = self.index.row_ids([issue.observation for issue in issues])
+        if not issues or any(row_id is None for row_id in row_ids):
+            return None
+        query_vector = self.embedder.embed([query])
+        best_rows, best_scores = self.index.top_k(query_vector, k=len(row_ids), rows=row_ids)
+        issue_by_row = {row_id: issue for row_id, issue in zip(row_ids, issues)}
+        return [(issue_by_row[int(row_id)], float(score)) for row_id, score in zip(best_rows[0], best_scores[0])]
+
+
+def create_embedder(provider: str = EMBEDDING_PROVIDER) -> Embedder:
+    return HashingEmbedder() if provider == 'hashing' else AzureEmbedder()
+
+
+_shared_ranker: Optional[EmbeddingRanker] = None
+_shared_ranker_loaded = False
+_shared_ranker_lock = threading.Lock()
+
+
+def candidate_ranker() -> Optional[EmbeddingRanker]:
+    '''
+    The process-wide embedding ranker when CANDIDATE_RANKER is 'embedding' and a matching index exists, otherwise None (BM25).
+    '''
+    global _shared_ranker, _shared_ranker_loaded
+    if CANDIDATE_RANKER != 'embedding':
+        return None
+    if not _shared_ranker_loaded:
+        with _shared_ranker_lock:
+            if not _shared_ranker_loaded:
+                try:
+                    index = EmbeddingIndex.load(EMBEDDING_INDEX_PATH)
+                    embedder = create_embedder()
+                    if index.embedder_name != embedder.name:
+                        raise ValueError('index built with {}, configured embedder is {}'.format(index.embedder_name, embedder.name))
+                    _shared_ranker = EmbeddingRanker(index, embedder)
+                except Exception as err:
+                    log(embedding_index_unavailable=err)
+                _shared_ranker_loaded = True
+    return _shared_ranker
+
+
+def compile_embedding_index(source_path: str = 'combined_training_data.json', output_path: str = EMBEDDING_INDEX_PATH, provider: str = EMBEDDING_PROVIDER) -> str:
+    '''Build step: embeds every observation in the training data json.'''
+    with open(source_path, 'r') as json_file:
+        raw_topics: Dict[str, dict] = json.load(json_file)
+    observations = [issue.get('observation', '') for topic in raw_topics.values() for issue in topic.get('issues', [])]
+    return EmbeddingIndex.build(observations, create_embedder(provider)).save(output_path)
+
+
+if __name__ == '__main__':
+    # python -m resources.embeddings [source.json] [output.npy] [azure|hashing]
+    compile_embedding_index(*sys.argv[1:4])
@@ -0,0 +1,61 @@
+from typing import Any, Dict, List, Optional
+import threading
+from utils import log
+
+# User message of the cold start completion, only the messages before it need to match the real requests
+COLD_START_USER_PROMPT = 'Ready.'
+
+
+def prompt_messages(system_prompt: List[str], user_prompt: List[str], topic_instructions: Optional[List[str]] = None, context_instructions: Optional[List[str]] = None) -> List[Dict[str, str]]:
+    '''
+    Chat messages ordered from most to least stable, so Azure OpenAI's automatic prompt caching can reuse the longest prefix:
+    the subtopic's system prompt (by default with its whole \'topic_list\', see TOPIC_LIST_PLACEMENT), then the resource type's
+    task instructions, then any per request context (e.g. a shortlisted \'topic_list\'), then the user's input.
+    Azure only caches prompts of 1024 tokens or more, in 128 token steps. Empty sections are left out rather than sent as blank messages.
+    '''
+    messages = [{"role": "system", "content": ' '.join(system_prompt)}]
+    for instructions in (topic_instructions, context_instructions):
+        if instructions:
+            messages.append({"role": "system", "content": ' '.join(instructions)})
+    messages.append({"role": "user", "content": ' '.join(user_prompt)})
+    return messages
+
+
+class PromptCacheUsage:
+    '''Process-wide prompt and cached token totals from the `usage` of every completion.'''
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.cache_hits = 0
+
+    def record(self, response: Any, **context: Any) -> Optional[int]:
+        '''Records and logs one completion's usage, returns its cached token count.'''
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return None
+        prompt_tokens = usage.prompt_tokens or 0
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached_tokens = (getattr(details, 'cached_tokens', None) or 0) if details else 0
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+            self.cache_hits += 1 if cached_tokens else 0
+            hit_rate = self.cache_hits / self.requests
+        log(prompt_tokens=prompt_tokens, cached_tokens=cached_tokens, prompt_cache_hit_rate=round(hit_rate, 3), **context)
+        return cached_tokens
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'prompt_tokens': self.prompt_tokens,
+                'cached_tokens': self.cached_tokens,
+                'hit_rate': self.cache_hits / self.requests if self.requests else 0.0,
+                'cached_token_ratio': self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0}
+
+
+PROMPT_CACHE_USAGE = PromptCacheUsage()
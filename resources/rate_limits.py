@@ -0,0 +1,238 @@
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from utils import log
+from utils.tokens import count_tokens
+
+# Each deployment's quota as deployed in Azure, 0 leaves that limit to Azure. Pool entries can set their own "tpm"/"rpm"
+AZURE_TPM_LIMIT = int(os.environ.get('AZURE_TPM_LIMIT', 0))
+AZURE_RPM_LIMIT = int(os.environ.get('AZURE_RPM_LIMIT', 0))
+# Azure enforces the per minute quota over shorter windows, a bucket holds this many seconds of it
+RATE_LIMIT_BURST_SEC = float(os.environ.get('RATE_LIMIT_BURST_SEC', 10))
+# Completion tokens counted against TPM until the response's usage is known
+EXPECTED_OUTPUT_TOKENS = int(os.environ.get('EXPECTED_OUTPUT_TOKENS', 400))
+# Requests expected to wait longer than this for quota are shed (LoadShedError) instead of queued
+INTERACTIVE_MAX_QUEUE_SEC = float(os.environ.get('INTERACTIVE_MAX_QUEUE_SEC', 5))
+COLD_START_MAX_QUEUE_SEC = float(os.environ.get('COLD_START_MAX_QUEUE_SEC', 15))
+BATCH_MAX_QUEUE_SEC = float(os.environ.get('BATCH_MAX_QUEUE_SEC', 120))
+RATE_LIMIT_MAX_QUEUED = int(os.environ.get('RATE_LIMIT_MAX_QUEUED', 256))
+
+
+class Priority(IntEnum):
+    interactive = 0
+    cold_start = 1
+    batch = 2
+
+
+MAX_QUEUE_SEC = {
+    Priority.interactive: INTERACTIVE_MAX_QUEUE_SEC,
+    Priority.cold_start: COLD_START_MAX_QUEUE_SEC,
+    Priority.batch: BATCH_MAX_QUEUE_SEC}
+
+
+class LoadShedError(RuntimeError):
+    '''A request the rate limiter won't queue: its wait for quota would be too long or the queue is full.'''
+
+    def __init__(self, deployment: str, priority: Priority, retry_after: float) -> None:
+        super().__init__('{} request shed by {}, retry after {:.1f}s'.format(priority.name, deployment, retry_after))
+        self.deployment = deployment
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+def shed_response(err: LoadShedError, headers: Dict[str, str]) -> Tuple[Dict[str, str], int, Dict[str, str]]:
+    '''A handler's response to a shed request, 503 with the limiter's Retry-After.'''
+    return ({"response": str(err)}, 503, {**headers, "Retry-After": str(math.ceil(err.retry_after))})
+
+
+def estimate_tokens(messages: Iterable[Dict[str, Any]], expected_output: int = EXPECTED_OUTPUT_TOKENS) -> int:
+    '''A request's TPM cost before it's sent: its prompt tokens plus the completion we expect.'''
+    return sum(count_tokens(message.get('content') if isinstance(message.get('content'), str) else None) for message in messages) + expected_output
+
+
+def usage_tokens(ai_response: Any) -> Optional[int]:
+    return getattr(getattr(ai_response, 'usage', None), 'total_tokens', None)
+
+
+class TokenBucket:
+    '''`per_minute` refilled continuously, holding up to `burst_sec` of it. Settling a request can leave it in debt.'''
+
+    def __init__(self, per_minute: float, burst_sec: float = RATE_LIMIT_BURST_SEC, clock: Callable[[], float] = time.monotonic) -> None:
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_sec)
+        self.level = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        '''Seconds until `amount` can be taken.'''
+        self._refill()
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def fit(self, amount: float) -> float:
+        # A request larger than the bucket waits for a full one
+        return min(amount, self.capacity)
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.level -= amount
+
+    def give(self, amount: float) -> None:
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+@dataclass(eq=False)
+class Ticket:
+    '''One request's claim on a deployment's quota, `cost` being its estimated tokens.'''
+    cost: int
+    priority: Priority
+    deadline: float
+    granted: bool = False
+    error: Optional[LoadShedError] = None
+    waiter: Optional["asyncio.Future[None]"] = field(default=None, repr=False)
+    limiter: Optional["RateLimiter"] = field(default=None, repr=False)
+
+    def settle(self, actual_tokens: Optional[int]) -> None:
+        '''Corrects the estimate once the response's usage is known.'''
+        if self.limiter is not None and self.limiter.tokens is not None and actual_tokens is not None:
+            self.limiter.tokens.give(self.cost - actual_tokens)
+
+
+class RateLimiter:
+    '''
+    Client-side TPM and RPM token buckets for one deployment, with a priority queue in front of them.
+
+    Requests are granted in priority order, lower priorities only get the quota no higher priority request is waiting
+    for, so cold starts and batch work soak up spare quota without adding latency to interactive requests. A request
+    whose expected wait (the quota queued ahead of it at its priority or higher) is over its priority's MAX_QUEUE_SEC
+    is shed right away, queued ones are shed when a higher priority request pushes them past their deadline, and a
+    full queue sheds its lowest priority request first.
+
+    Used from AZURE_LOOP only.
+    '''
+
+    def __init__(self, name: str, tpm: int = AZURE_TPM_LIMIT, rpm: int = AZURE_RPM_LIMIT, clock: Callable[[], float] = time.monotonic, max_queue_sec: Optional[Dict[Priority, float]] = None, max_queued: int = RATE_LIMIT_MAX_QUEUED) -> None:
+        self.name = name
+        self.tokens = TokenBucket(tpm, clock=clock) if tpm > 0 else None
+        self.requests = TokenBucket(rpm, clock=clock) if rpm > 0 else None
+        self.clock = clock
+        self.max_queue_sec = max_queue_sec or MAX_QUEUE_SEC
+        self.max_queued = max_queued
+        self._queue: List[Any] = []
+        self._order = itertools.count()
+        self.granted = 0
+        self.queued = 0
+        self.shed: Dict[str, int] = {priority.name: 0 for priority in Priority}
+
+    @property
+    def enabled(self) -> bool:
+        return self.tokens is not None or self.requests is not None
+
+    def _wait_time(self, costs: List[int]) -> float:
+        '''Seconds until requests of `costs` tokens, taken in turn, have all been granted.'''
+        return max(
+            self.tokens.wait_time(sum(self.tokens.fit(cost) for cost in costs)) if self.tokens is not None else 0.0,
+            self.requests.wait_time(len(costs)) if self.requests is not None else 0.0)
+
+    def _tickets(self) -> List[Ticket]:
+        return [ticket for _, _, ticket in self._queue]
+
+    def delay(self, cost: int, priority: Priority = Priority.interactive) -> float:
+        '''Expected seconds before a request of `cost` tokens would be granted.'''
+        if not self.enabled:
+            return 0.0
+        return self._wait_time([ticket.cost for ticket in self._tickets() if ticket.priority <= priority] + [cost])
+
+    def _shed(self, ticket: Ticket, retry_after: float) -> LoadShedError:
+        self.shed[ticket.priority.name] += 1
+        ticket.error = LoadShedError(self.name, ticket.priority, retry_after)
+        log(load_shed=self.name, priority=ticket.priority.name, retry_after=round(retry_after, 3))
+        if ticket.waiter is not None and not ticket.waiter.done():
+            ticket.waiter.set_result(None)
+        return ticket.error
+
+    def submit(self, cost: int, priority: Priority = Priority.interactive) -> Ticket:
+        '''Queues a request, or raises LoadShedError right away.'''
+        expected = self.delay(cost, priority)
+        ticket = Ticket(cost=cost, priority=priority, deadline=self.clock() + self.max_queue_sec[priority], limiter=self)
+        if expected > self.max_queue_sec[priority]:
+            raise self._shed(ticket, expected)
+        if len(self._queue) >= self.max_queued:
+            lowest_entry = max(self._queue)
+            lowest = lowest_entry[2]
+            if lowest.priority <= priority:
+                raise self._shed(ticket, expected)
+            self._queue.remove(lowest_entry)
+            heapq.heapify(self._queue)
+            self._shed(lowest, self.delay(lowest.cost, lowest.priority))
+        heapq.heappush(self._queue, (priority, next(self._order), ticket))
+        self.queued += 1
+        return ticket
+
+    def dispatch(self) -> Optional[float]:
+        '''Grants what the buckets allow, highest priority first, and sheds tickets past their deadline. Returns the seconds until the next grant, None with nothing queued.'''
+        now = self.clock()
+        for expired in [ticket for ticket in self._tickets() if ticket.deadline < now]:
+            self._queue = [entry for entry in self._queue if entry[2] is not expired]
+            heapq.heapify(self._queue)
+            self._shed(expired, self.delay(expired.cost, expired.priority))
+        while self._queue:
+            _, _, head = self._queue[0]
+            wait = self._wait_time([head.cost])
+            if wait > 0:
+                return wait
+            heapq.heappop(self._queue)
+            if self.tokens is not None:
+                self.tokens.take(head.cost)
+            if self.requests is not None:
+                self.requests.take(1)
+            head.granted = True
+            self.granted += 1
+            if head.waiter is not None and not head.waiter.done():
+                head.waiter.set_result(None)
+        return None
+
+    def cancel(self, ticket: Ticket) -> None:
+        if not ticket.granted:
+            self._queue = [entry for entry in self._queue if entry[2] is not ticket]
+            heapq.heapify(self._queue)
+
+    async def acquire(self, cost: int, priority: Priority = Priority.interactive) -> Ticket:
+        '''Waits for quota, raises LoadShedError when the request is shed.'''
+        if not self.enabled:
+            return Ticket(cost=cost, priority=priority, deadline=self.clock(), granted=True)
+        ticket = self.submit(cost, priority)
+        try:
+            while True:
+                wake = self.dispatch()
+                if ticket.granted:
+                    return ticket
+                if ticket.error is not None:
+                    raise ticket.error
+                ticket.waiter = asyncio.get_running_loop().create_future()
+                # Woken by the dispatch that grants or sheds it, or polls when the head of the queue can go
+                await asyncio.wait({ticket.waiter}, timeout=min(wake or self.max_queue_sec[priority], ticket.deadline - self.clock() + 0.001))
+        except asyncio.CancelledError:
+            self.cancel(ticket)
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'granted': self.granted,
+            'queued': self.queued,
+            'waiting': len(self._queue),
+            'shed': dict(self.shed),
+            'tokens': round(self.tokens.level) if self.tokens is not None else None,
+            'requests': round(self.requests.level, 1) if self.requests is not None else None}
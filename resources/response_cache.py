@@ -0,0 +1,184 @@
+from typing import Any, Dict, List, Optional, Tuple, Type, TypeVar
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from pydantic import BaseModel
+from utils import log
+from utils.cache import TTLCache
+from utils.near_duplicates import NEAR_DUPLICATE_THRESHOLD, LSHIndex
+
+# Structured responses are reused for this long, 0 disables the cache
+LLM_RESPONSE_CACHE_TTL_SEC = float(os.environ.get('LLM_RESPONSE_CACHE_TTL_SEC', 24 * 60 * 60))
+LLM_RESPONSE_CACHE_SIZE = int(os.environ.get('LLM_RESPONSE_CACHE_SIZE', 2048))
+# sqlite file the cache is also written to, empty keeps it in memory only. Must be on a mounted volume to survive restarts on Cloud Run.
+LLM_RESPONSE_CACHE_PATH = os.environ.get('LLM_RESPONSE_CACHE_PATH', '')
+# Near-duplicate inputs indexed per subtopic prompt, the least recently used subtopic's index is dropped past this
+NEAR_DUPLICATE_SCOPES = int(os.environ.get('NEAR_DUPLICATE_SCOPES', 512))
+NEAR_DUPLICATE_SCOPE_SIZE = int(os.environ.get('NEAR_DUPLICATE_SCOPE_SIZE', 256))
+
+M = TypeVar('M', bound=BaseModel)
+
+_NON_WORD = re.compile(r"[^\w]+")
+
+
+def normalize_user_input(text: str) -> str:
+    '''"Deck is springy!" and "  deck is  springy" are the same request.'''
+    return ' '.join(_NON_WORD.sub(' ', text.casefold()).split())
+
+
+class ResponseCache:
+    '''
+    LRU + TTL cache of parsed structured responses, in memory and optionally in a sqlite file.
+
+    The key digests the deployment, the response format and every prompt message: the subtopic's system prompt
+    (so the training data version, copilot and subtopic), the task and per request context instructions (previous
+    questions included), and the user's input normalized by `normalize_user_input`. Any change to the prompt is a miss.
+    Values are returned as deep copies, callers are free to modify them.
+
+    `get_similar` goes further and serves the entry of a near-duplicate input ("my deck feels bouncy" for "the deck is bouncy"),
+    found by a MinHash LSH index over the inputs stored under the same `similar_scope`, normally the subtopic's stable
+    prompt prefix. The matched entry still has to be live in the cache.
+    '''
+
+    def __init__(self, name: str, ttl: float = LLM_RESPONSE_CACHE_TTL_SEC, max_entries: int = LLM_RESPONSE_CACHE_SIZE, path: str = LLM_RESPONSE_CACHE_PATH, similarity_threshold: float = NEAR_DUPLICATE_THRESHOLD, clock=time.time) -> None:
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        # Wall clock rather than monotonic, entries restored from disk keep their original age
+        self.memory: TTLCache[str, BaseModel] = TTLCache(name=name, ttl=ttl, max_entries=max_entries, clock=clock)
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = self._open(path) if path and self.enabled else None
+        self.similarity_threshold = similarity_threshold
+        self._similar: TTLCache[str, LSHIndex[str]] = TTLCache(name=name + '_similar', max_entries=NEAR_DUPLICATE_SCOPES)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.similar_hits = 0
+        self.similar_misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def _open(self, path: str) -> Optional[sqlite3.Connection]:
+        try:
+            db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, payload TEXT NOT NULL, stored_at REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS responses_stored_at ON responses (stored_at)')
+            return db
+        except sqlite3.Error as err:
+            log(response_cache_disk_disabled=path, error=err)
+            return None
+
+    def key(self, deployment: str, response_format: type, messages: List[Dict[str, str]]) -> str:
+        parts = [deployment, '{}.{}'.format(response_format.__module__, response_format.__qualname__)] + [
+            [message['role'], normalize_user_input(message['content']) if message['role'] == 'user' else message['content']]
+            for message in messages]
+        return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def _similar_index(self, similar_scope: str) -> LSHIndex[str]:
+        return self._similar.get(similar_scope, lambda: LSHIndex(threshold=self.similarity_threshold, max_entries=NEAR_DUPLICATE_SCOPE_SIZE))
+
+    def get_similar(self, similar_scope: str, user_input: str, response_format: Type[M]) -> Optional[M]:
+        '''The cached response of the most similar input stored under `similar_scope`, if it's a near-duplicate.'''
+        if not self.enabled or self.similarity_threshold <= 0:
+            return None
+        match = self._similar_index(similar_scope).query(user_input)
+        value = self._fetch(match[0], response_format)[0] if match else None
+        with self._lock:
+            if value is None:
+                self.similar_misses += 1
+                return None
+            self.similar_hits += 1
+        log(response_cache_similar_hit=self.name, similarity=round(match[1], 3))
+        return value.model_copy(deep=True)
+
+    def get(self, key: str, response_format: Type[M]) -> Optional[M]:
+        if not self.enabled:
+            return None
+        value, from_disk = self._fetch(key, response_format)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1 if from_disk else 0
+        log(response_cache_hit=self.name, from_disk=from_disk)
+        return value.model_copy(deep=True)
+
+    def _fetch(self, key: str, response_format: Type[M]) -> Tuple[Optional[M], bool]:
+        '''The live entry and whether it was restored from disk.'''
+        value = self.memory.lookup(key)
+        if value is None and self._db is not None:
+            value = self._load(key, response_format)
+            return value, value is not None
+        return value, False
+
+    def _load(self, key: str, response_format: Type[M]) -> Optional[M]:
+        try:
+            with self._lock:
+                row = self._db.execute('SELECT payload, stored_at FROM responses WHERE key = ? AND stored_at > ?', (key, self.clock() - self.ttl)).fetchone()
+            if row is None:
+                return None
+            value = response_format.model_validate_json(row[0])
+        except (sqlite3.Error, ValueError) as err:
+            # A response format that changed shape since the entry was written is just a miss
+            log(response_cache_load_failed=self.name, error=err)
+            return None
+        self.memory.put(key, value, stored_at=row[1])
+        return value
+
+    def put(self, key: str, value: Optional[BaseModel], similar_scope: Optional[str] = None, user_input: Optional[str] = None) -> None:
+        if not self.enabled or value is None:
+            return
+        stored_at = self.clock()
+        self.memory.put(key, value.model_copy(deep=True), stored_at=stored_at)
+        if similar_scope and user_input and self.similarity_threshold > 0:
+            self._similar_index(similar_scope).add(key, user_input)
+        with self._lock:
+            self.stores += 1
+            if self._db is None:
+                return
+            try:
+                self._db.execute('INSERT OR REPLACE INTO responses (key, payload, stored_at) VALUES (?, ?, ?)', (key, value.model_dump_json(), stored_at))
+                self._db.execute('DELETE FROM responses WHERE stored_at <= ?', (stored_at - self.ttl,))
+                self._db.execute('DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY stored_at DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+            except sqlite3.Error as err:
+                log(response_cache_store_failed=self.name, error=err)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        self._similar.clear()
+        with self._lock:
+            if self._db is not None:
+                self._db.execute('DELETE FROM responses')
+
+    def close(self) -> None:
+        with self._lock:
+            db, self._db = self._db, None
+        if db is not None:
+            db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.memory),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'evictions': self.memory.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'similar_hits': self.similar_hits,
+                'similar_misses': self.similar_misses}
+
+
+RESPONSE_CACHE = ResponseCache(name='llm_responses')
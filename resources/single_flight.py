@@ -0,0 +1,56 @@
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+import asyncio
+from pydantic import BaseModel
+from utils import log
+
+T = TypeVar('T')
+
+
+def _share(value: Any) -> Any:
+    # Callers modify the parsed responses they get, every waiter gets its own copy
+    return value.model_copy(deep=True) if isinstance(value, BaseModel) else value
+
+
+class SingleFlight:
+    '''
+    Coalesces concurrent identical calls: the first caller for a key starts the call, callers arriving while it's
+    in flight await that same call and get (a copy of) its result, or its exception. Nothing is kept once it finishes.
+
+    The call runs as its own task, so a caller that is cancelled (e.g. the client went away) doesn't cancel it for the others.
+    '''
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._calls: Dict[Tuple[int, Hashable], "asyncio.Task[Any]"] = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        # Tasks belong to one loop, calls are only shared between callers on the same loop
+        flight_key = (id(asyncio.get_running_loop()), key)
+        task = self._calls.get(flight_key)
+        if task is not None:
+            self.coalesced += 1
+            log(single_flight_coalesced=self.name)
+            return _share(await asyncio.shield(task))
+        self.calls += 1
+        task = asyncio.ensure_future(call())
+        self._calls[flight_key] = task
+        task.add_done_callback(lambda done: self._finished(flight_key, done))
+        return await asyncio.shield(task)
+
+    def _finished(self, flight_key: Tuple[int, Hashable], task: "asyncio.Task[Any]") -> None:
+        if self._calls.get(flight_key) is task:
+            del self._calls[flight_key]
+        if not task.cancelled() and task.exception() is not None:
+            self.errors += 1
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def stats(self) -> Dict[str, int]:
+        return {'calls': self.calls, 'coalesced': self.coalesced, 'errors': self.errors, 'in_flight': len(self._calls)}
+
+
+IN_FLIGHT = SingleFlight('azure_openai')
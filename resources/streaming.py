@@ -0,0 +1,167 @@
+from abc import abstractmethod
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import json
+from pydantic import ValidationError
+from utils import log
+from .azure_client import AZURE_LOOP
+from .candidate_questions import CandidateQuestions
+
+SSE_HEADERS = {
+    "Content-Type": "text/event-stream",
+    "Cache-Control": "no-cache",
+    # Keeps proxies from buffering the events into one response
+    "X-Accel-Buffering": "no"}
+
+_END = object()
+
+
+def sse_event(event: str, data: Any) -> str:
+    return 'event: {}\ndata: {}\n\n'.format(event, json.dumps(data, default=str))
+
+
+class EventStream:
+    '''
+    A response body of server-sent events, produced by an async generator that runs on AZURE_LOOP (it awaits the shared
+    Azure OpenAI client). Iterate it with `async for` from the ASGI server's loop, or with `for` from a WSGI thread.
+    '''
+
+    def __init__(self, events: AsyncIterator[str]) -> None:
+        self.events = events
+
+    async def _next(self) -> Any:
+        try:
+            return await self.events.__anext__()
+        except StopAsyncIteration:
+            return _END
+
+    async def _close(self) -> None:
+        await self.events.aclose()
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        try:
+            while (event := await AZURE_LOOP.wait_for(self._next())) is not _END:
+                yield event
+        finally:
+            # Also runs when the client disconnects mid-stream, which stops the Azure stream too
+            await AZURE_LOOP.wait_for(self._close())
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            while (event := AZURE_LOOP.run(self._next())) is not _END:
+                yield event
+        finally:
+            AZURE_LOOP.run(self._close())
+
+
+def wsgi_response(result: Any) -> Any:
+    '''Flask only streams iterators, hands it the EventStream's event generator.'''
+    if isinstance(result, tuple) and result and isinstance(result[0], EventStream):
+        return (iter(result[0]),) + result[1:]
+    return result
+
+
+def _has_key_after(keys: List[str], key: str) -> bool:
+    return key in keys and keys.index(key) < len(keys) - 1
+
+
+class QuestionStreamTracker:
+    '''
+    Follows the partial `AIResponseFormatModel` JSON of a streamed completion and reports `question_text` and each
+    answer of `answer_set` once, as soon as they are complete: a field is complete once the model has moved on to
+    the next one (structured outputs keep the schema's field order), an answer once the next answer has started.
+    '''
+
+    def __init__(self) -> None:
+        self.question_sent = False
+        self.answers_sent = 0
+
+    def update(self, partial: Optional[Dict[str, Any]], final: bool = False) -> List[Tuple[str, Any]]:
+        question = (partial or {}).get('question_model') or {}
+        keys = list(question.keys())
+        events: List[Tuple[str, Any]] = []
+        if not self.question_sent:
+            if question.get('question_text') is None or not (final or _has_key_after(keys, 'question_text')):
+                return events
+            events.append(('question_text', question['question_text']))
+            self.question_sent = True
+        answers = question.get('answer_set') or []
+        complete = len(answers) if final or _has_key_after(keys, 'answer_set') else len(answers) - 1
+        while self.answers_sent < complete:
+            events.append(('answer', answers[self.answers_sent]))
+            self.answers_sent += 1
+        return events
+
+
+def copilot_question_events(copilot_question: Dict[str, Any]) -> List[str]:
+    '''The events of a response that's complete up front (response cache, local matcher), in the order of a streamed one.'''
+    return ([sse_event('question_text', {'question_text': copilot_question['question_text']})]
+        + [sse_event('answer', answer) for answer in copilot_question['copilot_answer_set']]
+        + [sse_event('final', copilot_question)])
+
+
+def error_event(err: Exception) -> str:
+    log(stream_failed=err)
+    return sse_event('error', {'response': str(err)})
+
+
+class StreamedQuestions(CandidateQuestions):
+    '''
+    The clarify endpoints' copilot question as server-sent events: `question_text` as soon as the model has written it,
+    an `answer` (CopilotAnswerFormat) as each of the model's answers completes, then the `final` CopilotQuestionFormat.
+    Falls back to a candidate question when Azure fails before anything has been sent.
+
+    Mixed into the clarify classes of both endpoints, which also provide `ai_resource`, `copilot_answer` and `assign_copilot_question`.
+    '''
+
+    @property
+    @abstractmethod
+    def model_answer_format(self) -> type:
+        '''The endpoint's AnswerFormatModel, one answer as the model writes it.'''
+
+    async def stream_copilot_question(self, user_input: str, prepare: Callable[[], Any]) -> AsyncIterator[str]:
+        '''
+        `prepare` runs off the event loop before the model is called (the shortlist and local matcher may call the
+        embedding endpoint synchronously), a copilot question it returns is sent instead of calling the model.
+        '''
+        tracker = QuestionStreamTracker()
+        try:
+            prepared = await asyncio.to_thread(prepare)
+            if prepared is not None:
+                for event in copilot_question_events(prepared.model_dump()):
+                    yield event
+                return
+
+            ai_response: Any = None
+            # Positional, clarify_issue's AIResource names the system prompt `system_instructions`
+            async for partial, parsed in self.ai_resource.stream_structured_response(
+                    [user_input],
+                    self.instructions_model.base_system_instructions(),
+                    self.instructions_model.clarifyUserIssueInstructions(),
+                    self.instructions_model.topic_list_instructions()):
+                for name, value in tracker.update(partial, final=parsed is not None):
+                    if name == 'question_text':
+                        yield sse_event('question_text', {'question_text': value})
+                    elif (answer := self._streamed_answer(value)) is not None:
+                        yield sse_event('answer', answer.model_dump())
+                ai_response = parsed
+
+            if ai_response and ai_response.question_model:
+                yield sse_event('final', self.assign_copilot_question(ai_response=ai_response).model_dump())
+            else:
+                yield sse_event('final', {"response": "OK"})
+        except Exception as err:
+            # Falls back only while nothing has been sent, the events of two answers can't be mixed
+            if self.can_fall_back(err) and not tracker.question_sent:
+                fallback_response = await asyncio.to_thread(self.fallback_copilot_question, user_input, err)
+                for event in copilot_question_events(fallback_response.model_dump()):
+                    yield event
+            else:
+                yield error_event(err)
+
+    def _streamed_answer(self, partial_answer: Dict[str, Any]) -> Any:
+        try:
+            return self.copilot_answer(self.model_answer_format.model_validate(partial_answer))
+        except ValidationError:
+            # Left for the final event
+            return None
@@ -0,0 +1,212 @@
+from abc import ABC, abstractmethod
+from contextlib import AsyncExitStack
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+from openai import LengthFinishReasonError
+from utils import log
+from .messages import COLD_START_USER_PROMPT, PROMPT_CACHE_USAGE, prompt_messages
+from .response_cache import RESPONSE_CACHE
+from .single_flight import IN_FLIGHT
+from .deployments import DeploymentPool
+from .rate_limits import LoadShedError, Priority, Ticket, estimate_tokens, usage_tokens
+
+
+class StructuredCompletions(ABC):
+    '''
+    The Azure OpenAI call path of both AIResource flavours: the response cache (exact, then near-duplicate inputs),
+    single-flight, the deployment pool (quota, circuit breaker, failover and hedging), prompt cache usage and streaming.
+
+    Subclasses connect `chat_client` and `deployments` and set `connected`, `model_name` is the deployment responses
+    are cached under and `response_model` the structured output model of `get_structured_response`.
+    '''
+    connected: bool = False
+    chat_client: Any
+    deployments: DeploymentPool
+    response_model: type
+    system_instructions: List[str] | None = None
+
+    @property
+    @abstractmethod
+    def model_name(self) -> str:
+        '''The deployment the resource calls and caches responses under.'''
+
+    async def warm_prompt_cache(self, system_prompt: List[str], topic_instructions: Optional[List[str]] = None) -> bool:
+        """
+        Sends the stable part of a subtopic's prompt, the system prompt, task instructions and response format, as a one token completion.
+        That opens the connection to the endpoint and leaves the prefix in Azure's prompt cache for the call that follows.
+
+        Returns:
+            bool: Whether the endpoint was reached
+        """
+        if not self.connected or not self.deployments.breaker.closed:
+            return False
+        messages = prompt_messages(system_prompt, [COLD_START_USER_PROMPT], topic_instructions=topic_instructions)
+        try:
+            # Behind interactive requests for the primary's quota, shed (and skipped) when there's none to spare
+            ticket = await self.deployments.acquire(self.deployments.primary, estimate_tokens(messages, expected_output=1), Priority.cold_start)
+        except LoadShedError as err:
+            log(warm_prompt_cache_skipped=err)
+            return False
+        try:
+            ai_response = await self.chat_client.beta.chat.completions.parse(
+                model=self.model_name,
+                messages=messages,
+                response_format=self.response_model,
+                max_tokens=1)
+        except LengthFinishReasonError as err:
+            # Expected, only the prompt matters
+            ai_response = err.completion
+        except Exception as err:
+            log(warm_prompt_cache_failed=err)
+            return False
+        PROMPT_CACHE_USAGE.record(ai_response, deployment=self.model_name, cold_start=True)
+        ticket.settle(usage_tokens(ai_response))
+        return True
+
+    async def _parse(self, cache_key: str, messages: List[dict], response_format: type, **cache_context: Any) -> Any | None:
+        '''One structured completion, hedged across the deployment pool and stored in RESPONSE_CACHE. Concurrent identical requests (same cache key) share one call.'''
+        async def request(deployment: Any) -> Any:
+            # The primary is this resource's own client, hedges and failovers go to the pool's other deployments
+            client = self.chat_client if deployment.primary else deployment.client()
+            if self.deployments.failover:
+                client = client.with_options(max_retries=0)
+            ai_response = await client.beta.chat.completions.parse(
+                model=deployment.deployment,
+                messages=messages,
+                response_format=response_format
+                )
+            PROMPT_CACHE_USAGE.record(ai_response, deployment=deployment.name)
+            return ai_response
+
+        async def call() -> Any | None:
+            ai_response = await self.deployments.call(request, cost=estimate_tokens(messages))
+            RESPONSE_CACHE.put(cache_key, ai_response.choices[0].message.parsed, **cache_context)
+            return ai_response.choices[0].message.parsed
+        return await IN_FLIGHT.do(cache_key, call)
+
+    async def get_typed_structured_response(self, user_prompt: List[str], system_prompt: List[str] = [], response_format: Optional[type] = None) -> Any | None:
+        """
+        Generatively fills request model, requires first providing the model to be filled.
+
+        Args:
+            system_prompt (List[str]): The initial instructions if different than the provided instruction used for class instantiation. Joins to one string
+            user_prompt (List[str]): The current input to be processed. Joins to one string
+            response_format (type): The object to be generatively filled, `response_model` by default
+
+        Returns:
+            Any | None: The model format to be returned, wherein some or all is generatively filled
+        """
+        if not self.connected:
+            return None
+        response_format = response_format or self.response_model
+        self.system_instructions = system_prompt
+        messages = [
+            {"role": "system",
+            "content": ' '.join(system_prompt)},
+            {"role": "user",
+            "content": ' '.join(user_prompt)},]
+        cache_key = RESPONSE_CACHE.key(self.model_name, response_format, messages)
+        cached = RESPONSE_CACHE.get(cache_key, response_format)
+        if cached is not None:
+            return cached
+        return await self._parse(cache_key, messages, response_format)
+
+    async def get_structured_response(self, user_prompt: List[str], system_prompt: List[str] = [], topic_instructions: List[str] = [], context_instructions: List[str] = []) -> Any | None:
+        """
+        Generatively fills `response_model`.
+
+        Args:
+            system_prompt (List[str]): The initial instructions if different than the provided instruction used for class instantiation. Joins to one string
+            user_prompt (List[str]): The current input to be processed. Joins to one string
+            topic_instructions (List[str]): The resource type's task instructions, sent after the system prompt
+            context_instructions (List[str]): Per request context, e.g. the shortlisted 'topic_list', sent last before the user's input
+
+        Returns:
+            Any | None: The model format to be returned, wherein some or all is generatively filled
+        """
+        if not self.connected:
+            return None
+        self.system_instructions = system_prompt
+        messages, cache_key, similar_scope, cached = self._structured_request(user_prompt, system_prompt, topic_instructions, context_instructions)
+        if cached is not None:
+            return cached
+        return await self._parse(cache_key, messages, self.response_model, similar_scope=similar_scope, user_input=' '.join(user_prompt))
+
+    def _structured_request(self, user_prompt: List[str], system_prompt: List[str], topic_instructions: List[str], context_instructions: List[str]) -> Tuple[List[dict], str, str, Any | None]:
+        '''The messages of a structured request, its response cache keys and the cached response, if any.'''
+        messages = prompt_messages(system_prompt, user_prompt, topic_instructions=topic_instructions, context_instructions=context_instructions)
+        cache_key = RESPONSE_CACHE.key(self.model_name, self.response_model, messages)
+        # Near-duplicate inputs are matched within the subtopic's stable prefix, the shortlisted context varies per input
+        similar_scope = RESPONSE_CACHE.key(self.model_name, self.response_model, prompt_messages(system_prompt, [], topic_instructions=topic_instructions))
+        cached = RESPONSE_CACHE.get(cache_key, self.response_model)
+        if cached is None:
+            cached = RESPONSE_CACHE.get_similar(similar_scope, ' '.join(user_prompt), self.response_model)
+        return messages, cache_key, similar_scope, cached
+
+    async def stream_structured_response(self, user_prompt: List[str], system_prompt: List[str] = [], topic_instructions: List[str] = [], context_instructions: List[str] = []) -> AsyncIterator[Tuple[Dict[str, Any], Any | None]]:
+        """
+        `get_structured_response`, streamed.
+
+        Yields:
+            (partial, None) for every content delta, `partial` being the JSON parsed so far, then (complete, parsed) once at the end.
+            A cached response is yielded as that last item right away.
+        """
+        if not self.connected:
+            return
+        messages, cache_key, similar_scope, cached = self._structured_request(user_prompt, system_prompt, topic_instructions, context_instructions)
+        if cached is not None:
+            yield cached.model_dump(mode='json'), cached
+            return
+        breaker = self.deployments.breaker
+        # Streams go to the healthiest deployment, they aren't hedged or failed over once started
+        deployment = self.deployments.candidates()[0]
+        async with AsyncExitStack() as stream_context:
+            async def first_event() -> Tuple[Ticket, Any, Any]:
+                ticket = await self.deployments.acquire(deployment, estimate_tokens(messages))
+                client = self.chat_client if deployment.primary else deployment.client()
+                stream = await stream_context.enter_async_context(client.beta.chat.completions.stream(
+                    model=deployment.deployment,
+                    messages=messages,
+                    response_format=self.response_model,
+                    stream_options={"include_usage": True}))
+                return ticket, stream, await anext(stream, None)
+            # The breaker judges (and times out) the time to the first chunk, the consumer's reads don't count towards it.
+            # While the circuit is open this raises CircuitOpenError before anything is yielded
+            ticket, stream, event = await breaker.call(first_event)
+            timeout = breaker.call_timeout_sec if breaker.enabled else None
+            while event is not None:
+                if event.type == 'content.delta' and isinstance(event.parsed, dict):
+                    yield event.parsed, None
+                # A stalled stream is abandoned after the same timeout per read
+                event = await asyncio.wait_for(anext(stream, None), timeout)
+            completion = await stream.get_final_completion()
+        PROMPT_CACHE_USAGE.record(completion, deployment=deployment.name, streamed=True)
+        ticket.settle(usage_tokens(completion))
+        parsed = completion.choices[0].message.parsed
+        RESPONSE_CACHE.put(cache_key, parsed, similar_scope=similar_scope, user_input=' '.join(user_prompt))
+        yield (parsed.model_dump(mode='json') if parsed else {}), parsed
+
+    async def get_chat_response(self, system_prompt: List[str], user_prompt: List[str]) -> str:
+        """
+        Basic question & typed chat completion
+
+        Args:
+            system_prompt (List[str]): The initial instructions if different than the provided instruction used for class instantiation. Joins to one string
+            user_prompt (List[str]): The current input to be processed. Joins to one string
+
+        Returns:
+            str: Generative response from the Azure AI model given the user input and system instructions
+        """
+        if not self.connected:
+            return 'NA'
+        self.system_instructions = system_prompt
+        ai_response = await self.chat_client.chat.completions.create(
+            model=self.model_name,
+            messages=[
+                {"role": "system",
+                "content": ' '.join(system_prompt)},
+                {"role": "user",
+                "content": ' '.join(user_prompt)},]
+            )
+        response_text = ai_response.choices[0].message.content.__str__()
+        return response_text.encode('utf-8').decode('unicode-escape')
@@ -0,0 +1,134 @@
+from abc import ABC, abstractmethod
+from typing import Any, List, Optional, Tuple
+from models import SubtopicIssues
+from utils import log
+from utils.cache import TTLCache
+from utils.prompt_templates import TOPIC_LIST_COMPACT, TOPIC_LIST_IN_PREFIX, CompiledTopicList, PromptTemplate
+from utils.tokens import count_tokens, fit_budget
+from .embeddings import candidate_ranker
+
+
+class SubtopicInstructions(ABC):
+    '''
+    The system instructions of one (copilot, subtopic), shared by the dynamic_qna and clarify_issue endpoints.
+    Everything that only depends on the topic data is compiled once into a PromptTemplate kept in `templates`
+    under `template_key`, requests only shortlist and render the \'topic_list\' on top of it.
+
+    The message layout is prefix-stable: `base_system_instructions` is the same for every input of the subtopic
+    (with the whole \'topic_list\' under TOPIC_LIST_PLACEMENT 'prefix'), so Azure's prompt cache can reuse it.
+    '''
+
+    def __init__(self, copilot: str, subtopic: str, topic_training_data: Any, limit_request: bool = True, user_input: Optional[str] = None, topic_list_in_prefix: bool = TOPIC_LIST_IN_PREFIX):
+        try:
+            self.copilot: str = copilot # Ex: 'interior_climate_control'
+            self.subtopic: str = subtopic # Ex: 'heating_and_cooling_systems'
+            self.topic: str = topic_training_data.topic if topic_training_data.topic else "" # Ex: 'Interior Climate Control'
+        except Exception:
+            pass
+
+        self.limit_request = limit_request
+        self.topic_list_in_prefix = topic_list_in_prefix
+        self.topic_training_data = topic_training_data
+        self.subtopic_issues: SubtopicIssues = topic_training_data.issue_index().subtopic(self.subtopic)
+        self.prompt_issues: SubtopicIssues = self.subtopic_issues
+        self.template: PromptTemplate = self.templates.get(self.template_key, self._compile_template)
+        self.shortlist(user_input)
+
+    @property
+    @abstractmethod
+    def templates(self) -> TTLCache[Tuple, PromptTemplate]:
+        '''The endpoint's template cache.'''
+
+    @property
+    @abstractmethod
+    def template_key(self) -> Tuple:
+        '''Identifies the topic data the template was compiled from, e.g. (version, copilot, subtopic, limit_request).'''
+
+    def _topic_list_issues(self, subtopic_issues: SubtopicIssues):
+        return subtopic_issues.flow_issues if self.limit_request else subtopic_issues.issues
+
+    def _topic_list_item(self, issue) -> Any:
+        if not self.limit_request:
+            return dict(issue.__dict__) if TOPIC_LIST_COMPACT else issue.__dict__.__str__() + "\n\n"
+        return {"associated_copilot_flow": issue.associated_copilot_flow, "observation": issue.observation, "issue_number": issue.issue_number}
+
+    def _compile_template(self) -> PromptTemplate:
+        '''Renders everything that only depends on the topic data and subtopic, once per `template_key`.'''
+        return PromptTemplate(
+            topic_list=CompiledTopicList(self._topic_list_issues(self.subtopic_issues), item=self._topic_list_item),
+            sections={
+                'topic_list': (
+                    'Consider this list, which will be referred to as: \'topic_list\', which is a list of issues in which the \'observation\' is a basic description of a homeowners issue',),
+                'base': (
+                    'The user will submit an issue related to their residential home, which the \'topic_list\' will be used to determine if the issue is warrantable',
+                    'Any system instructions which includes something like: \'some_variable\', is referencing a field that will be assigned.',
+                    'Assume the user\'s issue relates to their home\'s {0} and all responses should be structured around a residential home\'s {1}.'.format(self.topic, self.subtopic),),
+                'additional_topic_info': (self.topic_training_data.additional_topic_info if self.topic_training_data.additional_topic_info else '',),
+                'redirect': (
+                    "Each \'associated_copilot_flow\' will have a basic general description as the \'observation\' value.",
+                    "Compare the user's input against: \'observation\' and assign: \'closest_matching_copilot_flow\' as the value: \'associated_copilot_flow\' of the same object, which contains the closes matching description.",
+                    "Always assign a value.",
+                    "Assume the user's issue is related to their home's {0}, specifically {1}".format(self.topic, self.subtopic)),
+                'clarify': (
+                    'Assign \'question_model\' using a clarifying question as \'question_text\' and the relative multiple choice answers to the question as \'answer_set\'.',
+                    'The \'question_text\' should be formed to include the issue\'s topic: {0}, and this subtopic: {1} and addressing the user\'s issue.'.format(self.topic, self.subtopic),
+                    'The goal is to determine which topic most closely matches the user\'s issue.',
+                    'Never include an answer being some form of the following; \'Other\', \'Not Certain\' or \'None\' as one of the \'answer_set\' answers.',
+                    'The amount of answers in \'answer_set\' should be between 2 to 5 answers, which prioritize answers clarifying the related topic observation the most. It\'s preferable that there would be more answers, up to 5.',
+                    'Each \'answer_text\' values should only be a couple words long, maximum 4.',
+                    'Assign each \'answer_set\' value: \'associated_copilot_flow\' as the closest matching value for the field: \'associated_copilot_flow\' from each object from the \'topic_list\'.'),
+            })
+
+    def shortlist(self, user_input: Optional[str]) -> None:
+        '''
+        Narrows the \'topic_list\' sent to the model down to the issues that lexically match the user's input.
+        Without input, or with the \'topic_list\' in the prompt prefix, every subtopic issue is kept.
+        '''
+        if user_input and not self.topic_list_in_prefix:
+            self.prompt_issues = self.subtopic_issues.shortlist(user_input, ranker=candidate_ranker())
+            log(shortlisted_issues='{} of {}'.format(len(self.prompt_issues), len(self.subtopic_issues)))
+
+        self.fit_prompt_budget(user_input)
+
+    def fit_prompt_budget(self, user_input: Optional[str]) -> None:
+        '''
+        Renders the \'topic_list\' within PROMPT_TOKEN_BUDGET for the clarify prompt (base and clarify instructions plus the user's input),
+        dropping the lowest ranked candidates first, then \'additional_topic_info\'.
+        In the prompt prefix it's fitted without the user's input, in guideline order and always with \'additional_topic_info\',
+        so it's the same for every input.
+        '''
+        topic_list = self.template.topic_list
+        in_prefix = self.topic_list_in_prefix
+        fit = fit_budget(
+            fixed_tokens=self.template.token_count('topic_list', 'base', 'clarify') + topic_list.header_tokens + (self.template.token_count('additional_topic_info') if in_prefix else count_tokens(user_input)),
+            candidates=[(issue, topic_list.tokens[id(issue)]) for issue in self.prompt_issues.ranking if id(issue) in topic_list.tokens],
+            optional_tokens=0 if in_prefix else self.template.token_count('additional_topic_info'))
+        kept = {id(issue) for issue in fit.kept}
+        self.topic_list: str = topic_list.render([issue for issue in self._topic_list_issues(self.prompt_issues) if id(issue) in kept])
+        self.include_additional_topic_info: bool = in_prefix or fit.keep_optional
+        self.prompt_tokens: int = fit.tokens
+
+    def base_system_instructions(self):
+        '''
+        The subtopic's stable instructions, followed by the whole \'topic_list\' when it's in the prompt prefix.
+        A shortlisted \'topic_list\' is sent separately after the task instructions.
+        '''
+        instructions: List[str] = self.template.section('base')
+        instructions.extend(self.template.section('additional_topic_info') if self.include_additional_topic_info else [''])
+        if self.topic_list_in_prefix:
+            instructions.extend(self._topic_list_instructions())
+        return instructions
+
+    def _topic_list_instructions(self) -> List[str]:
+        return ['{0}{1}: \n{2}.'.format(self.template.sections['topic_list'][0], self.template.topic_list.description, self.topic_list)]
+
+    def topic_list_instructions(self) -> List[str]:
+        '''The shortlisted \'topic_list\', nothing when the whole list is already in the prompt prefix.'''
+        return [] if self.topic_list_in_prefix else self._topic_list_instructions()
+
+    def redirect_issue_instructions(self):
+        return [
+            "Consider this list of common homeowner issue descriptions: {}.".format(self.topic_list)] + self.template.section('redirect')
+
+    def clarifyUserIssueInstructions(self) -> List[str]:
+        return self.template.section('clarify')
@@ -115,6 +115,20 @@ def fix(c):  # noqa: ANN001, ANN201
         c.run("isort --profile google *.py **/*.py")
 
 
+@task(pre=[require_venv])
+def compile_training_data(c):  # noqa: ANN001, ANN201
+    """Compile combined_training_data.json into the memory-mapped artifact"""
+    with c.prefix(venv):
+        c.run("python -m google_cloud_functions.dynamic_qna.training_data")
+
+
+@task(pre=[require_venv])
+def compile_embeddings(c, provider="azure"):  # noqa: ANN001, ANN201
+    """Embed every training data observation into the memory-mapped .npy index"""
+    with c.prefix(venv):
+        c.run(f"python -m resources.embeddings combined_training_data.json combined_training_data.embeddings.npy {provider}")
+
+
 @task(pre=[require_project])
 def build(c):  # noqa: ANN001, ANN201
     """Build the service into a container image"""
@@ -12,10 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+
 import flask
 from flask.testing import FlaskClient
 import pytest
 
+# Tests warm what they need themselves, don't preload every topic from Firestore on import
+os.environ.setdefault("WARMUP_ON_START", "0")
+
 from app import app as flask_app
 
 
@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+from starlette.testclient import TestClient
+
+import google_cloud_functions
+from asgi import app as asgi_app, to_response
+from resources import await_async
+from resources.azure_client import AZURE_LOOP
+from utils import RequestData
+
+
+def test_wait_sec_is_served_by_the_coroutine() -> None:
+    with TestClient(asgi_app) as client:
+        res = client.get("/wait_sec", params={"seconds": 0})
+    assert res.status_code == 200
+    assert res.json()["finished"] is True
+
+
+def test_concurrent_waits_share_one_thread() -> None:
+    async def waits() -> None:
+        await asyncio.gather(*(google_cloud_functions.copilot_wait_sec_async(RequestData(method="GET", args={"seconds": "0.2"})) for _ in range(50)))
+
+    started = time.monotonic()
+    asyncio.run(waits())
+    assert time.monotonic() - started < 2
+
+
+def test_flask_routes_are_mounted() -> None:
+    with TestClient(asgi_app) as client:
+        assert client.get("/").text == "Hello, World!"
+        assert client.get("/readyz").status_code in (200, 503)
+
+
+def test_llm_route_preflight() -> None:
+    with TestClient(asgi_app) as client:
+        res = client.options("/clarify_issue")
+    assert res.status_code == 204
+    assert res.headers["Access-Control-Allow-Origin"] == "*"
+
+
+def test_to_response_matches_flask_bodies() -> None:
+    res = to_response(({"response": "OK"}, 201, {"Access-Control-Allow-Origin": "*"}))
+    assert res.status_code == 201
+    assert res.headers["content-type"] == "application/json"
+    assert res.headers["access-control-allow-origin"] == "*"
+    assert to_response("OK").body == b"OK"
+
+
+def test_await_async_runs_on_the_azure_loop() -> None:
+    async def loop_name() -> str:
+        return asyncio.get_running_loop() is AZURE_LOOP.loop
+
+    assert asyncio.run(await_async(loop_name())) is True
@@ -0,0 +1,44 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from resources.azure_client import BackgroundLoop, shared_chat_client
+
+
+def test_background_loop_serves_many_threads() -> None:
+    loop = BackgroundLoop("test")
+    loops = []
+
+    async def current_loop() -> asyncio.AbstractEventLoop:
+        await asyncio.sleep(0.01)
+        return asyncio.get_running_loop()
+
+    threads = [threading.Thread(target=lambda: loops.append(loop.run(current_loop(), timeout=5))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loops) == 8 and all(found is loop.loop for found in loops)
+    loop.stop()
+
+
+def test_background_loop_refuses_to_block_itself() -> None:
+    loop = BackgroundLoop("test")
+
+    async def nested() -> None:
+        async def inner() -> None:
+            return None
+        loop.run(inner())
+
+    with pytest.raises(RuntimeError):
+        loop.run(nested(), timeout=5)
+    loop.stop()
+
+
+def test_one_client_per_endpoint() -> None:
+    config = SimpleNamespace(azure_ai_endpoint="https://example.openai.azure.com", azure_ai_version="2024-10-21", azure_ai_api_key="key")
+    other = SimpleNamespace(azure_ai_endpoint="https://other.openai.azure.com", azure_ai_version="2024-10-21", azure_ai_api_key="key")
+    assert shared_chat_client(config) is shared_chat_client(SimpleNamespace(**vars(config)))
+    assert shared_chat_client(other) is not shared_chat_client(config)
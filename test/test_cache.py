@@ -0,0 +1,116 @@
+import threading
+import time
+
+from utils.cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def wait_for(condition, timeout: float = 2.0) -> bool:  # noqa: ANN001
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def test_fresh_entries_are_served_from_memory() -> None:
+    clock = FakeClock()
+    cache = TTLCache(name="test", ttl=10, clock=clock)
+    loads = []
+    assert cache.get("a", lambda: loads.append(1) or "first") == "first"
+    clock.now = 9
+    assert cache.get("a", lambda: loads.append(1) or "second") == "first"
+    assert len(loads) == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_stale_entries_revalidate_in_background() -> None:
+    clock = FakeClock()
+    cache = TTLCache(name="test", ttl=10, stale_ttl=10, clock=clock)
+    cache.get("a", lambda: "first")
+    clock.now = 15
+    assert cache.get("a", lambda: "second") == "first"
+    assert wait_for(lambda: cache.peek("a") == "second")
+    clock.now = 40
+    assert cache.get("a", lambda: "third") == "third"
+
+
+def test_invalidate_serves_stale_once_then_refreshes() -> None:
+    cache = TTLCache(name="test", ttl=100, stale_ttl=100)
+    cache.get("a", lambda: "first")
+    cache.invalidate("a")
+    assert cache.get("a", lambda: "second") == "first"
+    assert wait_for(lambda: cache.peek("a") == "second")
+
+
+def test_invalidate_during_refresh_loads_again() -> None:
+    cache = TTLCache(name="test", ttl=100, stale_ttl=100)
+    cache.get("a", lambda: "first")
+    loading, release = threading.Event(), threading.Event()
+    loads = []
+
+    def load() -> str:
+        loads.append(1)
+        if len(loads) == 1:
+            loading.set()
+            release.wait(2)
+            return "before change"
+        return "after change"
+
+    cache.refresh("a", load)
+    assert loading.wait(2)
+    cache.invalidate("a")
+    release.set()
+    assert wait_for(lambda: cache.peek("a") == "after change")
+    assert len(loads) == 2
+
+
+def test_lru_eviction() -> None:
+    cache = TTLCache(name="test", max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a", lambda: 0)
+    cache.put("c", 3)
+    assert cache.peek("b") is None
+    assert cache.peek("a") == 1
+    assert cache.evictions == 1
+
+
+def test_lookup_counts_and_keeps_recently_used() -> None:
+    clock = FakeClock()
+    cache = TTLCache(name="test", ttl=10, max_entries=2, clock=clock)
+    cache.put("a", 1, stored_at=-5)
+    cache.put("b", 2)
+    assert cache.lookup("a") == 1
+    cache.put("c", 3)
+    assert cache.peek("b") is None
+    clock.now = 6
+    assert cache.lookup("a") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_concurrent_misses_load_once() -> None:
+    cache = TTLCache(name="test", ttl=10)
+    started = threading.Event()
+    loads = []
+
+    def load() -> str:
+        loads.append(1)
+        started.wait(1)
+        return "value"
+
+    threads = [threading.Thread(target=cache.get, args=("a", load)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    started.set()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1
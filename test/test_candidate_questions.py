@@ -0,0 +1,43 @@
+from google_cloud_functions.clarify_issue import main as clarify_issue_main
+from google_cloud_functions.dynamic_qna.main import ClarifyIssue
+from resources.candidate_questions import CANDIDATE_ANSWER_MAX_WORDS, CLARIFY_FALLBACK_MAX_ANSWERS, CandidateQuestions, answer_label
+from resources.circuit_breaker import CircuitOpenError
+
+
+def test_both_endpoints_share_the_fallback() -> None:
+    assert issubclass(ClarifyIssue, CandidateQuestions)
+    assert issubclass(clarify_issue_main.ClarifyIssueCreator, CandidateQuestions)
+    assert not hasattr(clarify_issue_main, "CLARIFY_FALLBACK_MAX_ANSWERS")
+
+
+def test_fallback_offers_matching_flows() -> None:
+    clarify = ClarifyIssue(None, copilot="decking", subtopic="boards")
+    err = CircuitOpenError("primary", 30)
+    assert clarify.can_fall_back(err) and not clarify.can_fall_back(ValueError("bad request"))
+
+    question = clarify.fallback_copilot_question("boards are cracking", err)
+    assert question.served_by == "fallback"
+    assert 1 < len(question.copilot_answer_set) <= CLARIFY_FALLBACK_MAX_ANSWERS + 1
+    assert question.copilot_answer_set[-1].DisplayName == "Not listed"
+    assert all(answer.TopicId.startswith(clarify.topic_training_data.topic_id + ".topic.") for answer in question.copilot_answer_set)
+    assert question.copilot_answer_set[0].closest_matching_issue_number
+    assert all(len(answer.DisplayName.split()) <= CANDIDATE_ANSWER_MAX_WORDS for answer in question.copilot_answer_set)
+
+
+def test_answer_labels_are_short() -> None:
+    assert answer_label("A fastener protrudes from a decking board") == "Fastener protrudes"
+    assert answer_label("Wood decking boards, railings and/or pickets are split") == "Wood decking boards, railings"
+    assert answer_label("Loose railing.") == "Loose railing"
+    assert answer_label(None) == ""
+
+
+def test_candidate_answers_follow_the_endpoint_format() -> None:
+    class ClarifyWithoutIssueNumbers(ClarifyIssue):
+        answer_format = clarify_issue_main.CopilotAnswerFormat
+        question_format = clarify_issue_main.CopilotQuestionFormat
+
+    clarify = ClarifyWithoutIssueNumbers(None, copilot="decking", subtopic="boards")
+    question = clarify.candidate_copilot_question(clarify.instructions_model.subtopic_issues.issues[:2])
+    assert isinstance(question, clarify_issue_main.CopilotQuestionFormat)
+    assert question.served_by == "local" and len(question.copilot_answer_set) == 3
+    assert "closest_matching_issue_number" not in question.copilot_answer_set[0].model_dump()
@@ -0,0 +1,98 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from google_cloud_functions.dynamic_qna.main import ClarifyIssue
+from resources.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, azure_failure
+from resources.deployments import AzureDeployment, DeploymentPool
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def server_error() -> openai.InternalServerError:
+    response = httpx.Response(503, request=httpx.Request("POST", "https://westus.openai.azure.com/openai/deployments/gpt-4o/chat/completions"))
+    return openai.InternalServerError("unavailable", response=response, body=None)
+
+
+def breaker(clock: FakeClock) -> CircuitBreaker:
+    return CircuitBreaker("westus", enabled=True, failure_rate=0.5, window=4, min_calls=4, slow_call_sec=10, open_sec=30, probes=2, clock=clock)
+
+
+def test_only_azure_errors_count() -> None:
+    assert azure_failure(server_error())
+    assert azure_failure(asyncio.TimeoutError())
+    assert not azure_failure(ValueError("bad request"))
+    assert not azure_failure(asyncio.CancelledError())
+
+
+def test_opens_on_errors_and_slow_calls_then_fails_fast() -> None:
+    clock = FakeClock()
+    circuit = breaker(clock)
+    for seconds, err in ((1, None), (12, None), (1, server_error()), (1, ValueError("bad request")), (1, None)):
+        circuit.acquire()
+        circuit.record(seconds, err)
+    assert circuit.state == OPEN
+    with pytest.raises(CircuitOpenError) as rejected:
+        circuit.acquire()
+    assert rejected.value.retry_after == pytest.approx(30)
+
+
+def test_half_open_probes_close_or_reopen_it() -> None:
+    clock = FakeClock()
+    circuit = breaker(clock)
+    circuit._transition(OPEN)
+    clock.now += 31
+    circuit.acquire()
+    circuit.acquire()
+    assert circuit.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        circuit.acquire()
+    circuit.record(1)
+    circuit.record(1)
+    assert circuit.state == CLOSED
+
+    circuit._transition(OPEN)
+    clock.now += 31
+    circuit.acquire()
+    circuit.record(1, server_error())
+    assert circuit.state == OPEN
+    assert circuit.opened == 3
+
+
+def test_pool_calls_time_out_and_trip_the_circuit() -> None:
+    clock = FakeClock()
+    target = AzureDeployment(name="westus", endpoint="https://westus.openai.azure.com", deployment="gpt-4o", api_version="2024-10-21", api_key="key", primary=True)
+    circuit = CircuitBreaker("westus", enabled=True, window=2, min_calls=2, call_timeout_sec=0.01, clock=clock)
+    pool = DeploymentPool([target], breaker=circuit, clock=clock)
+
+    async def hangs(deployment: AzureDeployment) -> str:
+        await asyncio.sleep(1)
+        return deployment.name
+
+    for _ in range(2):
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(pool.call(hangs))
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(pool.call(hangs))
+    assert pool.stats()["circuit"]["state"] == OPEN
+
+
+def test_clarify_issue_falls_back_to_lexical_flows() -> None:
+    async def unavailable(**kwargs):
+        raise CircuitOpenError("westus", 30)
+
+    ai_resource = SimpleNamespace(get_structured_response=unavailable)
+    clarify = ClarifyIssue(ai_resource=ai_resource, copilot="decking", subtopic="railings")
+    response = asyncio.run(clarify.start_conversation(user_input="railing is loose", redirect_answer=None))
+    assert response.served_by == "fallback"
+    expected = clarify.instructions_model.subtopic_issues.fallback_candidates("railing is loose", 4)
+    assert [answer.TriggerId for answer in response.copilot_answer_set] == [issue.associated_copilot_flow for issue in expected] + ["None"]
@@ -0,0 +1,169 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from resources import deployments
+from resources.deployments import AzureDeployment, DeploymentPool, HedgeBudget
+
+
+def deployment(name: str, primary: bool = False) -> AzureDeployment:
+    return AzureDeployment(name=name, endpoint="https://{}.openai.azure.com".format(name), deployment="gpt-4o", api_version="2024-10-21", api_key="key", primary=primary)
+
+
+def pool(budget: HedgeBudget = None) -> DeploymentPool:
+    return DeploymentPool([deployment("westus", primary=True), deployment("eastus")], hedging=True, budget=budget or HedgeBudget(ratio=1, burst=1))
+
+
+def slow_primary(delays: dict, cancelled: list):
+    async def request(target: AzureDeployment) -> str:
+        try:
+            await asyncio.sleep(delays[target.name])
+        except asyncio.CancelledError:
+            cancelled.append(target.name)
+            raise
+        if isinstance(delays.get(target.name + "_error"), Exception):
+            raise delays[target.name + "_error"]
+        return target.name
+    return request
+
+
+@pytest.fixture(autouse=True)
+def short_delays(monkeypatch) -> None:
+    monkeypatch.setattr(deployments, "HEDGE_DEFAULT_DELAY_SEC", 0.05)
+
+
+def test_fast_primary_is_not_hedged() -> None:
+    hedged = pool()
+    cancelled = []
+    assert asyncio.run(hedged.call(slow_primary({"westus": 0.01, "eastus": 0.01}, cancelled))) == "westus"
+    assert hedged.hedges == 0
+    assert hedged.primary.calls == 1
+
+
+def test_slow_primary_is_hedged_and_the_loser_cancelled() -> None:
+    hedged = pool()
+    cancelled = []
+    assert asyncio.run(hedged.call(slow_primary({"westus": 1.0, "eastus": 0.01}, cancelled))) == "eastus"
+    assert cancelled == ["westus"]
+    assert (hedged.hedges, hedged.hedge_wins) == (1, 1)
+
+
+def test_hedges_are_capped_by_the_budget() -> None:
+    hedged = pool(budget=HedgeBudget(ratio=0, burst=1))
+    cancelled = []
+    request = slow_primary({"westus": 0.1, "eastus": 0.01}, cancelled)
+
+    async def run() -> list:
+        return [await hedged.call(request) for _ in range(2)]
+
+    assert asyncio.run(run()) == ["eastus", "westus"]
+    assert (hedged.hedges, hedged.hedges_over_budget) == (1, 1)
+
+
+def test_a_failed_hedge_waits_for_the_primary() -> None:
+    hedged = pool()
+    cancelled = []
+    delays = {"westus": 0.1, "eastus": 0.01, "eastus_error": RuntimeError("429")}
+    assert asyncio.run(hedged.call(slow_primary(delays, cancelled))) == "westus"
+    assert hedged.deployments[1].errors == 1
+
+
+def test_hedge_delay_follows_the_latency_percentile() -> None:
+    target = deployment("westus")
+    assert DeploymentPool([target]).hedge_delay(target) == 0.05
+    for seconds in range(1, 101):
+        target.record(seconds / 10)
+    assert DeploymentPool([target]).hedge_delay(target) == pytest.approx(9.1)
+
+
+def test_configured_pool(monkeypatch) -> None:
+    monkeypatch.setenv("AZURE_AI_API_KEY_EASTUS", "east-key")
+    monkeypatch.setattr(deployments, "AZURE_AI_DEPLOYMENT_POOL", '[{"name": "eastus", "endpoint": "https://eastus.openai.azure.com", "api_key_env": "AZURE_AI_API_KEY_EASTUS"}]')
+    env_config = SimpleNamespace(azure_ai_endpoint="https://pool-test.openai.azure.com", azure_ai_version="2024-10-21", azure_ai_api_key="west-key")
+    shared = deployments.shared_deployment_pool(env_config, "gpt-4o")
+    assert [(item.name, item.deployment, item.api_key, item.primary) for item in shared.deployments] == [("gpt-4o", "gpt-4o", "west-key", True), ("eastus", "gpt-4o", "east-key", False)]
+    assert deployments.shared_deployment_pool(env_config, "gpt-4o") is shared
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def status_error(status: int, headers: dict = None) -> openai.APIStatusError:
+    response = httpx.Response(status, headers=headers or {}, request=httpx.Request("POST", "https://westus.openai.azure.com/openai/deployments/gpt-4o/chat/completions"))
+    error_type = openai.RateLimitError if status == 429 else openai.InternalServerError if status >= 500 else openai.BadRequestError
+    return error_type("status {}".format(status), response=response, body=None)
+
+
+def failing(errors: dict, tried: list):
+    async def request(target: AzureDeployment) -> str:
+        tried.append(target.name)
+        if target.name in errors:
+            raise errors[target.name]
+        return target.name
+    return request
+
+
+def test_routes_to_the_lowest_ewma_latency() -> None:
+    routed = pool()
+    for _ in range(5):
+        routed.deployments[0].succeeded(2.0)
+        routed.deployments[1].succeeded(0.5)
+    assert [item.name for item in routed.candidates()] == ["eastus", "westus"]
+    assert routed.deployments[1].ewma_latency == pytest.approx(0.5)
+
+
+def test_low_rate_limit_headroom_is_avoided() -> None:
+    routed = pool()
+    routed.deployments[0].observe_headers({"x-ratelimit-remaining-tokens": "1200", "x-ratelimit-remaining-requests": "80"})
+    assert [item.name for item in routed.candidates()] == ["eastus", "westus"]
+    routed.deployments[0].observe_headers({"x-ratelimit-remaining-tokens": "90000"})
+    assert routed.deployments[0].remaining_requests == 80
+    assert [item.name for item in routed.candidates()] == ["westus", "eastus"]
+
+
+def test_throttled_deployment_fails_over_and_is_ejected() -> None:
+    clock = FakeClock()
+    routed = DeploymentPool([deployment("westus", primary=True), deployment("eastus")], hedging=True, clock=clock)
+    tried = []
+    request = failing({"westus": status_error(429, {"retry-after": "20"})}, tried)
+    assert asyncio.run(routed.call(request)) == "eastus"
+    assert tried == ["westus", "eastus"]
+    assert (routed.failovers, routed.primary.throttled) == (1, 1)
+    assert [item.name for item in routed.candidates()] == ["eastus", "westus"]
+    clock.now += 21
+    assert routed.primary.available(clock.now)
+
+
+def test_errors_eject_once_over_the_rate() -> None:
+    clock = FakeClock()
+    target = deployment("westus")
+    for _ in range(3):
+        assert target.failed(status_error(503), clock.now)
+        assert target.available(clock.now)
+    assert target.failed(status_error(503), clock.now)
+    assert not target.available(clock.now)
+
+
+def test_bad_requests_are_not_failed_over() -> None:
+    routed = pool()
+    tried = []
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(routed.call(failing({"westus": status_error(400)}, tried)))
+    assert tried == ["westus"]
+    assert routed.primary.available(routed.clock())
+
+
+def test_rate_limit_headers_are_read_from_responses(monkeypatch) -> None:
+    target = deployment("ratelimits")
+    monkeypatch.setitem(deployments._routes, ("ratelimits.openai.azure.com", "gpt-4o"), target)
+    request = httpx.Request("POST", "https://ratelimits.openai.azure.com/openai/deployments/gpt-4o/chat/completions?api-version=2024-10-21")
+    deployments._observe_rate_limits(httpx.Response(200, headers={"x-ratelimit-remaining-tokens": "5000", "x-ratelimit-remaining-requests": "7"}, request=request))
+    assert (target.remaining_tokens, target.remaining_requests) == (5000, 7)
@@ -0,0 +1,45 @@
+import pathlib
+
+import numpy as np
+
+from google_cloud_functions.dynamic_qna.models import TopicTrainingModel
+from resources.embeddings import EmbeddingIndex, EmbeddingRanker, HashingEmbedder
+
+
+OBSERVATIONS = [
+    "A wood deck is springy or shaky.",
+    "Deck boards are split or warped.",
+    "Railing posts are loose.",
+    "Stain on the deck is fading.",
+]
+
+
+def test_hashing_embedder_is_deterministic() -> None:
+    embedder = HashingEmbedder()
+    assert np.array_equal(embedder.embed(OBSERVATIONS), HashingEmbedder().embed(OBSERVATIONS))
+
+
+def test_index_round_trips_through_mmap(tmp_path: pathlib.Path) -> None:
+    embedder = HashingEmbedder()
+    path = EmbeddingIndex.build(OBSERVATIONS, embedder).save(str(tmp_path / "index.npy"))
+    index = EmbeddingIndex.load(path)
+    assert isinstance(index.matrix, np.memmap)
+    assert index.matrix.dtype == np.float16
+    assert index.embedder_name == embedder.name
+
+    rows, scores = index.top_k(embedder.embed(["springy shaky deck", "loose railing posts"]), k=2)
+    assert rows.shape == (2, 2)
+    assert index.row_ids([OBSERVATIONS[0], OBSERVATIONS[2]]) == [rows[0][0], rows[1][0]]
+    assert scores[0][0] >= scores[0][1]
+
+
+def test_ranker_falls_back_for_unindexed_issues() -> None:
+    issues = TopicTrainingModel(copilot="decking", subtopic="boards").subtopic_issues
+    embedder = HashingEmbedder()
+    ranker = EmbeddingRanker(EmbeddingIndex.build([issue.observation for issue in issues], embedder), embedder)
+    ranked = ranker(issues.issues, issues.issues[0].observation)
+    assert ranked[0][0] is issues.issues[0]
+    assert issues.shortlist("springy", top_k=2, ranker=ranker).issues[0] in issues.issues
+
+    partial = EmbeddingRanker(EmbeddingIndex.build([issues.issues[0].observation], embedder), embedder)
+    assert partial(issues.issues, "springy") is None
@@ -0,0 +1,39 @@
+import threading
+from utils.firestore_clients import FirestoreClientRegistry
+
+
+class FakeClient:
+    def __init__(self, project: str) -> None:
+        self.project = project
+        self.closed = False
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def test_one_client_per_project() -> None:
+    registry = FirestoreClientRegistry(factory=FakeClient)
+    first = registry.client('dev')
+    assert registry.client('dev') is first
+    assert registry.client('prod') is not first
+    assert registry.stats() == {'dev': {'created': 1, 'reused': 1}, 'prod': {'created': 1, 'reused': 0}}
+
+
+def test_concurrent_first_use_creates_one_client() -> None:
+    registry = FirestoreClientRegistry(factory=FakeClient)
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(registry.client('dev'))) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(client) for client in clients}) == 1
+    assert registry.stats()['dev'] == {'created': 1, 'reused': 15}
+
+
+def test_close_drops_clients() -> None:
+    registry = FirestoreClientRegistry(factory=FakeClient)
+    first = registry.client('dev')
+    registry.close()
+    assert first.closed
+    assert registry.client('dev') is not first
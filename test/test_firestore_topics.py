@@ -0,0 +1,95 @@
+import importlib
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from pydantic import ValidationError
+
+# Runs against the Firestore emulator only: gcloud emulators firestore start --host-port=localhost:8081
+emulator = pytest.mark.skipif(not os.environ.get("FIRESTORE_EMULATOR_HOST"), reason="FIRESTORE_EMULATOR_HOST not set")
+
+
+@pytest.fixture
+def clarify_issue():  # noqa: ANN201
+    module = importlib.import_module("google_cloud_functions.clarify_issue.main")
+    module.TOPIC_CACHE.clear()
+    return module
+
+
+def seed(db, collection: str, flow: str) -> None:  # noqa: ANN001
+    topic_ref = db.collection(collection).document("decking")
+    topic_ref.set({"topic_id": "crc_decking", "topic": "Decking"})
+    topic_ref.collection("boards").document("1").set(
+        {"issue_number": 1, "observation": "A wood deck is springy.", "associated_copilot_flow": flow, "subtopics": ["boards"]})
+
+
+@emulator
+def test_topic_cache_is_invalidated_by_listener(clarify_issue) -> None:  # noqa: ANN001
+    topics = clarify_issue.FireStoreTopics(topic="decking", env="dev")
+    collection = topics.env_config.collection(clarify_issue.FBCollection.azure_data)
+    seed(topics.db, collection, "SpringyDeck")
+
+    first = topics.get_topic_doc()
+    assert first.issues[0].associated_copilot_flow == "SpringyDeck"
+    assert clarify_issue.FireStoreTopics(topic="decking", env="dev").get_topic_doc() is first
+
+    seed(topics.db, collection, "ShakyDeck")
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        current = clarify_issue.TOPIC_CACHE.peek(topics.cache_key)
+        if current is not None and current.issues[0].associated_copilot_flow == "ShakyDeck":
+            break
+        time.sleep(0.1)
+    assert clarify_issue.TOPIC_CACHE.peek(topics.cache_key).issues[0].associated_copilot_flow == "ShakyDeck"
+
+
+class FakeIssues:
+    def __init__(self, name: str, issues: list, barrier: threading.Barrier, delay: float) -> None:
+        self.name = name
+        self.issues = issues
+        self.barrier = barrier
+        self.delay = delay
+
+    def stream(self) -> list:
+        # Every collection has to be streaming at once for the barrier to open
+        self.barrier.wait(timeout=2)
+        time.sleep(self.delay)
+        return [SimpleNamespace(to_dict=lambda issue=issue: dict(issue)) for issue in self.issues]
+
+
+def fake_topics(clarify_issue, monkeypatch, collections: list):  # noqa: ANN001, ANN201
+    topic_ref = SimpleNamespace(
+        get=lambda: SimpleNamespace(to_dict=lambda: {"topic_id": "crc_decking", "topic": "Decking"}),
+        collections=lambda: iter(collections))
+    db = SimpleNamespace(collection=lambda name: SimpleNamespace(document=lambda topic: topic_ref))
+    monkeypatch.setattr(clarify_issue, "firestore_client", lambda project: db)
+    return clarify_issue.FireStoreTopics(topic="decking", env="dev")
+
+
+def issue(number: int, flow: str) -> dict:
+    return {"issue_number": number, "observation": "Deck issue {}.".format(number), "associated_copilot_flow": flow, "subtopics": ["boards"]}
+
+
+def test_issue_collections_are_fetched_in_parallel_and_keep_their_order(clarify_issue, monkeypatch) -> None:  # noqa: ANN001
+    barrier = threading.Barrier(3)
+    topics = fake_topics(clarify_issue, monkeypatch, [
+        FakeIssues("boards", [issue(1, "CrackedBoards"), issue(2, "SpringyDeck")], barrier, delay=0.05),
+        FakeIssues("railing", [issue(3, "LooseRailing")], barrier, delay=0.02),
+        FakeIssues("stairs", [issue(4, "ShakyStairs")], barrier, delay=0)])
+
+    topic_model = topics._load_topic_doc()
+    assert [issue.issue_number for issue in topic_model.issues] == [1, 2, 3, 4]
+    assert all(isinstance(issue, clarify_issue.IssueTrainingModel) for issue in topic_model.issues)
+    assert topic_model.issue_index().by_flow["LooseRailing"].issue_number == 3
+
+
+def test_malformed_issue_fails_validation(clarify_issue, monkeypatch) -> None:  # noqa: ANN001
+    barrier = threading.Barrier(2)
+    topics = fake_topics(clarify_issue, monkeypatch, [
+        FakeIssues("boards", [issue(1, "CrackedBoards")], barrier, delay=0),
+        FakeIssues("railing", [{**issue(2, "LooseRailing"), "issue_number": "two"}], barrier, delay=0)])
+
+    with pytest.raises(ValidationError):
+        topics._get_topic_issues()
@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+
+from google_cloud_functions.dynamic_qna.instructions import SystemInstructionsCreator
+from google_cloud_functions.dynamic_qna.models import TopicTrainingModel
+from resources.messages import PromptCacheUsage, prompt_messages
+
+
+def messages(user_input: str, topic_list_in_prefix: bool = True) -> list:
+    creator = SystemInstructionsCreator("decking", "boards", TopicTrainingModel("decking", "boards"), user_input=user_input, topic_list_in_prefix=topic_list_in_prefix)
+    return prompt_messages(
+        creator.base_system_instructions(), [user_input],
+        topic_instructions=creator.clarifyUserIssueInstructions(),
+        context_instructions=creator.topic_list_instructions())
+
+
+def test_only_the_user_input_changes_across_inputs() -> None:
+    springy, cracked = messages("the deck feels springy"), messages("boards are cracked and splitting")
+    assert springy[:-1] == cracked[:-1]
+    assert [message["role"] for message in springy] == ["system", "system", "user"]
+    assert "topic_list" in springy[0]["content"]
+    creator = SystemInstructionsCreator("decking", "boards", TopicTrainingModel("decking", "boards"))
+    assert creator.topic_list == creator.template.topic_list.full
+
+
+def test_shortlisted_topic_list_follows_the_task_instructions() -> None:
+    springy, cracked = messages("the deck feels springy", False), messages("boards are cracked and splitting", False)
+    assert springy[:2] == cracked[:2]
+    assert [message["role"] for message in springy] == ["system", "system", "system", "user"]
+    assert "topic_list" in springy[2]["content"]
+
+
+def test_empty_sections_are_left_out() -> None:
+    assert [message["role"] for message in prompt_messages(["system"], ["user"], topic_instructions=[])] == ["system", "user"]
+
+
+def test_usage_records_cached_tokens() -> None:
+    usage = PromptCacheUsage()
+    hit = SimpleNamespace(usage=SimpleNamespace(prompt_tokens=2000, prompt_tokens_details=SimpleNamespace(cached_tokens=1536)))
+    miss = SimpleNamespace(usage=SimpleNamespace(prompt_tokens=2000, prompt_tokens_details=None))
+    assert usage.record(hit) == 1536
+    assert usage.record(miss) == 0
+    assert usage.record(SimpleNamespace(usage=None)) is None
+    assert usage.stats() == {"requests": 2, "prompt_tokens": 4000, "cached_tokens": 1536, "hit_rate": 0.5, "cached_token_ratio": 0.384}
+
+
+def test_warm_prompt_cache_sends_the_stable_prefix() -> None:
+    import asyncio
+
+    from openai import LengthFinishReasonError
+
+    from resources import AIResource
+
+    sent = {}
+    completion = SimpleNamespace(usage=SimpleNamespace(prompt_tokens=1200, prompt_tokens_details=None))
+
+    async def parse(**kwargs):
+        sent.update(kwargs)
+        raise LengthFinishReasonError(completion=completion)
+
+    resource = AIResource()
+    resource.connected = True
+    resource.chat_client = SimpleNamespace(beta=SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=parse))))
+    assert asyncio.run(resource.warm_prompt_cache(system_prompt=["system"], topic_instructions=["task"]))
+    assert [message["content"] for message in sent["messages"][:2]] == ["system", "task"]
+    assert sent["max_tokens"] == 1
+
+
+def test_warm_prompt_cache_settles_its_quota() -> None:
+    import asyncio
+
+    from openai import LengthFinishReasonError
+
+    from resources import AIResource
+    from resources.rate_limits import LoadShedError
+
+    settled, parsed = [], []
+    shed = [False]
+
+    async def acquire(deployment, cost, priority):
+        if shed[0]:
+            raise LoadShedError("westus", priority, 1.0)
+        return SimpleNamespace(settle=settled.append)
+
+    async def parse(**kwargs):
+        parsed.append(kwargs)
+        raise LengthFinishReasonError(completion=SimpleNamespace(usage=SimpleNamespace(prompt_tokens=1200, total_tokens=1201, prompt_tokens_details=None)))
+
+    resource = AIResource()
+    resource.connected = True
+    resource.chat_client = SimpleNamespace(beta=SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=parse))))
+    resource.deployments = SimpleNamespace(breaker=SimpleNamespace(closed=True), primary=None, acquire=acquire)
+    assert asyncio.run(resource.warm_prompt_cache(system_prompt=["system"]))
+    assert settled == [1201]
+
+    # Shed for want of spare quota: skipped, Azure isn't called
+    shed[0] = True
+    assert not asyncio.run(resource.warm_prompt_cache(system_prompt=["system"]))
+    assert len(parsed) == 1
@@ -0,0 +1,64 @@
+from utils.near_duplicates import NEAR_DUPLICATE_THRESHOLD, LSHIndex, MinHasher, contrast_terms, jaccard, shingles
+
+
+def test_shingles_ignore_stop_words_and_plurals() -> None:
+    assert shingles("My deck feels bouncy") == frozenset({"deck", "feel", "bouncy"})
+    assert shingles("the deck is bouncy", size=2) == frozenset({"deck bouncy"})
+    assert shingles("") == frozenset()
+
+
+def test_minhash_estimates_jaccard() -> None:
+    hasher = MinHasher(permutations=256)
+    a = shingles("water leaking under the kitchen sink cabinet floor")
+    b = shingles("water leaking under the bathroom sink cabinet floor")
+    signature_a, signature_b = hasher.signature(a), hasher.signature(b)
+    estimate = sum(x == y for x, y in zip(signature_a, signature_b)) / len(signature_a)
+    assert abs(estimate - jaccard(a, b)) < 0.15
+    assert MinHasher(permutations=256).signature(a) == signature_a
+
+
+def test_query_finds_phrasing_variants_only() -> None:
+    index = LSHIndex(threshold=0.65)
+    index.add("bouncy", "my deck feels bouncy")
+    index.add("sticks", "front door sticks")
+    assert index.query("the deck is bouncy")[0] == "bouncy"
+    assert index.query("Front door STICKS!")[0] == "sticks"
+    assert index.query("deck boards are cracked") is None
+
+
+def test_oldest_entries_are_dropped() -> None:
+    index = LSHIndex(threshold=0.65, max_entries=1)
+    index.add("bouncy", "my deck feels bouncy")
+    index.add("sticks", "front door sticks")
+    assert len(index) == 1
+    assert index.query("my deck feels bouncy") is None
+
+
+def test_contrast_terms() -> None:
+    assert contrast_terms("The garage door doesn't close") == frozenset({"not", "close"})
+    assert contrast_terms("crack wider than 1/4 inch.") == frozenset({"wider", "1/4"})
+    assert contrast_terms("my deck feels bouncy") == frozenset()
+
+
+def test_opposite_inputs_are_not_near_duplicates() -> None:
+    pairs = [
+        ("the garage door does not close", "the garage door does close"),
+        ("crack in the foundation wider than 1/4 inch", "crack in the foundation narrower than 1/4 inch"),
+        ("crack in the foundation wider than 1/4 inch", "crack in the foundation wider than 1/2 inch"),
+        ("leaking in basement north wall", "leaking in basement south wall")]
+    for stored, asked in pairs:
+        # Even at a threshold their word overlap passes
+        for threshold in (NEAR_DUPLICATE_THRESHOLD, 0.5):
+            index = LSHIndex(threshold=threshold)
+            index.add("stored", stored)
+            assert index.query(asked) is None, (stored, asked, threshold)
+            assert index.query(stored)[0] == "stored"
+
+
+def test_default_threshold_matches_paraphrases() -> None:
+    index = LSHIndex()
+    index.add("bouncy", "my deck feels bouncy")
+    assert index.query("The deck feels bouncy!")[0] == "bouncy"
+    assert index.query("the deck is bouncy")[0] == "bouncy"
+    assert index.query("the deck isn't bouncy") is None
+    assert index.query("deck boards are cracked") is None
@@ -0,0 +1,82 @@
+from functools import partial
+
+import pytest
+
+from google_cloud_functions.clarify_issue import main as clarify_issue_main
+from google_cloud_functions.dynamic_qna.instructions import PROMPT_TEMPLATES, SystemInstructionsCreator
+from google_cloud_functions.dynamic_qna.models import TopicTrainingModel
+from resources import subtopic_instructions
+from resources.subtopic_instructions import SubtopicInstructions
+from utils.prompt_templates import CompiledTopicList
+from utils.tokens import count_tokens, fit_budget
+
+
+def test_topic_list_renders_like_str_of_list() -> None:
+    issues = [{"observation": "Board's cracked", "issue_number": n} for n in range(4)]
+    topic_list = CompiledTopicList(issues, item=lambda issue: {"observation": issue["observation"], "issue_number": issue["issue_number"]}, compact=False)
+    assert topic_list.render(issues) == str(issues)
+    assert topic_list.render(issues[1:3]) == str(issues[1:3])
+    assert topic_list.render([]) == "[]"
+
+
+def test_compact_topic_list_drops_empty_fields() -> None:
+    issues = [
+        {"issue_number": 1, "observation": "Deck boards | cracked", "notes": "", "subtopics": ["boards", "railing"]},
+        {"issue_number": 2, "observation": "Loose railing", "notes": None, "subtopics": []},
+    ]
+    topic_list = CompiledTopicList(issues, item=dict)
+    assert topic_list.render(issues) == "issue_number | observation | subtopics\n1 | Deck boards / cracked | boards, railing\n2 | Loose railing | "
+    assert topic_list.render(issues[1:]) == "issue_number | observation | subtopics\n2 | Loose railing | "
+    assert all(tokens > 0 for tokens in topic_list.tokens.values())
+    assert len(topic_list.render(issues)) < len(str(issues))
+
+
+def test_template_shared_across_requests() -> None:
+    first = SystemInstructionsCreator("decking", "boards", TopicTrainingModel("decking", "boards"))
+    second = SystemInstructionsCreator("decking", "boards", TopicTrainingModel("decking", "boards"), user_input="boards are cracking")
+    assert first.template is second.template
+    assert first.template_key in {key for key in PROMPT_TEMPLATES._entries}
+    assert first.base_system_instructions()[1:] == second.base_system_instructions()[1:]
+    assert first.base_system_instructions() is not first.base_system_instructions()
+
+    unlimited = SystemInstructionsCreator("decking", "boards", TopicTrainingModel("decking", "boards"), limit_request=False)
+    assert unlimited.template is not first.template
+    assert unlimited.topic_list.count("\n") == len(unlimited.subtopic_issues.issues)
+    assert "None" not in unlimited.topic_list.splitlines()[0]
+
+
+def test_budget_trims_lowest_ranked_then_additional_info() -> None:
+    fit = fit_budget(fixed_tokens=10, candidates=[("a", 5), ("b", 5), ("c", 5), ("d", 5)], optional_tokens=8, budget=33, min_candidates=2)
+    assert fit.kept == ["a", "b", "c"] and fit.keep_optional and fit.tokens == 33
+    fit = fit_budget(fixed_tokens=10, candidates=[("a", 5), ("b", 5), ("c", 5), ("d", 5)], optional_tokens=8, budget=22, min_candidates=2)
+    assert fit.kept == ["a", "b"] and not fit.keep_optional and fit.tokens == 20
+    assert fit_budget(fixed_tokens=10, candidates=[("a", 5)], budget=0).kept == ["a"]
+
+
+def test_creator_respects_prompt_budget(monkeypatch) -> None:
+    monkeypatch.setattr(subtopic_instructions, "fit_budget", partial(fit_budget, budget=1, min_candidates=1))
+    creator = SystemInstructionsCreator("decking", "boards", TopicTrainingModel("decking", "boards"), user_input="boards are cracking", topic_list_in_prefix=False)
+    assert creator.topic_list.count("\n") == 1
+    assert creator.prompt_issues.ranking[0].observation in creator.topic_list
+    assert creator.base_system_instructions()[-1] == ""
+    assert count_tokens("deck boards") > 0
+
+
+def test_prefix_budget_ignores_the_user_input(monkeypatch) -> None:
+    monkeypatch.setattr(subtopic_instructions, "fit_budget", partial(fit_budget, budget=1, min_candidates=1))
+    short = SystemInstructionsCreator("decking", "boards", TopicTrainingModel("decking", "boards"), user_input="springy")
+    long = SystemInstructionsCreator("decking", "boards", TopicTrainingModel("decking", "boards"), user_input="the boards are cracking and the railing is loose")
+    assert short.base_system_instructions() == long.base_system_instructions()
+    assert short.include_additional_topic_info
+    assert short.topic_list_instructions() == []
+
+
+def test_both_endpoints_share_the_subtopic_instructions() -> None:
+    assert issubclass(SystemInstructionsCreator, SubtopicInstructions)
+    assert issubclass(clarify_issue_main.SystemInstructionsCreator, SubtopicInstructions)
+
+    class Incomplete(SubtopicInstructions):
+        templates = PROMPT_TEMPLATES
+
+    with pytest.raises(TypeError):
+        Incomplete("decking", "boards", TopicTrainingModel("decking", "boards"))
@@ -0,0 +1,165 @@
+import asyncio
+
+import pytest
+
+from resources.deployments import AzureDeployment, DeploymentPool
+from resources.rate_limits import LoadShedError, Priority, RateLimiter, TokenBucket, estimate_tokens, shed_response
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+QUEUE_SEC = {Priority.interactive: 5, Priority.cold_start: 15, Priority.batch: 60}
+
+
+def limiter(clock: FakeClock, tpm: int = 600, rpm: int = 0, max_queued: int = 16) -> RateLimiter:
+    # 600 TPM is 10 tokens a second, 100 in a full bucket
+    return RateLimiter("westus", tpm=tpm, rpm=rpm, clock=clock, max_queue_sec=QUEUE_SEC, max_queued=max_queued)
+
+
+def test_estimate_counts_prompt_and_expected_output() -> None:
+    messages = [{"role": "system", "content": "You classify deck issues."}, {"role": "user", "content": "deck is springy"}]
+    assert estimate_tokens(messages, expected_output=0) > 0
+    assert estimate_tokens(messages, expected_output=400) == estimate_tokens(messages, expected_output=0) + 400
+
+
+def test_token_bucket_refills_up_to_its_burst() -> None:
+    clock = FakeClock()
+    bucket = TokenBucket(600, burst_sec=10, clock=clock)
+    bucket.take(100)
+    assert bucket.wait_time(30) == pytest.approx(3)
+    clock.now += 60
+    assert bucket.wait_time(100) == 0
+    assert bucket.level == 100
+
+
+def test_interactive_requests_go_ahead_of_batch() -> None:
+    clock = FakeClock()
+    limits = limiter(clock)
+    limits.submit(100)
+    assert limits.dispatch() is None
+    batch = limits.submit(50, Priority.batch)
+    interactive = limits.submit(50, Priority.interactive)
+    assert limits.dispatch() == pytest.approx(5)
+    clock.now += 5
+    limits.dispatch()
+    assert (interactive.granted, batch.granted) == (True, False)
+    clock.now += 5
+    limits.dispatch()
+    assert batch.granted
+
+
+def test_requests_expected_to_wait_too_long_are_shed() -> None:
+    clock = FakeClock()
+    limits = limiter(clock)
+    limits.submit(100)
+    limits.dispatch()
+    with pytest.raises(LoadShedError) as shed:
+        limits.submit(80, Priority.interactive)
+    assert shed.value.retry_after == pytest.approx(8)
+    # Batch work may wait longer
+    assert not limits.submit(80, Priority.batch).granted
+    assert limits.stats()["shed"] == {"interactive": 1, "cold_start": 0, "batch": 0}
+
+
+def test_queued_batch_is_shed_past_its_deadline() -> None:
+    clock = FakeClock()
+    limits = limiter(clock)
+    limits.submit(100)
+    limits.dispatch()
+    batch = limits.submit(100, Priority.batch)
+    for _ in range(7):
+        clock.now += 9
+        limits.submit(90, Priority.interactive)
+        limits.dispatch()
+    assert isinstance(batch.error, LoadShedError)
+    assert not batch.granted
+
+
+def test_full_queue_sheds_the_lowest_priority() -> None:
+    clock = FakeClock()
+    limits = limiter(clock, max_queued=2)
+    limits.submit(100)
+    limits.dispatch()
+    cold_start = limits.submit(10, Priority.cold_start)
+    limits.submit(10, Priority.interactive)
+    limits.submit(10, Priority.interactive)
+    assert isinstance(cold_start.error, LoadShedError)
+    with pytest.raises(LoadShedError):
+        limits.submit(10, Priority.batch)
+
+
+def test_settling_returns_unused_tokens() -> None:
+    clock = FakeClock()
+    limits = limiter(clock)
+    ticket = limits.submit(100)
+    limits.dispatch()
+    ticket.settle(40)
+    assert limits.tokens.level == pytest.approx(60)
+
+
+def test_requests_per_minute() -> None:
+    clock = FakeClock()
+    limits = limiter(clock, tpm=0, rpm=6)
+    assert limits.enabled and limits.tokens is None
+    limits.submit(1)
+    assert limits.dispatch() is None
+    with pytest.raises(LoadShedError):
+        limits.submit(1)
+    limits.submit(1, Priority.cold_start)
+    assert limits.dispatch() == pytest.approx(10)
+
+
+def test_acquire_waits_for_the_dispatch_that_grants_it() -> None:
+    clock = FakeClock()
+    limits = limiter(clock)
+
+    async def run() -> bool:
+        await limits.acquire(100)
+        waiting = asyncio.ensure_future(limits.acquire(50))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        clock.now += 5
+        limits.dispatch()
+        return (await asyncio.wait_for(waiting, 1)).granted
+
+    assert asyncio.run(run())
+
+
+def pool(clock: FakeClock) -> DeploymentPool:
+    deployments = [
+        AzureDeployment(name=name, endpoint="https://{}.openai.azure.com".format(name), deployment="gpt-4o", api_version="2024-10-21", api_key="key", primary=name == "westus", tpm=600)
+        for name in ("westus", "eastus")]
+    shared = DeploymentPool(deployments, hedging=False, clock=clock)
+    for limits in shared.limiters.values():
+        limits.max_queue_sec = QUEUE_SEC
+    return shared
+
+
+async def name(target: AzureDeployment) -> str:
+    return target.name
+
+
+def test_pool_prefers_deployments_with_quota_and_sheds_when_none_has() -> None:
+    clock = FakeClock()
+    shared = pool(clock)
+
+    async def run() -> list:
+        return [await shared.call(name, cost=100) for _ in range(2)]
+
+    assert asyncio.run(run()) == ["westus", "eastus"]
+    with pytest.raises(LoadShedError):
+        asyncio.run(shared.call(name, cost=100))
+    assert shared.stats()["deployments"]["westus"]["quota"]["shed"]["interactive"] == 1
+
+
+def test_shed_response_is_a_503_with_retry_after() -> None:
+    body, status, headers = shed_response(LoadShedError("westus", Priority.interactive, 2.2), {"Access-Control-Allow-Origin": "*"})
+    assert status == 503
+    assert headers == {"Access-Control-Allow-Origin": "*", "Retry-After": "3"}
+    assert "interactive" in body["response"]
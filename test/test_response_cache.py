@@ -0,0 +1,157 @@
+import asyncio
+from types import SimpleNamespace
+from typing import List
+
+import pytest
+from pydantic import BaseModel
+
+from resources import AIResource
+from resources import structured_completions
+from resources.messages import prompt_messages
+from resources.response_cache import ResponseCache, normalize_user_input
+
+
+class Answer(BaseModel):
+    text: str
+    flows: List[str] = []
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def messages(user_input: str, subtopic: str = "deck_boards") -> list:
+    return prompt_messages(["You classify {} issues.".format(subtopic)], [user_input], topic_instructions=["Ask one question."])
+
+
+def test_normalized_inputs_share_a_key() -> None:
+    cache = ResponseCache(name="test", path="")
+    assert normalize_user_input("  Deck is SPRINGY!! ") == "deck is springy"
+    assert cache.key("gpt-4o", Answer, messages("Deck is springy.")) == cache.key("gpt-4o", Answer, messages("deck  is springy"))
+    assert cache.key("gpt-4o", Answer, messages("deck is springy")) != cache.key("gpt-4o", Answer, messages("deck is springy", subtopic="railings"))
+    assert cache.key("gpt-4o", Answer, messages("deck is springy")) != cache.key("gpt-4o-mini", Answer, messages("deck is springy"))
+
+
+def test_hits_misses_and_copies() -> None:
+    cache = ResponseCache(name="test", path="")
+    key = cache.key("gpt-4o", Answer, messages("door sticks"))
+    assert cache.get(key, Answer) is None
+    cache.put(key, Answer(text="Which door?", flows=["DoorSticks"]))
+    first = cache.get(key, Answer)
+    first.flows.append("Changed")
+    assert cache.get(key, Answer).flows == ["DoorSticks"]
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_entries_expire_and_are_capped() -> None:
+    clock = FakeClock()
+    cache = ResponseCache(name="test", ttl=60, max_entries=2, path="", clock=clock)
+    for text in ("a", "b", "c"):
+        cache.put(text, Answer(text=text))
+    assert cache.get("a", Answer) is None
+    assert cache.get("c", Answer).text == "c"
+    clock.now += 61
+    assert cache.get("c", Answer) is None
+
+
+def test_disabled_cache_stores_nothing() -> None:
+    cache = ResponseCache(name="test", ttl=0, path="")
+    cache.put("a", Answer(text="a"))
+    assert cache.get("a", Answer) is None
+
+
+def test_persisted_entries_survive_a_restart(tmp_path) -> None:
+    clock = FakeClock()
+    path = str(tmp_path / "responses.sqlite")
+    cache = ResponseCache(name="test", ttl=60, max_entries=2, path=path, clock=clock)
+    for text in ("a", "b", "c"):
+        cache.put(text, Answer(text=text))
+    cache.close()
+
+    clock.now += 30
+    restarted = ResponseCache(name="test", ttl=60, max_entries=2, path=path, clock=clock)
+    assert restarted.get("a", Answer) is None
+    assert restarted.get("c", Answer).text == "c"
+    assert restarted.stats()["disk_hits"] == 1
+    # Restored entries keep their original age
+    clock.now += 31
+    assert restarted.get("c", Answer) is None
+    restarted.close()
+
+
+def test_ai_resource_serves_repeated_requests_from_the_cache(monkeypatch) -> None:
+    monkeypatch.setattr(structured_completions, "RESPONSE_CACHE", ResponseCache(name="test", path=""))
+    calls = []
+
+    async def parse(**kwargs):
+        calls.append(kwargs)
+        return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=SimpleNamespace(parsed=Answer(text="Which board?")))])
+
+    resource = AIResource()
+    resource.connected = True
+    resource.chat_client = SimpleNamespace(beta=SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=parse))))
+
+    async def ask(user_input: str):
+        return await resource.get_structured_response(user_prompt=[user_input], system_prompt=["You classify deck issues."])
+
+    assert asyncio.run(ask("Deck is springy")).text == "Which board?"
+    assert asyncio.run(ask("deck is springy!")).text == "Which board?"
+    assert len(calls) == 1
+
+
+def test_clarify_issue_resource_shares_the_call_path(monkeypatch) -> None:
+    from google_cloud_functions.clarify_issue import main as clarify_issue_main
+
+    monkeypatch.setattr(structured_completions, "RESPONSE_CACHE", ResponseCache(name="test", path=""))
+    calls = []
+
+    async def parse(**kwargs):
+        calls.append(kwargs)
+        return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=SimpleNamespace(parsed=Answer(text="Which board?")))])
+
+    resource = clarify_issue_main.AIResource(env_config=clarify_issue_main.EnvConfig())
+    resource.connected = True
+    resource.chat_client = SimpleNamespace(beta=SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=parse))))
+
+    async def ask(user_input: str):
+        return await resource.get_structured_response(user_prompt=[user_input], system_instructions=["You classify deck issues."])
+
+    assert asyncio.run(ask("Deck is springy")).text == "Which board?"
+    assert asyncio.run(ask("deck is springy!")).text == "Which board?"
+    assert len(calls) == 1
+    assert calls[0]["response_format"] is clarify_issue_main.AIResponseFormatModel
+    assert calls[0]["messages"][0]["content"] == "You classify deck issues."
+
+
+def test_structured_completions_require_a_model_name() -> None:
+    class Unnamed(structured_completions.StructuredCompletions):
+        response_model = Answer
+
+    with pytest.raises(TypeError):
+        Unnamed()
+
+
+def test_near_duplicate_inputs_share_a_response() -> None:
+    cache = ResponseCache(name="test", path="", similarity_threshold=0.65)
+    scope = cache.key("gpt-4o", Answer, prompt_messages(["You classify deck issues."], []))
+    key = cache.key("gpt-4o", Answer, messages("my deck feels bouncy"))
+    cache.put(key, Answer(text="Which board?"), similar_scope=scope, user_input="my deck feels bouncy")
+    assert cache.get_similar(scope, "the deck is bouncy", Answer).text == "Which board?"
+    assert cache.get_similar(scope, "deck boards are cracked", Answer) is None
+    other_subtopic = cache.key("gpt-4o", Answer, prompt_messages(["You classify railing issues."], []))
+    assert cache.get_similar(other_subtopic, "the deck is bouncy", Answer) is None
+    assert (cache.stats()["similar_hits"], cache.stats()["similar_misses"]) == (1, 2)
+
+
+def test_opposite_inputs_miss_the_cache() -> None:
+    cache = ResponseCache(name="test", path="")
+    scope = cache.key("gpt-4o", Answer, prompt_messages(["You classify garage door issues."], []))
+    stored = "the garage door does not close"
+    cache.put(cache.key("gpt-4o", Answer, messages(stored)), Answer(text="Does it reverse?"), similar_scope=scope, user_input=stored)
+    assert cache.get_similar(scope, "the garage door does close", Answer) is None
+    assert cache.get_similar(scope, "The garage door does NOT close.", Answer).text == "Does it reverse?"
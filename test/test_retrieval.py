@@ -0,0 +1,82 @@
+from google_cloud_functions.dynamic_qna.models import TopicTrainingModel
+from utils.retrieval import BM25Index, shortlist, tokenize
+
+
+DOCUMENTS = [
+    "A wood deck is springy or shaky.",
+    "Deck boards are split or warped.",
+    "Railing posts are loose.",
+    "Stain on the deck is fading.",
+]
+
+
+def test_tokenize_folds_plurals_and_stop_words() -> None:
+    assert tokenize("The doors are sticking") == ["door", "sticking"]
+    assert tokenize("Stories") == ["story"]
+
+
+def test_bm25_ranks_matching_document_first() -> None:
+    index = BM25Index(DOCUMENTS, text=lambda document: document)
+    ranked = index.ranked("my deck feels springy")
+    assert ranked[0][0] == DOCUMENTS[0]
+    assert ranked[-1][1] == 0
+
+
+def test_shortlist_keeps_everything_without_a_signal() -> None:
+    index = BM25Index(DOCUMENTS, text=lambda document: document)
+    assert shortlist(index.ranked("completely unrelated"), top_k=2) == [doc for doc, _ in index.ranked("completely unrelated")]
+    assert len(shortlist(index.ranked("springy deck"), top_k=0)) == len(DOCUMENTS)
+
+
+def test_shortlist_cuts_to_top_k_with_margin() -> None:
+    ranked = [("a", 10.0), ("b", 8.0), ("c", 7.0), ("d", 1.0)]
+    assert shortlist(ranked, top_k=2, recall_margin=0.25) == ["a", "b", "c"]
+    assert shortlist(ranked, top_k=2, recall_margin=0.0) == ["a", "b"]
+
+
+def test_subtopic_shortlist_preserves_guideline_order() -> None:
+    issues = TopicTrainingModel(copilot="exterior_finishes", subtopic="siding").subtopic_issues
+    shortlisted = issues.shortlist("vinyl siding is buckling", top_k=3, recall_margin=0.0)
+    assert 3 <= len(shortlisted) < len(issues)
+    positions = [issues.issues.index(issue) for issue in shortlisted]
+    assert positions == sorted(positions)
+
+
+def test_confident_candidates() -> None:
+    issues = TopicTrainingModel(copilot="decking", subtopic="railings").subtopic_issues
+    flows = issues.ranked_flow_issues("railing is loose")
+    assert len({issue.associated_copilot_flow for issue, _ in flows}) == len(flows)
+    assert all(issue.associated_copilot_flow != "None" for issue, _ in flows)
+
+    small = issues.confident_candidates("railing is loose", max_issues=len(flows), dominance=0, max_answers=3)
+    assert [issue for issue, _ in flows] == small
+    assert issues.confident_candidates("railing", max_issues=1, dominance=0, max_answers=3) is None
+
+
+def test_confident_candidates_need_a_dominant_match() -> None:
+    issues = TopicTrainingModel(copilot="roof", subtopic="roof_general").subtopic_issues
+    query = "roof sheathing is wavy or appears bowed"
+    flows = issues.ranked_flow_issues(query)
+    assert flows[0][1] >= 2 * flows[1][1] > 0
+    dominant = issues.confident_candidates(query, max_issues=3, dominance=2.0, max_answers=3)
+    assert dominant == [issue for issue, _ in flows[:3]]
+    assert "sheathing" in dominant[0].observation.lower()
+
+    # Both match, neither dominates
+    close = issues.ranked_flow_issues("roof is bowed")
+    assert 0 < close[1][1] <= close[0][1] < 2 * close[1][1]
+    assert issues.confident_candidates("roof is bowed", max_issues=3, dominance=2.0, max_answers=3) is None
+
+    # One term hits one issue, every other flow scores 0: not confident, and no 0.0 answers
+    assert [score for _, score in issues.ranked_flow_issues("there is a crack")[1:3]] == [0.0, 0.0]
+    assert issues.confident_candidates("there is a crack", max_issues=3, dominance=2.0, max_answers=3) is None
+    partial = issues.confident_candidates("chimney cap crack", max_issues=3, dominance=2.0, max_answers=3)
+    assert len(partial) == 2 and "chimney" in partial[0].observation.lower()
+
+
+def test_fallback_candidates_rank_lexically() -> None:
+    issues = TopicTrainingModel(copilot="decking", subtopic="railings").subtopic_issues
+    flows = issues.ranked_flow_issues("railing is loose")
+    assert issues.fallback_candidates("railing is loose", max_answers=2) == [issue for issue, score in flows if score > 0][:2]
+    # Nothing matches: the first flows in guideline order
+    assert issues.fallback_candidates("zzz", max_answers=2) == [issue for issue, _ in issues.ranked_flow_issues(None)][:2]
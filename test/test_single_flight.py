@@ -0,0 +1,91 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from pydantic import BaseModel
+
+from models import AIResponseFormatModel
+from resources import AIResource
+from resources import structured_completions
+from resources.response_cache import ResponseCache
+from resources.single_flight import SingleFlight
+
+
+class Answer(BaseModel):
+    text: str
+
+
+def test_concurrent_identical_calls_share_one() -> None:
+    flight = SingleFlight("test")
+    calls = []
+
+    async def call() -> Answer:
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return Answer(text="Which door?")
+
+    async def run() -> list:
+        return await asyncio.gather(*(flight.do("door sticks", call) for _ in range(5)), flight.do("deck is bouncy", call))
+
+    results = asyncio.run(run())
+    assert len(calls) == 2
+    assert {result.text for result in results} == {"Which door?"}
+    assert len({id(result) for result in results}) == 6
+    assert flight.stats() == {"calls": 2, "coalesced": 4, "errors": 0, "in_flight": 0}
+
+
+def test_errors_reach_every_waiter() -> None:
+    flight = SingleFlight("test")
+
+    async def call() -> None:
+        await asyncio.sleep(0.01)
+        raise RuntimeError("429")
+
+    async def run() -> list:
+        return await asyncio.gather(*(flight.do("key", call) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert flight.stats()["errors"] == 1
+    with pytest.raises(RuntimeError):
+        asyncio.run(flight.do("key", call))
+
+
+def test_cancelled_caller_leaves_the_call_running() -> None:
+    flight = SingleFlight("test")
+
+    async def call() -> str:
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run() -> str:
+        first = asyncio.ensure_future(flight.do("key", call))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(flight.do("key", call))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == "done"
+    assert flight.calls == 1
+
+
+def test_ai_resource_coalesces_identical_requests(monkeypatch) -> None:
+    monkeypatch.setattr(structured_completions, "RESPONSE_CACHE", ResponseCache(name="test", path=""))
+    monkeypatch.setattr(structured_completions, "IN_FLIGHT", SingleFlight("test"))
+    calls = []
+
+    async def parse(**kwargs):
+        calls.append(kwargs)
+        await asyncio.sleep(0.05)
+        return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=SimpleNamespace(parsed=AIResponseFormatModel.model_construct()))])
+
+    resource = AIResource()
+    resource.connected = True
+    resource.chat_client = SimpleNamespace(beta=SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=parse))))
+
+    async def run() -> list:
+        return await asyncio.gather(*(resource.get_structured_response(user_prompt=["Door sticks"], system_prompt=["You classify door issues."]) for _ in range(4)))
+
+    asyncio.run(run())
+    assert len(calls) == 1
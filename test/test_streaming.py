@@ -0,0 +1,161 @@
+import asyncio
+import json
+
+import flask
+import httpx
+import pytest
+from openai import AsyncAzureOpenAI
+from starlette.applications import Starlette
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from asgi import to_response
+from google_cloud_functions.clarify_issue import main as clarify_issue_main
+from google_cloud_functions.dynamic_qna.main import ClarifyIssue
+from resources import AIResource
+from resources import structured_completions
+from resources.circuit_breaker import CircuitBreaker, CircuitOpenError
+from resources.deployments import AzureDeployment, DeploymentPool
+from resources.response_cache import ResponseCache
+from resources.streaming import EventStream, QuestionStreamTracker, sse_event, wsgi_response
+
+ANSWERS = [
+    {"answer_text": "Front door", "warrantable_certainty_modifier": None, "answer_index": 0, "associated_copilot_flow": "FrontDoor", "closest_matching_issue_number": 3},
+    {"answer_text": "Back door", "warrantable_certainty_modifier": None, "answer_index": 1, "associated_copilot_flow": "BackDoor", "closest_matching_issue_number": 4}]
+COMPLETION = json.dumps({
+    "issue_number": 3,
+    "builder_responsible": None,
+    "question_model": {"question_text": "Which door sticks?", "answer_set": ANSWERS, "user_answer": None, "closest_matching_issue_number": 3, "closest_matching_flow": None, "reason": "Two doors match."},
+    "correct_issue_certainty_score": 50,
+    "issue_warrantable_certainty_score": 50})
+
+
+def streamed_completion(request: httpx.Request) -> httpx.Response:
+    chunk = {"id": "c", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o"}
+    chunks = [dict(chunk, choices=[{"index": 0, "delta": {"content": COMPLETION[i:i + 9]}, "finish_reason": None}]) for i in range(0, len(COMPLETION), 9)]
+    chunks.append(dict(chunk, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+    chunks.append(dict(chunk, choices=[], usage={"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150}))
+    body = "".join("data: {}\n\n".format(json.dumps(item)) for item in chunks) + "data: [DONE]\n\n"
+    return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body.encode())
+
+
+def test_tracker_reports_fields_once_complete() -> None:
+    tracker = QuestionStreamTracker()
+    assert tracker.update({"question_model": {"question_text": "Which door"}}) == []
+    assert tracker.update({"question_model": {"question_text": "Which door sticks?", "answer_set": [ANSWERS[0]]}}) == [("question_text", "Which door sticks?")]
+    assert tracker.update({"question_model": {"question_text": "Which door sticks?", "answer_set": ANSWERS}}) == [("answer", ANSWERS[0])]
+    assert tracker.update({"question_model": {"question_text": "Which door sticks?", "answer_set": ANSWERS, "user_answer": None}}) == [("answer", ANSWERS[1])]
+    assert tracker.update({"question_model": {"question_text": "Which door sticks?", "answer_set": ANSWERS, "user_answer": None}}, final=True) == []
+
+
+def test_ai_resource_streams_partials_then_the_parsed_response(monkeypatch) -> None:
+    monkeypatch.setattr(structured_completions, "RESPONSE_CACHE", ResponseCache(name="test", path=""))
+    resource = AIResource()
+    resource.connected = True
+    resource.chat_client = AsyncAzureOpenAI(api_key="key", api_version="2024-10-21", azure_endpoint="https://example.openai.azure.com", http_client=httpx.AsyncClient(transport=httpx.MockTransport(streamed_completion)))
+
+    async def collect() -> list:
+        tracker = QuestionStreamTracker()
+        events = []
+        async for partial, parsed in resource.stream_structured_response(user_prompt=["door sticks"], system_prompt=["You classify door issues."]):
+            events.extend(name for name, _ in tracker.update(partial, final=parsed is not None))
+            if parsed is not None:
+                events.append(parsed.question_model.question_text)
+        return events
+
+    assert asyncio.run(collect()) == ["question_text", "answer", "answer", "Which door sticks?"]
+    # The streamed response was cached, a repeat is a single final item
+    assert asyncio.run(collect()) == ["question_text", "answer", "answer", "Which door sticks?"]
+    assert structured_completions.RESPONSE_CACHE.stats()["hits"] == 1
+
+
+def streaming_resource(transport: httpx.AsyncBaseTransport, breaker: CircuitBreaker, clock) -> AIResource:
+    resource = AIResource()
+    resource.connected = True
+    resource.chat_client = AsyncAzureOpenAI(api_key="key", api_version="2024-10-21", azure_endpoint="https://example.openai.azure.com", http_client=httpx.AsyncClient(transport=transport))
+    target = AzureDeployment(name="westus", endpoint="https://westus.openai.azure.com", deployment="gpt-4o", api_version="2024-10-21", api_key="key", primary=True)
+    resource.deployments = DeploymentPool([target], hedging=False, breaker=breaker, clock=clock)
+    return resource
+
+
+def test_breaker_times_the_first_chunk_not_the_consumer(monkeypatch) -> None:
+    monkeypatch.setattr(structured_completions, "RESPONSE_CACHE", ResponseCache(name="test", path=""))
+    now = [0.0]
+    breaker = CircuitBreaker("westus", enabled=True, window=1, min_calls=1, slow_call_sec=10, clock=lambda: now[0])
+    resource = streaming_resource(httpx.MockTransport(streamed_completion), breaker, lambda: now[0])
+
+    async def slow_consumer() -> None:
+        async for _ in resource.stream_structured_response(user_prompt=["door sticks"], system_prompt=["You classify door issues."]):
+            now[0] += 60
+
+    asyncio.run(slow_consumer())
+    assert breaker.closed and list(breaker.outcomes) == [False]
+
+
+class StalledTransport(httpx.AsyncBaseTransport):
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        async def body():
+            yield streamed_completion(request).content.split(b"\n\n")[0] + b"\n\n"
+            await asyncio.sleep(10)
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body())
+
+
+def test_stalled_stream_is_abandoned(monkeypatch) -> None:
+    monkeypatch.setattr(structured_completions, "RESPONSE_CACHE", ResponseCache(name="test", path=""))
+    breaker = CircuitBreaker("westus", enabled=True, call_timeout_sec=0.05)
+    resource = streaming_resource(StalledTransport(), breaker, breaker.clock)
+
+    async def consume() -> None:
+        async for _ in resource.stream_structured_response(user_prompt=["door sticks"], system_prompt=["You classify door issues."]):
+            pass
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(consume())
+    # The first chunk arrived in time, the stall isn't the breaker's to judge
+    assert list(breaker.outcomes) == [False]
+
+
+async def events():
+    yield sse_event("question_text", {"question_text": "Which door sticks?"})
+    yield sse_event("final", {"response": "OK"})
+
+
+def test_event_stream_over_asgi() -> None:
+    async def endpoint(request):
+        return to_response((EventStream(events()), 200, {"Cache-Control": "no-cache"}))
+
+    with TestClient(Starlette(routes=[Route("/", endpoint)])) as client:
+        res = client.get("/")
+    assert res.headers["content-type"].startswith("text/event-stream")
+    assert res.text == 'event: question_text\ndata: {"question_text": "Which door sticks?"}\n\nevent: final\ndata: {"response": "OK"}\n\n'
+
+
+def test_event_stream_over_wsgi() -> None:
+    app = flask.Flask(__name__)
+    app.add_url_rule("/", "stream", lambda: wsgi_response((EventStream(events()), 200, {"Content-Type": "text/event-stream"})))
+    res = app.test_client().get("/")
+    assert res.headers["Content-Type"] == "text/event-stream"
+    assert res.get_data(as_text=True).startswith("event: question_text\n")
+
+
+class UnavailableResource:
+    async def stream_structured_response(self, *args):
+        raise CircuitOpenError("primary", 30)
+        yield
+
+
+def test_both_endpoints_stream_through_one_generator() -> None:
+    assert ClarifyIssue.stream_copilot_question is clarify_issue_main.ClarifyIssueCreator.stream_copilot_question
+    clarify = ClarifyIssue(UnavailableResource(), copilot="decking", subtopic="boards")
+
+    async def collect(stream) -> list:
+        return [event.split("\n", 1)[0] async for event in stream]
+
+    # Nothing was sent before the circuit opened, the whole fallback question is
+    events = asyncio.run(collect(clarify.stream_conversation("boards are cracking")))
+    assert events[0] == "event: question_text" and events[-1] == "event: final"
+    assert events.count("event: answer") > 1
+
+    local = clarify.candidate_copilot_question(clarify.instructions_model.subtopic_issues.issues[:1])
+    events = asyncio.run(collect(clarify.stream_copilot_question("boards are cracking", prepare=lambda: local)))
+    assert events == ["event: question_text", "event: answer", "event: answer", "event: final"]
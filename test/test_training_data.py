@@ -0,0 +1,78 @@
+import json
+import os
+import pathlib
+
+from google_cloud_functions.dynamic_qna.models import TopicTrainingModel
+from google_cloud_functions.dynamic_qna.training_data import (
+    CompiledTrainingData,
+    JsonTrainingData,
+    TrainingDataStore,
+    compile_training_data,
+)
+
+
+def test_store_loads_once() -> None:
+    store = TrainingDataStore.shared()
+    assert store is TrainingDataStore.shared()
+    assert store.source() is store.source()
+    assert store.topic("Decking") is store.topic("decking")
+
+
+def test_topic_views_share_issues() -> None:
+    first = TopicTrainingModel(copilot="decking", subtopic="boards")
+    second = TopicTrainingModel(copilot="decking", subtopic="boards")
+    assert first.issues
+    assert len(first.issues) == len(second.issues)
+    assert all(a is b for a, b in zip(first.issues, second.issues))
+    assert all("boards" in issue.subtopics for issue in first.issues)
+    assert first.get_issues() is TrainingDataStore.shared().topic("decking").issues
+
+
+def test_topic_missing_optional_fields() -> None:
+    structural = TopicTrainingModel(copilot="structural", subtopic="")
+    assert structural.additional_topic_info == ""
+
+
+def test_compiled_artifact_matches_json(tmp_path: pathlib.Path) -> None:
+    artifact = compile_training_data(output_path=str(tmp_path / "training.bin"))
+    compiled = CompiledTrainingData(artifact)
+    parsed = JsonTrainingData()
+    assert compiled.copilots() == parsed.copilots()
+    for copilot in parsed.copilots():
+        assert compiled.topic(copilot) == parsed.topic(copilot)
+    assert compiled.topic("doors") is compiled.topic("doors")
+    boards = compiled.subtopic_positions("decking", "boards")
+    assert boards
+    assert all("boards" in compiled.topic("decking").issues[i].subtopics for i in boards)
+
+
+def test_store_prefers_current_artifact(tmp_path: pathlib.Path) -> None:
+    artifact = compile_training_data(output_path=str(tmp_path / "training.bin"))
+    store = TrainingDataStore(compiled_path=artifact)
+    assert isinstance(store.source(), CompiledTrainingData)
+    missing = TrainingDataStore(compiled_path=str(tmp_path / "missing.bin"))
+    assert isinstance(missing.source(), JsonTrainingData)
+
+
+def test_subtopic_index_lookups() -> None:
+    model = TopicTrainingModel(copilot="decking", subtopic="boards")
+    issues = model.subtopic_issues
+    assert issues is model.issue_index().subtopic("boards")
+    first = issues.flow_issues[0]
+    assert issues.by_issue_number[first.issue_number] is first
+    assert issues.by_flow[first.associated_copilot_flow].associated_copilot_flow == first.associated_copilot_flow
+    assert len(model.issue_index().subtopic("not_a_subtopic")) == 0
+
+
+def test_store_swaps_snapshot_on_change(tmp_path: pathlib.Path) -> None:
+    source = tmp_path / "training.json"
+    source.write_text(json.dumps({"decking": {"topic": "Decking", "topic_id": "a", "issues": []}}))
+    store = TrainingDataStore(file_path=str(source), compiled_path=str(tmp_path / "missing.bin"))
+    before = store.snapshot()
+    assert not store.refresh()
+
+    source.write_text(json.dumps({"decking": {"topic": "Decking", "topic_id": "b", "issues": []}}))
+    os.utime(source, ns=(before.version[0] + 1_000_000_000, before.version[0] + 1_000_000_000))
+    assert store.refresh()
+    assert store.topic("decking").topic_id == "b"
+    assert before.data.topic("decking").topic_id == "a"
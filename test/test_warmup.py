@@ -0,0 +1,38 @@
+import flask
+from flask.testing import FlaskClient
+
+from google_cloud_functions.clarify_issue import main as clarify_issue_main
+from google_cloud_functions.warmup import WARM_UP, WARMUP_FIRESTORE_ENVS, WarmUp, warm_training_data
+from utils.firestore_clients import FIRESTORE_CLIENTS
+
+
+def test_warm_up_runs_every_step_and_records_failures() -> None:
+    def broken() -> None:
+        raise RuntimeError("unreachable")
+
+    warm_up = WarmUp(steps=[("ok", lambda: 1), ("broken", broken)])
+    assert not warm_up.ready
+    warm_up.start()
+    assert warm_up.wait(timeout=5)
+    status = warm_up.status()
+    assert status["ready"]
+    assert status["steps"]["ok"]["ok"] and status["steps"]["ok"]["detail"] == 1
+    assert not status["steps"]["broken"]["ok"]
+    assert status["firestore_clients"] == FIRESTORE_CLIENTS.stats()
+
+
+def test_warm_training_data_builds_indexes() -> None:
+    warmed = warm_training_data()
+    assert warmed["copilots"] > 0 and warmed["subtopics"] > 0
+
+
+def test_firestore_topics_are_warmed_for_the_deployed_env() -> None:
+    assert WARMUP_FIRESTORE_ENVS == [clarify_issue_main.BUILD_ENV]
+    assert clarify_issue_main.EnvConfig(None).build_env.value.lower() == clarify_issue_main.BUILD_ENV
+
+
+def test_readyz_waits_for_warm_up(app: flask.app.Flask, client: FlaskClient) -> None:
+    assert not WARM_UP.ready
+    res = client.get("/readyz")
+    assert res.status_code == 503
+    assert "firestore_clients" in res.json
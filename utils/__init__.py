@@ -1,5 +1,7 @@
 from .logger import log
 from .build_env import BuildEnv, EnvConfig
 from .logging import logger
+from .snapshot import Snapshot, ReloadableSnapshot
+from .http import RequestData
 
-__all__ = ["log", "BuildEnv", "EnvConfig"]
\ No newline at end of file
+__all__ = ["log", "BuildEnv", "EnvConfig", "Snapshot", "ReloadableSnapshot", "RequestData"]
\ No newline at end of file
@@ -45,6 +45,7 @@ class EnvConfig:
         self.azure_ai_deployment_name = os.environ.get('AZURE_AI_AZURE_AI_DEPLOYMENT_NAME', 'gpt-4o')
         self.azure_ai_model_name = os.environ.get('AZURE_AI_MODEL_NAME', 'gpt-4o')
         self.azure_ai_version = os.environ.get('AZURE_AI_API_VERSION', '2024-10-21')
+        self.azure_ai_embedding_deployment_name = os.environ.get('AZURE_AI_EMBEDDING_DEPLOYMENT_NAME', 'text-embedding-3-small')
         self.firebase_prefix = self.build_env.value.lower() + "_"
         log(azure_ai_api_key=self.azure_ai_api_key)
         
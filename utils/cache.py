@@ -0,0 +1,177 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Generic, Hashable, Optional, Set, TypeVar
+import threading
+import time
+from .logger import log
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+# Background revalidation for every cache in the process, refreshes are short I/O bound loads
+_refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='cache-refresh')
+
+
+@dataclass
+class CacheEntry(Generic[V]):
+    value: V
+    stored_at: float
+    invalidated: bool = False
+
+
+class TTLCache(Generic[K, V]):
+    '''
+    Thread-safe LRU cache with a time to live and optional stale-while-revalidate.
+
+    - younger than `ttl`: served from memory
+    - older, but within `ttl + stale_ttl` (or invalidated): served stale while one background load replaces it
+    - past that, or missing: loaded on the caller's thread, concurrent callers for the same key wait for that one load
+
+    `max_entries` evicts the least recently used key. `ttl=None` never expires.
+    '''
+
+    def __init__(self, name: str, ttl: Optional[float] = None, stale_ttl: float = 0, max_entries: Optional[int] = None, clock: Callable[[], float] = time.monotonic) -> None:
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries: "OrderedDict[K, CacheEntry[V]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[K, threading.Lock] = {}
+        self._refreshing: Set[K] = set()
+        # Bumped by every `invalidate`, a refresh that loaded under an older generation doesn't clear the invalidation
+        self._generations: Dict[K, int] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _age(self, entry: CacheEntry[V]) -> float:
+        return self.clock() - entry.stored_at
+
+    def _is_fresh(self, entry: CacheEntry[V]) -> bool:
+        return not entry.invalidated and (self.ttl is None or self._age(entry) < self.ttl)
+
+    def _is_servable_stale(self, entry: CacheEntry[V]) -> bool:
+        if self.ttl is None:
+            return True
+        return self._age(entry) < self.ttl + self.stale_ttl
+
+    def peek(self, key: K) -> Optional[V]:
+        '''The cached value if it's fresh, without loading or counting.'''
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.value if entry and self._is_fresh(entry) else None
+
+    def lookup(self, key: K) -> Optional[V]:
+        '''The cached value if it's fresh, counted and marked as recently used, for callers that load asynchronously themselves.'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self._is_fresh(entry):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def get(self, key: K, load: Callable[[], V]) -> V:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._is_fresh(entry):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry.value
+                if self._is_servable_stale(entry):
+                    self._entries.move_to_end(key)
+                    self.stale_hits += 1
+                    self._schedule_refresh(key, load)
+                    return entry.value
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # Another caller may have finished the load while this one waited
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and self._is_fresh(entry):
+                    self.hits += 1
+                    return entry.value
+                self.misses += 1
+            value = load()
+            self.put(key, value)
+            return value
+
+    def put(self, key: K, value: V, stored_at: Optional[float] = None) -> None:
+        '''`stored_at` backdates the entry, e.g. when restoring one from disk, so it doesn't outlive its original TTL.'''
+        with self._lock:
+            self._store(key, value, self.clock() if stored_at is None else stored_at)
+
+    def _store(self, key: K, value: V, stored_at: float, invalidated: bool = False) -> None:
+        # Caller holds self._lock
+        self._entries[key] = CacheEntry(value=value, stored_at=stored_at, invalidated=invalidated)
+        self._entries.move_to_end(key)
+        while self.max_entries is not None and len(self._entries) > self.max_entries:
+            evicted_key, _ = self._entries.popitem(last=False)
+            self._load_locks.pop(evicted_key, None)
+            self._generations.pop(evicted_key, None)
+            self.evictions += 1
+
+    def invalidate(self, key: K) -> None:
+        '''
+        Marks the entry stale, the next read serves it once more and revalidates in the background.
+        A refresh already running when it's invalidated may have read the old data, it's loaded again once that one is done.
+        '''
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.invalidated = True
+
+    def discard(self, key: K) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generations.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+    def refresh(self, key: K, load: Callable[[], V]) -> None:
+        '''Reloads the key in the background, keeping the current value until the new one is ready.'''
+        with self._lock:
+            self._schedule_refresh(key, load)
+
+    def _schedule_refresh(self, key: K, load: Callable[[], V]) -> None:
+        # Caller holds self._lock
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        _refresh_executor.submit(self._refresh, key, load)
+
+    def _refresh(self, key: K, load: Callable[[], V]) -> None:
+        with self._lock:
+            generation = self._generations.get(key, 0)
+        try:
+            value = load()
+        except Exception as err:
+            # The stale value keeps being served until it ages out, then the next caller loads synchronously
+            log(cache_refresh_failed=self.name, key=key, error=err)
+            with self._lock:
+                self._refreshing.discard(key)
+            return
+        with self._lock:
+            superseded = self._generations.get(key, 0) != generation
+            # Invalidated while loading, the value may predate the change: store it still stale and load again
+            self._store(key, value, self.clock(), invalidated=superseded)
+            self._refreshing.discard(key)
+            if superseded:
+                self._schedule_refresh(key, load)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {'entries': len(self._entries), 'hits': self.hits, 'stale_hits': self.stale_hits, 'misses': self.misses, 'evictions': self.evictions}
@@ -0,0 +1,55 @@
+from typing import Any, Callable, Dict
+import threading
+from google.cloud import firestore
+from .logger import log
+
+
+class FirestoreClientRegistry:
+    '''
+    One Firestore client per project for the whole process.
+    A client owns a gRPC channel and its auth token, creating it per request paid for a new channel, token fetch and TLS handshake every time.
+    Clients are created on first use and are safe to share across request threads.
+    '''
+
+    def __init__(self, factory: Callable[[str], Any] = lambda project: firestore.Client(project=project)) -> None:
+        self._factory = factory
+        self._clients: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.created: Dict[str, int] = {}
+        self.reused: Dict[str, int] = {}
+
+    def client(self, project: str) -> firestore.Client:
+        found = self._clients.get(project)
+        if found is None:
+            with self._lock:
+                found = self._clients.get(project)
+                if found is None:
+                    found = self._factory(project)
+                    self._clients[project] = found
+                    self.created[project] = self.created.get(project, 0) + 1
+                    log(created_firestore_client=project)
+                    return found
+        with self._lock:
+            self.reused[project] = self.reused.get(project, 0) + 1
+        return found
+
+    def close(self) -> None:
+        '''Closes every client, the next call for a project opens a new channel.'''
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for project, client in clients.items():
+            try:
+                client.close()
+            except Exception as err:
+                log(firestore_client_close_failed=project, error=err)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {project: {'created': created, 'reused': self.reused.get(project, 0)} for project, created in self.created.items()}
+
+
+FIRESTORE_CLIENTS = FirestoreClientRegistry()
+
+
+def firestore_client(project: str) -> firestore.Client:
+    return FIRESTORE_CLIENTS.client(project)
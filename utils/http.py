@@ -0,0 +1,38 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+import json
+
+
+@dataclass
+class RequestData:
+    '''
+    What the endpoint handlers read from a request: method, query args, headers (lower-case names) and JSON body.
+    Detached from the server's request object so a handler can run on another thread or event loop,
+    and so the same handler serves both the Flask (WSGI) and Starlette (ASGI) apps.
+    '''
+    method: str
+    args: Dict[str, str] = field(default_factory=dict)
+    json: Any = None
+    headers: Dict[str, str] = field(default_factory=dict)
+    mode: Optional[str] = None
+
+    def get_json(self, silent: bool = False) -> Any:
+        return self.json
+
+    @property
+    def wants_event_stream(self) -> bool:
+        '''`?stream=1` or an `Accept: text/event-stream` header asks for a server-sent events response.'''
+        return self.args.get('stream', '').lower() in ('1', 'true') or 'text/event-stream' in self.headers.get('accept', '')
+
+    @classmethod
+    def from_flask(cls, request: Any) -> "RequestData":
+        return cls(method=request.method, args=request.args.to_dict(), json=request.get_json(silent=True), headers={name.lower(): value for name, value in request.headers.items()})
+
+    @classmethod
+    async def from_starlette(cls, request: Any) -> "RequestData":
+        body = await request.body()
+        try:
+            request_json = json.loads(body) if body else None
+        except ValueError:
+            request_json = None
+        return cls(method=request.method, args=dict(request.query_params), json=request_json, headers=dict(request.headers))
@@ -0,0 +1,146 @@
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Generic, Hashable, List, Optional, Set, Tuple, TypeVar
+import hashlib
+import os
+import random
+import re
+import threading
+from .retrieval import tokenize
+
+# Inputs whose word shingles overlap at least this much (Jaccard) are near-duplicates, 0 disables matching.
+# Low enough for paraphrases ("my deck feels bouncy" / "the deck is bouncy" is 2/3), inputs that differ in a
+# negation, direction or number never match whatever the overlap (see `contrast_terms`)
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get('NEAR_DUPLICATE_THRESHOLD', 0.6))
+# Words per shingle, user inputs are a handful of words so single words (after stop word removal) work best
+SHINGLE_SIZE = int(os.environ.get('SHINGLE_SIZE', 1))
+# 16 bands of 4 rows: pairs at ~0.5 similarity already share a band half the time, candidates are then verified exactly
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+# Words that flip or pin down an input's meaning while barely moving its Jaccard score ("door does not close",
+# "crack wider than 1/4 inch", "north wall"). Two inputs are only near-duplicates when they use the same ones
+NEGATIONS = frozenset(('not', 'no', 'never', 'nor', 'none', 'nothing', 'without', 'cannot', 'unable'))
+CONTRAST_WORDS = frozenset((
+    'north', 'south', 'east', 'west', 'left', 'right', 'front', 'back', 'rear', 'side', 'top', 'bottom', 'upper',
+    'lower', 'upstairs', 'downstairs', 'up', 'down', 'above', 'below', 'over', 'under', 'inside', 'outside',
+    'interior', 'exterior', 'first', 'second', 'third', 'hot', 'cold', 'warm', 'cool', 'open', 'opens', 'close',
+    'closes', 'closed', 'off', 'out', 'wet', 'dry', 'more', 'less', 'most', 'least', 'wider', 'narrower',
+    'larger', 'smaller', 'bigger', 'longer', 'shorter', 'higher', 'taller', 'deeper', 'shallower', 'thicker',
+    'thinner', 'louder', 'quieter', 'faster', 'slower', 'before', 'after', 'early', 'late', 'new', 'old'))
+_WORD_PATTERN = re.compile(r"[a-z0-9/.]+(?:'[a-z]+)?")
+
+K = TypeVar('K', bound=Hashable)
+
+
+def shingles(text: Optional[str], size: int = SHINGLE_SIZE) -> FrozenSet[str]:
+    tokens = tokenize(text)
+    if len(tokens) <= size:
+        return frozenset([' '.join(tokens)]) if tokens else frozenset()
+    return frozenset(' '.join(tokens[i:i + size]) for i in range(len(tokens) - size + 1))
+
+
+def contrast_terms(text: Optional[str]) -> FrozenSet[str]:
+    '''The negations, contrast words and numbers (e.g. '1/4') of `text`, none of which `shingles` can weigh.'''
+    terms = set()
+    for word in _WORD_PATTERN.findall((text or '').lower()):
+        word = word.strip('.')
+        if word in NEGATIONS or word.endswith("n't"):
+            terms.add('not')
+        elif word in CONTRAST_WORDS or any(character.isdigit() for character in word):
+            terms.add(word)
+    return frozenset(terms)
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class MinHasher:
+    '''MinHash signatures from `permutations` universal hash functions, seeded so signatures are comparable across processes.'''
+
+    def __init__(self, permutations: int = MINHASH_PERMUTATIONS, seed: int = 1) -> None:
+        generator = random.Random(seed)
+        self.permutations = [(generator.randrange(1, _MERSENNE_PRIME), generator.randrange(0, _MERSENNE_PRIME)) for _ in range(permutations)]
+
+    @staticmethod
+    def _hash(shingle: str) -> int:
+        return int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+
+    def signature(self, shingle_set: FrozenSet[str]) -> Tuple[int, ...]:
+        hashes = [self._hash(shingle) for shingle in shingle_set]
+        if not hashes:
+            return tuple(_MERSENNE_PRIME for _ in self.permutations)
+        return tuple(min((a * value + b) % _MERSENNE_PRIME for value in hashes) for a, b in self.permutations)
+
+
+class LSHIndex(Generic[K]):
+    '''
+    MinHash LSH over short texts. `add` indexes a text under a key, `query` returns the most similar indexed key
+    whose exact shingle Jaccard similarity reaches `threshold` and whose `contrast_terms` are the query's.
+    Past `max_entries` the oldest key is dropped.
+    '''
+
+    def __init__(self, threshold: float = NEAR_DUPLICATE_THRESHOLD, bands: int = MINHASH_BANDS, hasher: Optional[MinHasher] = None, max_entries: int = 1024) -> None:
+        self.threshold = threshold
+        self.hasher = hasher or MinHasher()
+        self.bands = bands
+        self.rows = len(self.hasher.permutations) // bands
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[K, Tuple[FrozenSet[str], FrozenSet[str], List[Tuple[int, ...]]]]" = OrderedDict()
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], Set[K]] = {}
+        self._lock = threading.Lock()
+
+    def _band_keys(self, signature: Tuple[int, ...]) -> List[Tuple[int, ...]]:
+        return [signature[band * self.rows:(band + 1) * self.rows] for band in range(self.bands)]
+
+    def add(self, key: K, text: Optional[str]) -> None:
+        shingle_set = shingles(text)
+        if not shingle_set:
+            return
+        bands = self._band_keys(self.hasher.signature(shingle_set))
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (shingle_set, contrast_terms(text), bands)
+            for band, band_key in enumerate(bands):
+                self._buckets.setdefault((band, band_key), set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: K) -> None:
+        # Caller holds self._lock
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for band, band_key in enumerate(entry[2]):
+            bucket = self._buckets.get((band, band_key))
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[(band, band_key)]
+
+    def remove(self, key: K) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def query(self, text: Optional[str]) -> Optional[Tuple[K, float]]:
+        shingle_set = shingles(text)
+        if not shingle_set or self.threshold <= 0:
+            return None
+        contrast = contrast_terms(text)
+        bands = self._band_keys(self.hasher.signature(shingle_set))
+        with self._lock:
+            candidates: Set[K] = set()
+            for band, band_key in enumerate(bands):
+                candidates.update(self._buckets.get((band, band_key), ()))
+            scored = [(key, jaccard(shingle_set, self._entries[key][0])) for key in candidates if self._entries[key][1] == contrast]
+        best = max(scored, key=lambda item: item[1], default=None)
+        if best is None or best[1] < self.threshold:
+            return None
+        return best
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,96 @@
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Mapping, Sequence, Tuple
+import os
+from .cache import TTLCache
+from .tokens import count_tokens
+
+# One template per (training data version, topic, subtopic, limit_request), the least recently used is dropped past this
+PROMPT_TEMPLATE_CACHE_SIZE = int(os.environ.get('PROMPT_TEMPLATE_CACHE_SIZE', 512))
+# 'compact' sends the \'topic_list\' as a table without empty fields, 'repr' sends str() of the item dicts as before
+TOPIC_LIST_FORMAT = os.environ.get('TOPIC_LIST_FORMAT', 'compact')
+TOPIC_LIST_COMPACT = TOPIC_LIST_FORMAT == 'compact'
+# 'prefix' sends the subtopic's whole \'topic_list\' and \'additional_topic_info\' in the system prompt, the same for every
+# input, so Azure can cache it (only prompts of 1024+ tokens are cached). 'shortlist' sends the input's shortlisted issues
+# after the task instructions instead: fewer prompt tokens, but only the instructions before them can be cached
+TOPIC_LIST_PLACEMENT = os.environ.get('TOPIC_LIST_PLACEMENT', 'prefix')
+TOPIC_LIST_IN_PREFIX = TOPIC_LIST_PLACEMENT == 'prefix'
+COLUMN_SEPARATOR = ' | '
+
+
+def _is_empty(value: Any) -> bool:
+    return value is None or value == '' or (isinstance(value, (list, tuple, set, dict)) and not value)
+
+
+def _cell(value: Any) -> str:
+    if _is_empty(value):
+        return ''
+    if isinstance(value, (list, tuple, set)):
+        value = ', '.join(str(item) for item in value)
+    return ' '.join(str(value).replace('|', '/').split())
+
+
+class CompiledTopicList:
+    '''
+    The \'topic_list\' items of one subtopic, each rendered and token counted once.
+    `render` joins any subset of them, e.g. a shortlist, into the text sent to the model.
+
+    Compact: a header naming the fields, then one issue per line. Fields that are empty for every issue are left out.
+    Otherwise: exactly the text `str()` of the item list would give.
+    '''
+
+    def __init__(self, issues: Sequence[Any], item: Callable[[Any], Any], compact: bool = TOPIC_LIST_COMPACT) -> None:
+        # Holding the issues keeps their ids unique for as long as the template lives
+        self.issues: Tuple[Any, ...] = tuple(issues)
+        self.compact = compact
+        items = [item(issue) for issue in self.issues]
+        if compact:
+            columns = list(dict.fromkeys(key for fields in items for key in fields))
+            self.columns = [column for column in columns if any(not _is_empty(fields.get(column)) for fields in items)]
+            self.header = COLUMN_SEPARATOR.join(self.columns)
+            rendered = [COLUMN_SEPARATOR.join(_cell(fields.get(column)) for column in self.columns) for fields in items]
+        else:
+            self.header = ''
+            rendered = [repr(fields) for fields in items]
+        self.fragments: Dict[int, str] = {id(issue): fragment for issue, fragment in zip(self.issues, rendered)}
+        self.tokens: Dict[int, int] = {id(issue): count_tokens(fragment + '\n') for issue, fragment in zip(self.issues, rendered)}
+        self.header_tokens = count_tokens(self.header)
+        self.full = self._join(self.issues)
+
+    @property
+    def description(self) -> str:
+        if not self.compact:
+            return ''
+        return ' (one issue per line, fields separated by \'{}\', the first line names the fields)'.format(COLUMN_SEPARATOR.strip())
+
+    def _join(self, issues: Sequence[Any]) -> str:
+        if self.compact:
+            return '\n'.join([self.header] + [self.fragments[id(issue)] for issue in issues])
+        return '[' + ', '.join(self.fragments[id(issue)] for issue in issues) + ']'
+
+    def render(self, issues: Sequence[Any]) -> str:
+        if len(issues) == len(self.issues):
+            return self.full
+        return self._join(issues)
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    '''The static instruction sets of one subtopic, rendered and token counted once. Only per request pieces are added on top.'''
+    topic_list: CompiledTopicList
+    sections: Mapping[str, Tuple[str, ...]]
+    section_tokens: Mapping[str, int] = field(init=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, 'section_tokens', {name: sum(count_tokens(line) for line in lines) for name, lines in self.sections.items()})
+
+    def section(self, name: str) -> List[str]:
+        '''A fresh list of the section's instructions, callers are free to add their per request instructions to it.'''
+        return list(self.sections[name])
+
+    def token_count(self, *names: str) -> int:
+        return sum(self.section_tokens[name] for name in names)
+
+
+def prompt_template_cache(name: str) -> TTLCache[Tuple, PromptTemplate]:
+    # Entries are keyed by the training data version, a reload simply stops hitting the old ones until they're evicted
+    return TTLCache(name=name, max_entries=PROMPT_TEMPLATE_CACHE_SIZE)
@@ -0,0 +1,90 @@
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+import math
+import os
+import re
+
+CANDIDATE_TOP_K = int(os.environ.get('CANDIDATE_TOP_K', 8)) # 0 sends every subtopic issue
+# Issues ranked past K are still kept while they score within this fraction of the K-th issue, up to 2K
+CANDIDATE_RECALL_MARGIN = float(os.environ.get('CANDIDATE_RECALL_MARGIN', 0.25))
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+STOP_WORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'from', 'has', 'have', 'i', 'in', 'is', 'it',
+    'its', 'me', 'my', 'of', 'on', 'or', 'our', 'so', 'that', 'the', 'their', 'there', 'this', 'to', 'was', 'we',
+    'were', 'when', 'with', 'you', 'your'))
+
+
+def tokenize(text: str | None) -> List[str]:
+    tokens = []
+    for token in TOKEN_PATTERN.findall((text or '').lower()):
+        if token in STOP_WORDS:
+            continue
+        # Light plural folding so 'doors' matches 'door' and 'stories' matches 'story'
+        if len(token) > 4 and token.endswith('ies'):
+            token = token[:-3] + 'y'
+        elif len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    '''
+    Okapi BM25 over a fixed list of documents, with the inverted index built up front.
+    Scoring a query only touches the postings of the query's terms.
+    '''
+
+    def __init__(self, documents: Sequence[Any], text: Callable[[Any], str | None], k1: float = 1.2, b: float = 0.75) -> None:
+        self.documents: Tuple[Any, ...] = tuple(documents)
+        self.k1 = k1
+        self.b = b
+        self.doc_lengths: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        for doc_id, document in enumerate(self.documents):
+            term_counts = Counter(tokenize(text(document)))
+            self.doc_lengths.append(sum(term_counts.values()))
+            for term, count in term_counts.items():
+                self.postings.setdefault(term, []).append((doc_id, count))
+        self.average_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+        document_count = len(self.documents)
+        self.idf: Dict[str, float] = {
+            term: math.log(1 + (document_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()}
+
+    def scores(self, query: str | None) -> List[float]:
+        scores = [0.0] * len(self.documents)
+        if not self.average_length:
+            return scores
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, count in self.postings[term]:
+                length_norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / self.average_length
+                scores[doc_id] += idf * count * (self.k1 + 1) / (count + self.k1 * length_norm)
+        return scores
+
+    def ranked(self, query: str | None) -> List[Tuple[Any, float]]:
+        '''Every document with its score, best first. Ties keep document order.'''
+        scores = self.scores(query)
+        order = sorted(range(len(self.documents)), key=lambda doc_id: -scores[doc_id])
+        return [(self.documents[doc_id], scores[doc_id]) for doc_id in order]
+
+
+def shortlist(ranked: Iterable[Tuple[Any, float]], top_k: int = CANDIDATE_TOP_K, recall_margin: float = CANDIDATE_RECALL_MARGIN) -> List[Any]:
+    '''
+    Cuts a best-first (document, score) ranking down to the prompt candidates.
+    Nothing is cut when K is disabled, the list already fits, or nothing matched at all,
+    since a zero-overlap query says nothing about which issues to drop.
+    '''
+    ranked = list(ranked)
+    if top_k <= 0 or len(ranked) <= top_k or not ranked[0][1]:
+        return [document for document, _ in ranked]
+    cutoff = ranked[top_k - 1][1] * (1 - recall_margin)
+    kept = ranked[:top_k]
+    for document, score in ranked[top_k:top_k * 2]:
+        if score <= 0 or score < cutoff:
+            break
+        kept.append((document, score))
+    return [document for document, _ in kept]
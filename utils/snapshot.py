@@ -0,0 +1,77 @@
+from dataclasses import dataclass, field
+from typing import Any, Callable, Generic, Optional, TypeVar
+import threading
+import time
+from .logger import log
+
+T = TypeVar('T')
+
+
+@dataclass(frozen=True)
+class Snapshot(Generic[T]):
+    '''One immutable build of some data. Requests hold on to the snapshot they started with.'''
+    version: Any
+    data: T
+    loaded_at: float = field(default_factory=time.time)
+
+
+class ReloadableSnapshot(Generic[T]):
+    '''
+    Holds the current Snapshot and rebuilds it when `version` reports something new.
+    The rebuild happens off to the side and is swapped in with a single reference assignment,
+    so in-flight requests keep reading the snapshot they already have.
+    '''
+
+    def __init__(self, name: str, load: Callable[[], T], version: Callable[[], Any], poll_interval: float = 0) -> None:
+        self.name = name
+        self._load = load
+        self._version = version
+        self.poll_interval = poll_interval
+        self._current: Optional[Snapshot[T]] = None
+        self._lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def get(self) -> Snapshot[T]:
+        current = self._current
+        if current is None:
+            with self._lock:
+                if self._current is None:
+                    self._current = self._build(self._version())
+                current = self._current
+            self.watch()
+        return current
+
+    def _build(self, version: Any) -> Snapshot[T]:
+        snapshot = Snapshot(version=version, data=self._load())
+        log(loaded_snapshot=self.name, version=version)
+        return snapshot
+
+    def refresh(self, force: bool = False) -> bool:
+        '''Rebuilds and swaps when the version changed, returns whether a swap happened.'''
+        with self._lock:
+            version = self._version()
+            if not force and self._current is not None and self._current.version == version:
+                return False
+            self._current = self._build(version)
+            return True
+
+    def watch(self) -> None:
+        '''Starts the background watcher once, a no-op when polling is disabled.'''
+        if self.poll_interval <= 0 or self._watcher is not None:
+            return
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name='snapshot-{}'.format(self.name), daemon=True)
+                self._watcher.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception as err:
+                # Keep serving the last good snapshot, a bad edit shouldn't take the topic down
+                log(snapshot_reload_failed=self.name, error=err)
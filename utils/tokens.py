@@ -0,0 +1,75 @@
+from dataclasses import dataclass
+from typing import Any, List, Optional, Sequence, Tuple
+import math
+import os
+import re
+from .logger import log
+
+# Input tokens allowed for the system prompt plus the user's input, 0 disables trimming
+PROMPT_TOKEN_BUDGET = int(os.environ.get('PROMPT_TOKEN_BUDGET', 6000))
+# Trimming never goes below this many \'topic_list\' candidates
+PROMPT_MIN_CANDIDATES = int(os.environ.get('PROMPT_MIN_CANDIDATES', 3))
+TOKEN_ENCODING = os.environ.get('TOKEN_ENCODING', 'o200k_base') # gpt-4o family
+
+# Fallback when tiktoken or its encoding file isn't available: words and punctuation count as a token each,
+# long words as one token per 4 characters, which lands within ~10% of o200k_base on English prompts
+_HEURISTIC_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+_encoding: Any = None
+_encoding_loaded = False
+
+
+def _load_encoding() -> Optional[Any]:
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception as err:
+            log(token_counter='heuristic', reason=err)
+        _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: Optional[str]) -> int:
+    if not text:
+        return 0
+    encoding = _load_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return sum(max(1, math.ceil(len(piece) / 4)) for piece in _HEURISTIC_PATTERN.findall(text))
+
+
+def counter_name() -> str:
+    return TOKEN_ENCODING if _load_encoding() is not None else 'heuristic'
+
+
+@dataclass(frozen=True)
+class BudgetFit:
+    kept: List[Any]
+    keep_optional: bool
+    tokens: int
+
+
+def fit_budget(fixed_tokens: int, candidates: Sequence[Tuple[Any, int]], optional_tokens: int = 0, budget: int = PROMPT_TOKEN_BUDGET, min_candidates: int = PROMPT_MIN_CANDIDATES) -> BudgetFit:
+    '''
+    Fits a prompt into `budget` tokens. `candidates` are (candidate, tokens) pairs best first, the lowest ranked are
+    dropped first down to `min_candidates`, then the optional section. Whatever still doesn't fit is sent as is.
+    '''
+    kept = list(candidates)
+    total = fixed_tokens + optional_tokens + sum(tokens for _, tokens in kept)
+    keep_optional = True
+    if budget > 0:
+        while total > budget and len(kept) > min_candidates:
+            total -= kept.pop()[1]
+        if total > budget and optional_tokens:
+            keep_optional = False
+            total -= optional_tokens
+        if len(kept) < len(candidates) or not keep_optional:
+            log(prompt_tokens=total, budget=budget, dropped_candidates=len(candidates) - len(kept), dropped_optional=not keep_optional)
+    return BudgetFit(kept=[candidate for candidate, _ in kept], keep_optional=keep_optional, tokens=total)
+
+
+if __name__ == '__main__':
+    # Build step: downloads the encoding into TIKTOKEN_CACHE_DIR so the container never fetches it at runtime
+    print(counter_name())